@@ -33,6 +33,28 @@ class NBXClient:
     os.makedirs(U.env.NBOX_HOME_DIR(), exist_ok=True)
     self.fp = join(U.env.NBOX_HOME_DIR(), "secrets.json")
 
+    local_backend = U.env.NBOX_LOCAL_BACKEND()
+    if local_backend:
+      # the stand-in backend does not need a login, keep its secrets apart so the real ones are never overwritten
+      self.fp = join(U.env.NBOX_HOME_DIR(), "secrets_local.json")
+      if os.path.exists(self.fp):
+        with open(self.fp, "r") as f:
+          self.secrets = json.load(f)
+      else:
+        self.secrets = {
+          "email": "local@localhost",
+          "access_token": "local",
+          "username": "local",
+          ConfigString.workspace_id.value: "local",
+          ConfigString.workspace_name.value: "local",
+          ConfigString.cache.value: {},
+        }
+      self.secrets["nbx_url"] = local_backend.rstrip("/")
+      with open(self.fp, "w") as f:
+        f.write(repr(self))
+      logger.debug(f"Using stand-in backend at {self.secrets['nbx_url']}")
+      return
+
     access_token = U.env.NBOX_USER_TOKEN("")
 
     # if this is the first time starting this then get things from the nbx-hq
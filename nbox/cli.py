@@ -41,6 +41,7 @@ from nbox.instance import Instance
 from nbox.sub_utils.ssh import tunnel
 from nbox.relics import RelicsNBX
 from nbox.lmao import LmaoCLI
+from nbox.sub_utils.cache import CacheManager
 from nbox.version import __version__ as V
 
 logger = U.get_logger()
@@ -116,9 +117,17 @@ def why():
   print("\nIf you like what we are building, come work with us.\n\nWith Love,\nNimbleBox.ai\n")
 
 
+def standin(root: str = "", url: str = "", workers: int = 8, jobs: dict = {}):
+  """Run the local stand-in backend, see ``nbox.standin.serve``"""
+  # imported here so the other commands do not load the stand-in services and grpc
+  from nbox.standin import serve
+  serve(root = root, url = url, workers = workers, jobs = jobs)
+
+
 def main():
   fire.Fire({
     "build"   : Instance,
+    "cache"   : CacheManager,
     "config"  : global_config,
     "get"     : get,
     "jobs"    : Job,
@@ -127,6 +136,7 @@ def main():
     "open"    : open_home,
     "relics"  : RelicsNBX,
     "serve"   : Serve,
+    "standin" : standin,
     "tunnel"  : tunnel,
     "version" : version,
     "why"     : why,
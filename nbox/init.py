@@ -30,6 +30,12 @@ def get_stub() -> WSJobServiceStub:
   """Create a gRPC stub with the NBX Webserver, this will initialise ``nbox_grpc_stub``
   object which is globally accesible as ``nbox.nbox_grpc_stub``. If you find yourself
   using this function, you might want to reconsider your design."""
+  if env.NBOX_LOCAL_BACKEND():
+    from nbox.standin import get_grpc_address
+    channel = grpc.insecure_channel(get_grpc_address(secret.get("nbx_url")))
+    logger.debug(f"Connected to stand-in backend at {secret.get('nbx_url')}")
+    return WSJobServiceStub(channel)
+
   token_cred = grpc.access_token_call_credentials(secret.get("access_token"))
   ssl_creds = grpc.ssl_channel_credentials()
   creds = grpc.composite_channel_credentials(ssl_creds, token_cred)
@@ -51,6 +57,10 @@ def create_webserver_subway(version: str = "v1", session: requests.Session = Non
   """
   _version_specific_url = secret.get("nbx_url") + f"/api/{version}"
   session = session if session != None else nbox_session # select correct session
+  if env.NBOX_LOCAL_BACKEND():
+    # the spec is static, so the stand-in does not have to be running when nbox is imported
+    from nbox.standin.jobs import OPENAPI_SPEC
+    return Sub30(_version_specific_url, OPENAPI_SPEC, session)
   r = session.get(_version_specific_url + "/openapi.json")
   try:
     r.raise_for_status()
@@ -102,7 +112,7 @@ def nbox_version_update():
       f"Fix: Update all the relevant requirements.txt files with nbox[serving]=={latest_version}"
     )
 
-if not env.NBOX_NO_CHECK_VERSION():
+if not (env.NBOX_NO_CHECK_VERSION() or env.NBOX_LOCAL_BACKEND()):
   nbox_version_update()
 
 logger.info(f"Current workspace id: {secret.get(ConfigString.workspace_id)} ({secret.get(ConfigString.workspace_name)})")
@@ -7,6 +7,7 @@ import os
 
 import nbox.utils as U
 from nbox import RelicsNBX
+from nbox.relics.ref import get_relic, pack, unpack_args
 from nbox.auth import secret, ConfigString
 from nbox import Operator, logger
 from nbox.utils import SimplerTimes
@@ -60,42 +61,7 @@ class NBXLet(Operator):
       run_tag = os.getenv("NBOX_RUN_METADATA", "")
       logger.info(f"Tag: {run_tag}")
 
-      # in the NimbleBox system we provide tags for each key which essentially tells what is the behaviour
-      # of the job. For example if it contains the string LMAO which means we need to initialise a couple
-      # of things, or this can be any other job type
-      from nbox.lmao import LMAO_JOB_TYPE_PREFIX, LMAO_RELIC_NAME, _lmaoConfig
-      if run_tag.startswith(LMAO_JOB_TYPE_PREFIX):
-        relic = RelicsNBX(LMAO_RELIC_NAME, workspace_id)
-        fp = run_tag[len(LMAO_JOB_TYPE_PREFIX)+1:] # +1 for the -
-        if not relic.has(fp+"/init.pkl"):
-          raise Exception(f"Could not find init.pkl for tag {run_tag}")
-        init_data = relic.get_object(fp+"/init.pkl")
-        _lmaoConfig.kv = init_data
-        args = _lmaoConfig.kv["args"]
-        kwargs = _lmaoConfig.kv["kwargs"]
-        logger.info(_lmaoConfig.kv)
-      else:
-        # check if there is a specific relic for this job
-        relic = RelicsNBX("cache", workspace_id)
-        _in = f"{job_id}/args_kwargs"
-        if run_tag:
-          _in += f"_{run_tag}"
-        if relic.has(_in):
-          (args, kwargs) = relic.get_object(_in)
-        else:
-          args, kwargs = (), {}
-
-      # call the damn thing
-      out = self.op(*args, **kwargs)
-
-      # save the output to the relevant place
-      if run_tag.startswith(LMAO_JOB_TYPE_PREFIX):
-        _out = fp+"/return.pkl"
-      else:
-        _out = f"{job_id}/return"
-        if run_tag:
-          _out += f"_{run_tag}"
-      relic.put_object(_out, out)
+      self.run_job(job_id, workspace_id, run_tag)
 
       # last step mark as completed
       status = Job.Status.COMPLETED
@@ -112,6 +78,48 @@ class NBXLet(Operator):
         )
       U._exit_program()
 
+  def run_job(self, job_id: str, workspace_id: str, run_tag: str = ""):
+    """Read the arguments of this run from relics, call the operator and write the return value back, this is the
+    part of ``run`` that does not talk to the jobs service or exit the process."""
+    # in the NimbleBox system we provide tags for each key which essentially tells what is the behaviour
+    # of the job. For example if it contains the string LMAO which means we need to initialise a couple
+    # of things, or this can be any other job type
+    from nbox.lmao import LMAO_JOB_TYPE_PREFIX, LMAO_RELIC_NAME, _lmaoConfig
+    if run_tag.startswith(LMAO_JOB_TYPE_PREFIX):
+      relic = RelicsNBX(LMAO_RELIC_NAME, workspace_id)
+      fp = run_tag[len(LMAO_JOB_TYPE_PREFIX)+1:] # +1 for the -
+      if not relic.has(fp+"/init.pkl"):
+        raise Exception(f"Could not find init.pkl for tag {run_tag}")
+      init_data = relic.get_object(fp+"/init.pkl")
+      _lmaoConfig.kv = init_data
+      args = _lmaoConfig.kv["args"]
+      kwargs = _lmaoConfig.kv["kwargs"]
+      logger.info(_lmaoConfig.kv)
+    else:
+      # check if there is a specific relic for this job
+      relic = get_relic("cache", workspace_id, tiered = True)
+      _in = f"{job_id}/args_kwargs"
+      if run_tag:
+        _in += f"_{run_tag}"
+      if relic.has(_in):
+        # the arguments can be references to the objects in relics, load them
+        (args, kwargs) = unpack_args(*relic.get_object(_in), relic = relic)
+      else:
+        args, kwargs = (), {}
+
+    # call the damn thing
+    out = self.op(*args, **kwargs)
+
+    # save the output to the relevant place
+    if run_tag.startswith(LMAO_JOB_TYPE_PREFIX):
+      _out = fp+"/return.pkl"
+    else:
+      _out = f"{job_id}/return"
+      if run_tag:
+        _out += f"_{run_tag}"
+      out = pack(relic, out)
+    relic.put_object(_out, out)
+
   def serve(self, host: str = "0.0.0.0", port: int = 8000, *, model_name: str = None):
     """Run a serving API endpoint"""
     try:
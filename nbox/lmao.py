@@ -23,14 +23,19 @@ import re
 import sys
 import time
 import shlex
+import shutil
+import asyncio
+import numbers
 import zipfile
 import threading
-from queue import Queue, Empty
+from uuid import uuid4
 from git import Repo
 from json import dumps, load
 from requests import Session
+from requests.exceptions import ConnectionError, Timeout
 from typing import Dict, Any, List, Optional, Union, Tuple
 from subprocess import Popen, PIPE
+from concurrent.futures import Future, ThreadPoolExecutor, wait
 from google.protobuf.field_mask_pb2 import FieldMask
 
 try:
@@ -44,6 +49,16 @@ try:
 except ImportError:
   starlette = None
 
+try:
+  import numpy as np
+except ImportError:
+  np = None
+
+try:
+  import fcntl
+except ImportError:
+  fcntl = None
+
 
 import nbox.utils as U
 from nbox import Instance
@@ -51,6 +66,7 @@ from nbox.utils import logger, SimplerTimes
 from nbox.auth import secret, ConfigString
 from nbox.nbxlib.tracer import Tracer
 from nbox.relics import RelicsNBX
+from nbox.relics.cp import copy as relics_copy, RELIC_SCHEME
 from nbox.jobs import Job, Resource
 from nbox.init import nbox_grpc_stub
 from nbox.messages import message_to_dict
@@ -60,7 +76,7 @@ from nbox.hyperloop.job_pb2 import Job as JobProto
 # all the sublime -> hyperloop stuff
 from nbox.sublime.lmao_client import LMAO_Stub # main stub class
 from nbox.sublime.lmao_client import (
-  Record, File, FileList, AgentDetails, RunLog, Run, InitRunRequest, ListProjectsRequest, RelicFile
+  Record, RecordColumn, File, FileList, AgentDetails, RunLog, Run, InitRunRequest, ListProjectsRequest, RelicFile
 )
 from nbox.sublime.lmao_client import (
   Serving, LogBuffer, ServingHTTPLog
@@ -68,6 +84,11 @@ from nbox.sublime.lmao_client import (
 
 
 from nbox.observability.system import SystemMetricsLogger
+from nbox.observability.shipper import RunLogShipper, ServingLogShipper
+from nbox.observability.sketch import DDSketch
+from nbox.observability.policy import LogPolicy, PolicyRouter
+from nbox.observability.wal import RunLogWAL, WALUploader, OFFLINE_PREFIX, list_wals
+from nbox.sublime._yql.common import message_to_b64
 
 DEBUG_LOG_EVERY = 100
 INFO_LOG_EVERY = 100
@@ -76,8 +97,26 @@ INFO_LOG_EVERY = 100
 functional components of LMAO
 """
 
+# seconds after which a call to the monitoring instance is given up
+LMAO_RPC_TIMEOUT = 10.0
+
+
+class _LmaoSession(Session):
+  """``Session`` with a timeout on every request where the 5xx responses raise ``ConnectionError``, so a monitoring
+  instance that hangs or fails looks the same as one that cannot be reached: the run goes offline and the WAL retries"""
+  def request(self, *args, **kwargs):
+    kwargs.setdefault("timeout", LMAO_RPC_TIMEOUT)
+    r = super().request(*args, **kwargs)
+    if r.status_code >= 500 and r.status_code != 501:
+      raise ConnectionError(f"{r.status_code} from {r.url}")
+    return r
+
+
 @lru_cache()
 def get_lmao_stub(username: str, workspace_id: str):
+  if U.env.NBOX_LOCAL_BACKEND():
+    return LMAO_Stub(url = secret.get("nbx_url") + "/lmao", session = _LmaoSession())
+
   # prepare the URL
   id_or_name = f"monitoring-{workspace_id}"
   logger.info(f"Instance id_or_name: {id_or_name}")
@@ -94,7 +133,7 @@ def get_lmao_stub(username: str, workspace_id: str):
   logger.debug(f"URL: {url}")
 
   # create a session with the auth header
-  _session = Session()
+  _session = _LmaoSession()
   _session.headers.update({
     "NBX-TOKEN": open_data["token"],
     "X-NBX-USERNAME": username,
@@ -123,6 +162,81 @@ def get_record(k: str, v: Union[int, float, str]) -> Record:
     record.string_data.append(v)
   return record
 
+def get_record_column(k: str, values, steps) -> RecordColumn:
+  """Create a RecordColumn with one row per value, ``values[i]`` is logged at ``steps[i]``. The type is decided once for
+  the column from the numpy dtype (or the first value if numpy is not installed)."""
+  if np is not None:
+    values = np.asarray(values)
+    kind = values.dtype.kind
+    if kind not in "fiub":
+      kind = "U" if kind in "USO" else None
+    values = values.tolist()
+    steps = np.asarray(steps).tolist()
+  else:
+    values = list(values)
+    _tv = type(values[0]) if values else float
+    kind = {float: "f", int: "i", bool: "b", str: "U"}.get(_tv)
+  if kind is None:
+    raise ValueError(f"[key = {k}] cannot log values of this type, use int, float or str")
+
+  # rows are messages, so there is no bulk extend like for the repeated numbers, add them from python lists
+  column = RecordColumn(key = k)
+  add = column.rows.add
+  if kind == "f":
+    column.value_type = RecordColumn.DataType.FLOAT
+    for x, v in zip(steps, values):
+      add(x = x, float_data = v)
+  elif kind == "U":
+    column.value_type = RecordColumn.DataType.STRING
+    for x, v in zip(steps, values):
+      add(x = x, string_data = str(v))
+  else:
+    column.value_type = RecordColumn.DataType.INTEGER
+    for x, v in zip(steps, values):
+      add(x = x, integer_data = v)
+  return column
+
+# ioctl to clone a file on copy-on-write filesystems (btrfs, xfs), from linux/fs.h
+_FICLONE = 0x40049409
+
+def snapshot_file(src: str, dst: str):
+  """Copy ``src`` to ``dst`` so that later writes to ``src`` do not change ``dst``. On copy-on-write filesystems this
+  is a reflink that shares the blocks, otherwise a normal copy. A hard link is not used since ``torch.save`` and most
+  writers truncate the same inode."""
+  os.makedirs(os.path.dirname(dst) or ".", exist_ok = True)
+  if fcntl is not None:
+    try:
+      with open(src, "rb") as fs, open(dst, "wb") as fd:
+        fcntl.ioctl(fd.fileno(), _FICLONE, fs.fileno())
+      shutil.copystat(src, dst)
+      return
+    except OSError:
+      pass
+  shutil.copy2(src, dst)
+
+def move_offline_files(wal: RunLogWAL, lmao: LMAO_Stub, names: List[str]) -> bool:
+  """``on_files`` of the LMAO WALs: the files saved while the run was offline are in the relic folder of the local ID,
+  once the run has its real ID move them to its folder and list them in the LMAO DB."""
+  old_id, new_id = wal.experiment_id, wal.meta["experiment_id"]
+  if old_id.startswith(OFFLINE_PREFIX) and new_id.startswith(OFFLINE_PREFIX):
+    return False # not yet created on the server
+  if wal.meta["save_to_relic"] and old_id != new_id:
+    project_name, workspace_id = wal.meta["project_name"], wal.meta["workspace_id"]
+    relics_copy(
+      f"{RELIC_SCHEME}{LMAO_RELIC_NAME}/{project_name}/{old_id}",
+      f"{RELIC_SCHEME}{LMAO_RELIC_NAME}/{project_name}/{new_id}",
+      recursive = True,
+      workspace_id = workspace_id,
+    )
+    old = RelicsNBX(LMAO_RELIC_NAME, workspace_id, prefix = f"{project_name}/{old_id}", cache = False)
+    for name in names:
+      old.rm(name)
+  fl = FileList(experiment_id = new_id)
+  fl.files.extend([File(relic_file = RelicFile(name = x)) for x in names])
+  ack = lmao.on_save(_FileList = fl)
+  return ack is not None and ack.success
+
+
 def get_git_details(folder):
   """If there is a .git folder in the folder, return some details for that."""
   repo = Repo(folder)
@@ -203,6 +317,9 @@ class _lmaoConfig:
 
 
 class Lmao():
+  # seconds that ``end`` waits for the WAL to be sent, the rest is left for ``nbx lmao sync``
+  end_timeout = 30.0
+
   def __init__(
     self,
     project_name: Optional[str] = "",
@@ -212,12 +329,28 @@ class Lmao():
     save_to_relic: bool = False,
     enable_system_monitoring: bool = False,
     workspace_id: str = "",
+    *,
+    max_queue: int = 100_000,
+    flush_every: float = 1.0,
+    backpressure: str = "block",
+    wal: bool = True,
+    log_policy: Optional[Dict[str, LogPolicy]] = None,
   ) -> None:
     """``Lmao`` is the client library for using NimbleBox Monitoring. It talks to your monitoring instance running on your build
     and stores the information in the ``project_name`` or ``project_id``. This object inherently doesn't care what you are actually
     logging and rather concerns itself with ensuring storage.
     
-    All arguments are optional, if the _lmaoConfig is set"""
+    All arguments are optional, if the _lmaoConfig is set. ``log`` does not wait for the server, the records are queued and
+    sent in batches from a background thread (see ``nbox.observability.shipper``), ``max_queue`` is the number of records
+    that can wait, ``flush_every`` is the longest they wait in seconds and ``backpressure`` is what happens when the queue
+    is full: ``"block"``, ``"drop_oldest"`` or ``"sample"``.
+
+    With ``wal`` (default) the batches are written to a local write-ahead log and uploaded from there (see
+    ``nbox.observability.wal``), if the monitoring instance cannot be reached the run continues offline and the logs
+    can be pushed later with ``nbx lmao sync``.
+
+    ``log_policy`` maps key prefixes to a ``LogPolicy`` that decides which of the numbers logged under them are sent
+    (every n-th, throttled, downsampled per window), see ``nbox.observability.policy`` and ``set_log_policy``."""
 
     self.config = _lmaoConfig.kv
 
@@ -249,6 +382,16 @@ class Lmao():
     self.system_monitoring: SystemMetricsLogger = None
     self._nbx_run_id = None
     self._nbx_job_id = None
+    self._shipper: RunLogShipper = None
+    self._shipper_config = {"max_queue": max_queue, "flush_every": flush_every, "backpressure": backpressure}
+    self._use_wal = wal
+    self._wal: RunLogWAL = None
+    self._uploader: WALUploader = None
+    self._distributions: Dict[str, Tuple[int, DDSketch, int]] = {} # key: (step, sketch, log_type) not yet sent
+    self._distributions_lock = threading.Lock()
+    self._upload_pool: ThreadPoolExecutor = None
+    self._uploads: List[Future] = []
+    self._policy = PolicyRouter(log_policy)
 
     # create connection and initialise the run
     self._init(project_name, project_id, config = metadata)
@@ -256,6 +399,12 @@ class Lmao():
   def __del__(self):
     if self.system_monitoring is not None:
       self.system_monitoring.stop()
+    if self._shipper is not None:
+      self._shipper.close()
+    if self._uploader is not None:
+      self._uploader.stop()
+    if self._wal is not None:
+      self._wal.close()
 
   def _get_name_id(self, project_id: str = None, project_name: str = None):
     all_projects = self.lmao.list_projects(
@@ -302,22 +451,6 @@ class Lmao():
       secret.put("username", self.tracer.job_proto.auth_info.username)
       self.username = secret.get("username")
 
-    self.lmao = get_lmao_stub(self.username, self.workspace_id)
-
-    # do a quick lookup and see if the project exists, if not, create it
-    if self.config:
-      project_id = self.config["project_id"]
-      project_name = self.config["project_name"]
-    else:
-      if project_id:
-        project_id, project_name = self._get_name_id(project_id=project_id)
-        if not project_id:
-          raise Exception(f"Project with id {project_id} not found, please create a new one with project_name")
-      else:
-        project_id, project_name = self._get_name_id(project_name=project_name)
-        if not project_id:
-          logger.info(f"Project '{project_name}' not found, create one from dashboard.")
-
     # this is the config value that is used to store data on the plaform, user cannot be allowed to have
     # like a full access to config values
     log_config: Dict[str, Any] = {
@@ -337,28 +470,63 @@ class Lmao():
       nbx_run_id = self._nbx_run_id or "fake_run",
     )
 
-    run_details = self.lmao.get_run_details(Run(
-      experiment_id = _lmaoConfig.kv["experiment_id"],
-    ))
-    if run_details.experiment_id:
-      # means that this run already exists so we need to make an update call
-      ack = self.lmao.update_run_status(Run(
-        experiment_id = run_details.experiment_id,
-        agent = self._agent_details,
+    self.lmao = None
+    offline_init = None
+    try:
+      self.lmao = get_lmao_stub(self.username, self.workspace_id)
+
+      # do a quick lookup and see if the project exists, if not, create it
+      if self.config:
+        project_id = self.config["project_id"]
+        project_name = self.config["project_name"]
+      else:
+        if project_id:
+          project_id, project_name = self._get_name_id(project_id=project_id)
+          if not project_id:
+            raise Exception(f"Project with id {project_id} not found, please create a new one with project_name")
+        else:
+          project_id, project_name = self._get_name_id(project_name=project_name)
+          if not project_id:
+            logger.info(f"Project '{project_name}' not found, create one from dashboard.")
+
+      run_details = self.lmao.get_run_details(Run(
+        experiment_id = _lmaoConfig.kv["experiment_id"],
       ))
-      if not ack.success:
-        raise Exception(f"Failed to update run status!")
-    else:
-      # check if there is a lmao run existing for this project_id
-      run_details = self.lmao.init_run(
-        _InitRunRequest = InitRunRequest(
-          agent_details=self._agent_details,
+      if run_details.experiment_id:
+        # means that this run already exists so we need to make an update call
+        ack = self.lmao.update_run_status(Run(
+          experiment_id = run_details.experiment_id,
+          agent = self._agent_details,
+        ))
+        if not ack.success:
+          raise Exception(f"Failed to update run status!")
+      else:
+        # check if there is a lmao run existing for this project_id
+        run_details = self.lmao.init_run(
+          _InitRunRequest = InitRunRequest(
+            agent_details=self._agent_details,
+            created_at = SimplerTimes.get_now_i64(),
+            project_name = project_name,
+            project_id = project_id,
+            config = dumps(log_config),
+          )
+        )
+    except Exception as e:
+      # the instance is not there or cannot be reached, everything else is a real error
+      if not self._use_wal or not (self.lmao is None or isinstance(e, (ConnectionError, Timeout))):
+        raise e
+      logger.warning(f"Could not reach the monitoring instance, continuing offline: {e}")
+      self.lmao = None
+      run_details = Run(experiment_id = _lmaoConfig.kv.get("experiment_id") or OFFLINE_PREFIX + uuid4().hex[:16])
+      if not _lmaoConfig.kv.get("experiment_id"):
+        # the run is created on the server by the sync
+        offline_init = InitRunRequest(
+          agent_details = self._agent_details,
           created_at = SimplerTimes.get_now_i64(),
           project_name = project_name,
           project_id = project_id,
           config = dumps(log_config),
         )
-      )
 
     if not run_details:
       # TODO: Make a custom exception of this
@@ -374,6 +542,26 @@ class Lmao():
     logger.info(f"      id: {self.run.experiment_id}")
     logger.info(f"    link: https://app.nimblebox.ai/workspace/{self.workspace_id}/monitoring/{self.project_id}/{self.run.experiment_id}")
 
+    # all the logs go through the shipper, with the WAL it writes to the disk and the uploader sends from there
+    send = self._send_run_log
+    if self._use_wal:
+      meta = {
+        "username": self.username,
+        "workspace_id": self.workspace_id,
+        "project_name": self.project_name,
+        "save_to_relic": self.save_to_relic,
+      }
+      if offline_init is not None:
+        meta["init"] = message_to_b64(offline_init)
+      self._wal = RunLogWAL(self.run.experiment_id, meta, on_files = move_offline_files)
+      if not self._wal.acquire():
+        raise Exception(f"Run {self.run.experiment_id} is being logged by another process")
+      if self._wal.pending:
+        logger.info(f"Resuming with {self._wal.pending} bytes of logs not yet sent")
+      self._uploader = WALUploader(self._wal, self._get_stub, every = self._shipper_config["flush_every"])
+      send = self._wal.append
+    self._shipper = RunLogShipper(send, self.run.experiment_id, **self._shipper_config)
+
     # now initialize the relic
     if self.save_to_relic:
       # The relic will be the project id
@@ -387,15 +575,39 @@ class Lmao():
 
   @property
   def experiment_prefix(self):
+    self._refresh_run_id()
     prefix = f"{self.project_name}/{self.run.experiment_id}/"
     return prefix
 
+  def _refresh_run_id(self):
+    """A run started offline gets its real ID when the WAL is synced, switch to it"""
+    if self._wal is not None and self._wal.meta["experiment_id"] != self.run.experiment_id:
+      logger.info(f"Run {self.run.experiment_id} is now {self._wal.meta['experiment_id']}")
+      self.run.experiment_id = self._wal.meta["experiment_id"]
+
+  def _get_stub(self) -> LMAO_Stub:
+    if self.lmao is None:
+      self.lmao = get_lmao_stub(self.username, self.workspace_id)
+    return self.lmao
+
+  def _send_run_log(self, run_log: RunLog) -> bool:
+    ack = self.lmao.on_log(_RunLog = run_log)
+    if ack is None or not ack.success:
+      for l in (ack.message if ack is not None else "no response").splitlines():
+        logger.error("  " + l)
+      return False
+    return True
+
   """The functions below are the ones supposed to be used."""
 
-  @lru_cache(maxsize=1)
   def get_relic(self):
     """Get the underlying Relic for more advanced usage patterns."""
-    return RelicsNBX("experiments", self.workspace_id, create = True, prefix = f"{self.project_name}/{self.run.experiment_id}")
+    self._refresh_run_id()
+    return self._get_relic(self.run.experiment_id)
+
+  @lru_cache(maxsize=1)
+  def _get_relic(self, experiment_id: str):
+    return RelicsNBX("experiments", self.workspace_id, create = True, prefix = f"{self.project_name}/{experiment_id}")
 
   def log(self, y: Dict[str, Union[int, float, str]], step = None, *, log_type: str = RunLog.LogType.USER):
     """Log a single level dictionary to the platform at any given step. This function does not really care about the
@@ -411,22 +623,140 @@ class Lmao():
     step = step if step is not None else SimplerTimes.get_now_i64()
     if step < 0:
       raise Exception("Step must be <= 0")
-    run_log = RunLog(experiment_id = self.run.experiment_id, log_type=log_type)
+    records = []
     for k,v in y.items():
-      record = get_record(k, v)
-      record.step = step
-      run_log.data.append(record)
+      if isinstance(v, numbers.Real) and not isinstance(v, bool):
+        # numpy and torch scalars are sent as the python numbers
+        v = int(v) if isinstance(v, numbers.Integral) else float(v)
+      if self._policy and type(v) in (int, float):
+        points = self._policy.offer(k, step, v, log_type)
+      else:
+        points = [(step, v)]
+      for s, v in points:
+        record = get_record(k, v)
+        record.step = s
+        records.append(record)
+    if records:
+      self._shipper.put(records, log_type)
+    self._total_logged_elements += 1
 
-    ack = self.lmao.on_log(_RunLog = run_log)
-    if not ack.success:
-      logger.error("  >> Server Error")
-      for l in ack.message.splitlines():
-        logger.error("  " + l)
-      raise Exception("Server Error")
+  def set_log_policy(self, prefix: str, policy: LogPolicy):
+    """Set the ``LogPolicy`` of all the keys starting with ``prefix``, the longest matching prefix is used and ``""``
+    matches every key. For example to keep 100 points of every 1000 steps of the gradient norms, with the spikes:
+
+    .. code-block:: python
+
+      lmao.set_log_policy("grad_norm/", LogPolicy(max_points = 100, window = 1000, anomaly_z = 4))
+    """
+    self._flush_policy()
+    self._policy.set(prefix, policy)
+
+  def _flush_policy(self):
+    for k, (log_type, points) in self._policy.flush().items():
+      records = []
+      for s, v in points:
+        record = get_record(k, v)
+        record.step = s
+        records.append(record)
+      self._shipper.put(records, log_type)
+
+  def log_many(self, y: Dict[str, Any], steps = None, *, log_type: str = RunLog.LogType.USER):
+    """Log whole arrays in one call, ``y[key][i]`` is the value at ``steps[i]``. ``y`` can be a dict of numpy arrays (or lists)
+    or a ``pandas.DataFrame``, by default the steps are ``0, 1, 2, ...``. Each key is sent as a ``RecordColumn`` so
+    back-filling a million points is one call and a few requests, not a million."""
+    if self.completed:
+      raise Exception("Run already completed, cannot log more data!")
+    columns = {k: v for k, v in y.items()}
+    lengths = set(len(v) for v in columns.values())
+    if len(lengths) > 1:
+      raise ValueError(f"All the values should have the same length, got: { {k: len(v) for k, v in columns.items()} }")
+    n = lengths.pop() if lengths else 0
+    steps = list(range(n)) if steps is None else (steps.tolist() if hasattr(steps, "tolist") else list(steps))
+    if len(steps) != n:
+      raise ValueError(f"Got {len(steps)} steps for {n} values")
+    if n and min(steps) < 0:
+      raise Exception("Step must be >= 0")
+
+    # chunks of the batch size so that a single request does not get too large
+    chunk = self._shipper.batch_size
+    for k, v in columns.items():
+      for i in range(0, n, chunk):
+        self._shipper.put([], log_type, [get_record_column(k, v[i:i + chunk], steps[i:i + chunk])])
+    self._total_logged_elements += n
+
+  def log_distribution(
+    self,
+    key: str,
+    values,
+    step = None,
+    *,
+    relative_accuracy: float = 0.01,
+    log_type: str = RunLog.LogType.USER,
+  ):
+    """Log the distribution of many values (ex. per sample losses or gradient norms of a batch) without sending them.
+    The values go into a ``DDSketch`` for this key and step, all the calls with the same step are merged and the sketch
+    is sent once the key is logged at another step (or on ``flush`` / ``end``). The server gets the count, sum, min,
+    max, p50, p90, p99 and the buckets under ``{key}/...``, see ``nbox.observability.sketch``. NaN and infinite values
+    (ex. an exploding gradient norm) do not go in the buckets, they are counted in ``{key}/non_finite``.
 
+    Args:
+      key (str): Name of the distribution
+      values: Numbers, a list or a numpy array of any shape
+      step (int, optional): Defaults to the current time in seconds, so the distribution is per second
+      relative_accuracy (float, optional): Quantiles are within this fraction of the true value
+    """
+    if self.completed:
+      raise Exception("Run already completed, cannot log more data!")
+    step = step if step is not None else SimplerTimes.get_now_i64()
+    if step < 0:
+      raise Exception("Step must be >= 0")
+    with self._distributions_lock:
+      old = self._distributions.get(key)
+      if old is None or old[0] != step:
+        if old is not None:
+          self._put_distribution(key, *old)
+        old = self._distributions[key] = (step, DDSketch(relative_accuracy), log_type)
+      sketch = old[1]
+      non_finite = sketch.non_finite
+      sketch.add_many(values)
+      if sketch.non_finite > non_finite:
+        logger.warning(f"{sketch.non_finite - non_finite} NaN or infinite values in '{key}' at step {step}")
+
+  def _put_distribution(self, key: str, step: int, sketch: DDSketch, log_type: int):
+    self._shipper.put(sketch.to_records(key, step), log_type)
     self._total_logged_elements += 1
 
-  def save_file(self, *files: List[str]):
+  def _flush_distributions(self):
+    with self._distributions_lock:
+      for key, (step, sketch, log_type) in self._distributions.items():
+        self._put_distribution(key, step, sketch, log_type)
+      self._distributions.clear()
+
+  def flush(self, timeout: float = None) -> bool:
+    """Wait till everything logged so far is sent to the server, returns ``False`` on timeout"""
+    self._flush_policy()
+    self._flush_distributions()
+    start = time.monotonic()
+    if not self._shipper.flush(timeout):
+      return False
+    if self._uploader is not None:
+      return self._uploader.drain(None if timeout is None else max(timeout - (time.monotonic() - start), 0))
+    return True
+
+  @property
+  def log_stats(self) -> Dict[str, int]:
+    """Number of records ``queued``, ``sent`` (to the WAL if it is used), ``dropped`` because of the backpressure,
+    ``failed`` and ``pending``. With the WAL ``wal_pending`` is the number of bytes not yet on the server. With a
+    ``log_policy`` the ``policy_offered`` values, ``policy_kept`` of them and ``policy_forced`` by the extremes and
+    anomalies."""
+    stats = self._shipper.stats()
+    if self._wal is not None:
+      stats["wal_pending"] = self._wal.pending
+    if self._policy:
+      stats.update({f"policy_{k}": v for k, v in self._policy.stats().items()})
+    return stats
+
+  def save_file(self, *files: List[str], blocking: bool = True) -> Optional[Future]:
     """
     Register a file save. User should be aware of some structures that we follow for standardizing the data.
     All the experiments are going to be tracked under the following pattern:
@@ -436,7 +766,12 @@ class Lmao():
 
     If relics is not enabled, this function will simply log to the LMAO DB.
 
+    With ``blocking = False`` the files are first snapshotted (see ``snapshot_file``) and then uploaded from a background
+    pool, the training can continue and even overwrite the files. This returns a ``Future`` of the list of files and
+    ``end`` waits for all the pending uploads.
+
     dk.save_file("foo.t", "/bar/", "baz.t", "/bar/roo/")
+    dk.save_file("ckpt.pt", blocking = False)
     """
     logger.info(f"Saving files: {files}")
 
@@ -446,21 +781,53 @@ class Lmao():
       if os.path.isfile(folder_or_file):
         all_files.append(folder_or_file)
       elif os.path.isdir(folder_or_file):
-        all_files.extend(U.get_files_in_folder(folder_or_file, self.username, self.workspace_id))
+        all_files.extend(U.get_files_in_folder(folder_or_file, abs_path = False))
       else:
         raise Exception(f"File or Folder not found: {folder_or_file}")
 
     logger.debug(f"Storing {len(all_files)} files")
+    if blocking:
+      self._save_files(all_files, all_files)
+      return None
+
+    local_paths, snapshot_dir = all_files, None
     if self.save_to_relic:
-      relic = self.get_relic()
-      logger.info(f"Uploading files to relic: {relic}")
-      for f in all_files:
-        relic.put(f)
+      snapshot_dir = U.join(U.env.NBOX_HOME_DIR(), "lmao", "uploads", uuid4().hex)
+      local_paths = [U.join(snapshot_dir, str(i)) for i in range(len(all_files))]
+      for src, dst in zip(all_files, local_paths):
+        snapshot_file(src, dst)
+
+    if self._upload_pool is None:
+      self._upload_pool = ThreadPoolExecutor(max_workers = 2, thread_name_prefix = "lmao_upload")
+    future = self._upload_pool.submit(self._save_files, local_paths, all_files, snapshot_dir)
+    future.add_done_callback(lambda f: f.exception() and logger.error(f"Could not save files {all_files}: {f.exception()}"))
+    self._uploads = [f for f in self._uploads if not f.done()] + [future]
+    return future
+
+  def _save_files(self, local_paths: List[str], names: List[str], snapshot_dir: str = None) -> List[str]:
+    self._refresh_run_id()
+    offline = self.lmao is None or self.run.experiment_id.startswith(OFFLINE_PREFIX)
+    try:
+      if self.save_to_relic:
+        relic = self.get_relic()
+        logger.info(f"Uploading files to relic: {relic}")
+        relic.put_many(local_paths, names)
+    finally:
+      if snapshot_dir is not None:
+        shutil.rmtree(snapshot_dir, ignore_errors = True)
 
     # log the files in the LMAO DB for sanity
+    if offline:
+      if self._wal is None:
+        logger.warning("Run is offline, the files are not listed in the LMAO DB")
+      else:
+        logger.info("Run is offline, the files are listed in the LMAO DB when the run is synced")
+        self._wal.add_files(names)
+      return names
     fl = FileList(experiment_id = self.run.experiment_id)
-    fl.files.extend([File(relic_file = RelicFile(name = x)) for x in all_files])
+    fl.files.extend([File(relic_file = RelicFile(name = x)) for x in names])
     self.lmao.on_save(_FileList = fl)
+    return names
 
   def end(self):
     """End the run to declare it complete. This is more of a convinience function than anything else. For example when you
@@ -471,51 +838,77 @@ class Lmao():
       return None
 
     logger.info("Ending run")
-    ack = self.lmao.on_train_end(_Run = Run(experiment_id=self.run.experiment_id,))
-    if not ack.success:
-      logger.error("  >> Server Error")
-      for l in ack.message.splitlines():
-        logger.error("  " + l)
-      raise Exception("Server Error")
-    self.completed = True
-    if self.enable_system_monitoring:
+    if self._upload_pool is not None:
+      pending = [f for f in self._uploads if not f.done()]
+      if pending:
+        logger.info(f"Waiting for {len(pending)} uploads to complete")
+        wait(pending)
+      self._upload_pool.shutdown()
+    if self.system_monitoring is not None:
+      # the last window of the system metrics goes in before the shipper is closed
       self.system_monitoring.stop()
+    self._flush_policy()
+    self._flush_distributions()
+    self._shipper.close()
+    stats = self._shipper.stats()
+    if stats["dropped"] or stats["failed"]:
+      logger.warning(f"{stats['dropped']} records were dropped and {stats['failed']} could not be sent")
+    if self._wal is not None:
+      # on_train_end is sent by the uploader after the logs
+      self._wal.mark_ended()
+      if self._uploader.close(timeout = self.end_timeout):
+        self._wal.remove()
+      else:
+        logger.warning(f"Could not send everything to the server, {self._wal.pending} bytes are kept in {self._wal.folder}")
+        logger.warning("  Fix: push them later with `nbx lmao sync`")
+        self._wal.close()
+    else:
+      ack = self.lmao.on_train_end(_Run = Run(experiment_id=self.run.experiment_id,))
+      if not ack.success:
+        logger.error("  >> Server Error")
+        for l in ack.message.splitlines():
+          logger.error("  " + l)
+        raise Exception("Server Error")
+    self.completed = True
 
 """
 Code responsible for Monitoring of live servings
 """
 
 
-def post_buffer(lmao: LMAO_Stub, queue: Queue, bar: threading.Barrier):
-  while True:
-    bar.wait() # rate_limit
-    buff = LogBuffer()
-    while True:
-      try:
-        item = queue.get()
-        buff.logs.append(item)
-      except Empty:
-        break
-    lmao.on_livelog(buff)
-
-
 class LmaoASGIMiddleware():
+  # number of (method, path) whose route template is remembered
+  route_cache_size = 4096
+
+  def __init__(
+    self,
+    app,
+    workspace_id: str = "",
+    max_buffer: int = 100_000,
+    batch_size: int = 5_000,
+    flush_every: float = 1.0,
+    aggregate: bool = True,
+    sample_rate: float = 0.0,
+  ) -> None:
+    """ASGI middleware that logs the requests to the routes of the app (path template, method, status code and latency)
+    to NimbleBox Monitoring, use with ``app.add_middleware(LmaoASGIMiddleware)``. By default it sends a latency summary
+    per route, method and status code every ``flush_every`` seconds instead of every request, everything is sent from a
+    background thread with ``on_serving_log`` (see ``ServingLogShipper``).
 
-  def __init__(self, app, workspace_id: str = "") -> None:
+    Args:
+      app: The ASGI app to wrap
+      workspace_id (str): Workspace of the monitoring instance, defaults to the global config
+      max_buffer (int): Requests that can wait to be sent, under overload the oldest are dropped
+      batch_size (int): Requests in one ``on_serving_log`` call
+      flush_every (float): Longest time in seconds a request waits to be sent, also the interval of the summaries
+      aggregate (bool): Send the latency summaries, if ``False`` every request is sent
+      sample_rate (float): With ``aggregate``, fraction of the requests that are also sent as they are
+    """
     if starlette is None:
       raise ValueError("Starlette is not installed. pip install -U nbox\[serving\]")
-    super().__init__(app)
-
-    # rate limiter
-    self._bar = threading.Barrier(2)
-    def _rate_limiter(s = 1.0):
-      while True:
-        self._bar.wait()
-        time.sleep(s)
-    rl = threading.Thread(target=_rate_limiter, daemon=True)
-
-    # create connection and handshake with the lmao server
-    self.workspace_id = workspace_id
+    self.app = app
+    self.workspace_id = workspace_id or secret.get(ConfigString.workspace_id)
+    self._route_cache: Dict[Tuple[str, str], Tuple[str, bool]] = {}
 
     # create a tracer object that will load all the information
     self.tracer = Tracer(start_heartbeat=False)
@@ -524,9 +917,10 @@ class LmaoASGIMiddleware():
     if self._nbx_run_id is not None:
       # update the username you have
       secret.put("username", self.tracer.job_proto.auth_info.username)
-      self.username = secret.get("username")
-    self.lmao = LMAO_Stub(self.username, self.workspace_id)
+    self.username = secret.get("username")
 
+    # create connection and handshake with the lmao server
+    self.lmao = get_lmao_stub(self.username, self.workspace_id)
     serving = self.lmao.init_serving(
       InitRunRequest(
         agent_details = AgentDetails(
@@ -540,48 +934,95 @@ class LmaoASGIMiddleware():
         })
       )
     )
+    if not serving:
+      raise Exception("Server Side exception has occurred, Check the log for details")
     self.serving = serving
-    self.buffer = Queue(maxsize = 2 << 14)
-    self.logger_thread = threading.Thread(target = post_buffer, args = (self.lmao, self.buffer, self._bar), daemon = True)
-    rl.start()
-    self.logger_thread.start()
+    self._closed = False
+    self._close_lock = threading.Lock()
+    self.shipper = ServingLogShipper(
+      self._send_log_buffer,
+      serving.agent_token,
+      max_buffer = max_buffer,
+      batch_size = batch_size,
+      flush_every = flush_every,
+      aggregate = aggregate,
+      sample_rate = sample_rate,
+    )
+
+  def _send_log_buffer(self, buffer: LogBuffer) -> bool:
+    ack = self.lmao.on_serving_log(_LogBuffer = buffer)
+    return ack is not None and ack.success
+
+  async def __call__(self, scope, receive, send):
+    if scope["type"] == "lifespan":
+      return await self._lifespan(scope, receive, send)
+    if scope["type"] != "http":
+      return await self.app(scope, receive, send)
 
-  async def dispatch(self, request, call_next):
-    method = request.method
-    path_template, is_handled_path = self.get_path_template(request)
-    if not is_handled_path:
-      return await call_next(request)
+    status_code = HTTP_500_INTERNAL_SERVER_ERROR
+    async def _send(message):
+      nonlocal status_code
+      if message["type"] == "http.response.start":
+        status_code = message["status"]
+      await send(message)
 
     before_time = time.perf_counter()
     try:
-      response = await call_next(request)
-    except BaseException as e:
-      status_code = HTTP_500_INTERNAL_SERVER_ERROR
-      raise e from None
-    else:
-      status_code = response.status_code
-      after_time = time.perf_counter()
-
-    path = path_template.strip("/")
-    if path:
-      _log = ServingHTTPLog(
-        path = path,
-        method = method,
-        status_code = status_code,
-        latency_ms = 1e3 * (after_time-before_time),
-        timestamp = SimplerTimes.get_now_pb(),
-      )
-      self.buffer.put_nowait(_log)
-
-    return response
+      await self.app(scope, receive, _send)
+    finally:
+      latency_ms = 1e3 * (time.perf_counter() - before_time)
+      path_template, is_handled_path = self.get_path_template(scope)
+      path = path_template.strip("/")
+      if is_handled_path and path:
+        self.shipper.put(path, scope["method"], status_code, latency_ms, time.time())
+
+  def get_path_template(self, scope) -> Tuple[str, bool]:
+    """Template of the route that matches the request, cached on ``(method, path)`` so the routes are scanned once"""
+    key = (scope["method"], scope["path"])
+    out = self._route_cache.get(key)
+    if out is None:
+      out = (scope["path"], False)
+      for route in scope["app"].routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+          out = (route.path, True)
+          break
+      if len(self._route_cache) >= self.route_cache_size:
+        # paths with parameters can be unbounded, forget the oldest entry
+        self._route_cache.pop(next(iter(self._route_cache)))
+      self._route_cache[key] = out
+    return out
+
+  async def _lifespan(self, scope, receive, send):
+    # the server is stopping, send the pending logs and end the serving before telling it that the app is done
+    shutdown = False
+    async def _receive():
+      nonlocal shutdown
+      message = await receive()
+      if message["type"] == "lifespan.shutdown":
+        shutdown = True
+      return message
+
+    async def _send(message):
+      if message["type"] in ["lifespan.shutdown.complete", "lifespan.shutdown.failed"]:
+        await asyncio.get_running_loop().run_in_executor(None, self.close)
+      await send(message)
 
-  @staticmethod
-  def get_path_template(request) -> Tuple[str, bool]:
-    for route in request.app.routes:
-      match, child_scope = route.matches(request.scope)
-      if match == Match.FULL:
-        return route.path, True
-    return request.url.path, False
+    try:
+      await self.app(scope, _receive, _send)
+    finally:
+      if shutdown:
+        # the app did not complete the shutdown itself
+        await asyncio.get_running_loop().run_in_executor(None, self.close)
+
+  def close(self):
+    """Send the pending logs and mark the serving as completed, called when the server shuts down"""
+    with self._close_lock:
+      if self._closed:
+        return
+      self._closed = True
+    self.shipper.close()
+    self.lmao.on_serving_end(_Serving = Serving(agent_token = self.serving.agent_token))
 
 
 """
@@ -830,6 +1271,35 @@ class LmaoCLI:
     # finally print the location of the run where the users can track this
     logger.info(f"Run location: https://app.nimblebox.ai/workspace/{workspace_id}/monitoring/{project_id}/{run.experiment_id}")
 
+  def sync(self, experiment_id: str = "", end: bool = False):
+    """Push the logs kept in the local write-ahead logs to the monitoring instance. The runs that were started offline
+    are created first, a WAL is deleted once its run has ended and everything is on the server.
+
+    Args:
+      experiment_id (str, optional): Push only this run, by default all the WALs on this machine
+      end (bool, optional): Also end the runs that never called ``end``, ex. the process crashed
+    """
+    experiment_ids = [experiment_id] if experiment_id else list_wals()
+    if not experiment_ids:
+      logger.info("Nothing to sync")
+      return
+    for eid in experiment_ids:
+      wal = RunLogWAL(eid, on_files = move_offline_files)
+      if not wal.acquire():
+        logger.warning(f"Run {eid} is being logged by another process, skipping")
+        continue
+      try:
+        if end and not wal.meta["ended"]:
+          wal.mark_ended(Run.Status.FAILED)
+        logger.info(f"Syncing {wal}")
+        if not wal.sync(get_lmao_stub(wal.meta["username"], wal.meta["workspace_id"])):
+          logger.error(f"Could not sync run {eid}, {wal.pending} bytes left")
+        elif wal.done:
+          logger.info(f"Run {wal.meta['experiment_id']} is synced")
+          wal.remove()
+      finally:
+        wal.close()
+
 # do not change these it can become a huge pain later on
 LMAO_RELIC_NAME = "experiments"
 LMAO_JOB_TYPE_PREFIX = "NBXLmao"
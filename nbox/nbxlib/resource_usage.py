@@ -0,0 +1,149 @@
+"""
+Resources used by each ``Operator.__call__``, so a trace shows which nested operator is eating the CPU or the memory
+instead of only the metrics of the whole pod. For every call this measures:
+
+#. ``wall_s``: wall time, and ``wall_self_s`` without the nested operators
+#. ``cpu_s``: user + system CPU time of the calling thread (``resource.getrusage``, or ``time.thread_time`` where
+   it cannot measure a thread), and ``cpu_self_s``
+#. ``peak_rss_delta_mib``: how much the peak RSS of the process grew during the call
+#. ``io_read_mib`` / ``io_write_mib``: bytes read and written by the process (``psutil``, where available)
+#. ``tracemalloc_peak_mib``: peak python memory above the start of the call, only if ``tracemalloc`` is tracing
+
+The python memory is counted for the whole process, so when several threads are measured at the same time (eg.
+``Operator.map``) ``tracemalloc_peak_mib`` includes what the other threads allocated and is an upper bound. The
+numbers of the nested calls are rolled up into their parent on the same thread. They are stored as JSON in the
+``RunStatus.outputs`` of the node under ``RESOURCE_USAGE_KEY`` so they reach the trace file and the job DAG.
+"""
+
+import sys
+import json
+import time
+import threading
+import contextlib
+import tracemalloc
+from typing import Any, Dict, Optional
+
+try:
+  import resource
+except ImportError:
+  # not on windows
+  resource = None
+
+try:
+  import psutil
+except ImportError:
+  psutil = None
+
+from nbox.hyperloop.dag_pb2 import Node
+
+RESOURCE_USAGE_KEY = "nbx_resource_usage"
+
+MiB = 1024 ** 2
+# ru_maxrss is in KiB on linux and in bytes on macOS
+_MAXRSS_UNIT = 1 if sys.platform == "darwin" else 1024
+_RUSAGE_THREAD = getattr(resource, "RUSAGE_THREAD", None)
+
+_store = threading.local()
+_process = None
+
+# number of threads in a ``measure_resources`` block, the peak of tracemalloc is process wide and is only reset
+# when no other thread is measuring with it
+_measuring = 0
+_measuring_lock = threading.Lock()
+
+
+def _cpu_s() -> float:
+  if _RUSAGE_THREAD is None:
+    # RUSAGE_SELF would be the CPU of the whole process (macOS, windows)
+    return time.thread_time()
+  ru = resource.getrusage(_RUSAGE_THREAD)
+  return ru.ru_utime + ru.ru_stime
+
+
+def _maxrss() -> int:
+  if resource is None:
+    return 0
+  return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * _MAXRSS_UNIT
+
+
+def _io_bytes() -> Optional[tuple]:
+  global _process
+  if psutil is None:
+    return None
+  try:
+    if _process is None:
+      _process = psutil.Process()
+    io = _process.io_counters()
+    return io.read_bytes, io.write_bytes
+  except (AttributeError, psutil.Error):
+    # io_counters is not available on macOS
+    return None
+
+
+class _Frame:
+  def __init__(self):
+    self.wall = time.perf_counter()
+    self.cpu = _cpu_s()
+    self.maxrss = _maxrss()
+    self.io = _io_bytes()
+    self.children_wall = 0.0
+    self.children_cpu = 0.0
+    self.child_peak = 0
+    self.traced_start = self.saved_peak = None
+    if tracemalloc.is_tracing():
+      with _measuring_lock:
+        self.traced_start, self.saved_peak = tracemalloc.get_traced_memory()
+        if _measuring == 1 and hasattr(tracemalloc, "reset_peak"):
+          tracemalloc.reset_peak()
+
+
+@contextlib.contextmanager
+def measure_resources():
+  """Measure the resources used in the ``with`` block, the dict yielded is filled when the block exits"""
+  global _measuring
+  stack = getattr(_store, "stack", None)
+  if stack is None:
+    stack = _store.stack = []
+  if not stack:
+    with _measuring_lock:
+      _measuring += 1
+  usage: Dict[str, Any] = {}
+  frame = _Frame()
+  stack.append(frame)
+  try:
+    yield usage
+  finally:
+    stack.pop()
+    wall = time.perf_counter() - frame.wall
+    cpu = _cpu_s() - frame.cpu
+    usage.update(
+      wall_s = wall,
+      wall_self_s = max(wall - frame.children_wall, 0.0),
+      cpu_s = cpu,
+      cpu_self_s = max(cpu - frame.children_cpu, 0.0),
+      peak_rss_delta_mib = max(_maxrss() - frame.maxrss, 0) / MiB,
+    )
+    io = _io_bytes()
+    if io is not None and frame.io is not None:
+      usage.update(io_read_mib = (io[0] - frame.io[0]) / MiB, io_write_mib = (io[1] - frame.io[1]) / MiB)
+    peak = None
+    if frame.traced_start is not None and tracemalloc.is_tracing():
+      peak = max(tracemalloc.get_traced_memory()[1], frame.child_peak)
+      usage["tracemalloc_peak_mib"] = max(peak - frame.traced_start, 0) / MiB
+
+    if stack:
+      # roll up into the parent, a reset of the peak in this call hid the peak the parent had before it
+      parent = stack[-1]
+      parent.children_wall += wall
+      parent.children_cpu += cpu
+      if peak is not None:
+        parent.child_peak = max(parent.child_peak, peak, frame.saved_peak)
+    else:
+      with _measuring_lock:
+        _measuring -= 1
+
+
+def get_resource_usage(node: Node) -> Dict[str, float]:
+  """The resources used by the last call of this node, empty if it was not measured"""
+  data = node.run_status.outputs.get(RESOURCE_USAGE_KEY)
+  return json.loads(data) if data else {}
@@ -0,0 +1,268 @@
+"""
+Client side downsampling of the scalars logged with ``Lmao.log``. A ``LogPolicy`` is set for a key prefix and decides
+which of the values of every key under it are sent, so a job logging hundreds of scalars per step has a bound on
+the records it sends without ``if step % k`` everywhere. For each key a value goes through:
+
+#. ``every_n``: only every n-th value of the key is kept
+#. ``min_interval``: at most one value of the key every these many seconds
+#. ``max_points`` of every ``window`` values are kept, picked by ``"lttb"`` (Largest-Triangle-Three-Buckets, keeps the
+   shape of the curve) or ``"reservoir"`` (uniform random sample)
+
+With ``max_points`` no more than ``max_points`` of every ``window`` values are sent, ``keep_extremes`` makes the min
+and max of the window two of those points. Without a window ``keep_extremes`` also sends the min and max of the
+values dropped between two kept values when they are outside those two, so ``every_n`` / ``min_interval`` can send up
+to 3 points per kept value. With ``anomaly_z`` a value further than these many standard deviations from the recent
+mean (exponentially weighted) is always sent immediately, on top of any bound.
+"""
+
+import math
+import time
+import random
+import threading
+from typing import Dict, List, Optional, Tuple
+
+DOWNSAMPLING_METHODS = ("lttb", "reservoir")
+
+Point = Tuple[int, float] # (step, value)
+
+
+class LogPolicy:
+  def __init__(
+    self,
+    every_n: int = 1,
+    min_interval: float = 0.0,
+    max_points: int = 0,
+    window: int = 1000,
+    method: str = "lttb",
+    keep_extremes: bool = False,
+    anomaly_z: float = 0.0,
+    anomaly_span: int = 100,
+  ):
+    """Which values of a key are sent, see ``nbox.observability.policy``.
+
+    Args:
+      every_n (int): Keep one of every ``every_n`` values
+      min_interval (float): Keep at most one value every these many seconds
+      max_points (int): If set, keep only these many values of every ``window`` values
+      window (int): Number of values downsampled together, these are held in memory till the window is full
+      method (str): How to pick the ``max_points``, one of ``DOWNSAMPLING_METHODS``
+      keep_extremes (bool): Keep the min and max of every window (within ``max_points``), without a window also the
+        min and max of the dropped values
+      anomaly_z (float): If set, always keep the values that are these many standard deviations away from the mean
+      anomaly_span (int): Span of the exponentially weighted mean and variance for the anomalies
+    """
+    if method not in DOWNSAMPLING_METHODS:
+      raise ValueError(f"method should be one of {DOWNSAMPLING_METHODS}, got '{method}'")
+    if max_points and max_points >= window:
+      raise ValueError(f"max_points ({max_points}) should be less than the window ({window})")
+    if max_points and keep_extremes and max_points < 2:
+      raise ValueError(f"max_points should be at least 2 to keep the min and max, got {max_points}")
+    self.every_n = max(1, every_n)
+    self.min_interval = min_interval
+    self.max_points = max_points
+    self.window = window
+    self.method = method
+    self.keep_extremes = keep_extremes
+    self.anomaly_z = anomaly_z
+    self.anomaly_span = anomaly_span
+
+  def __repr__(self):
+    return (
+      f"LogPolicy(every_n = {self.every_n}, min_interval = {self.min_interval}, max_points = {self.max_points}/"
+      f"{self.window} ({self.method}), keep_extremes = {self.keep_extremes}, anomaly_z = {self.anomaly_z})"
+    )
+
+
+def lttb(points: List[Point], n: int) -> List[Point]:
+  """Downsample ``points`` (sorted by step) to ``n`` points keeping the visual shape, Sveinn Steinarsson (2013)"""
+  if n >= len(points) or n < 3:
+    return points[:] if n >= len(points) else points[:max(n, 0)]
+  out = [points[0]]
+  size = (len(points) - 2) / (n - 2)
+  a = 0
+  for i in range(n - 2):
+    # average of the next bucket is the third point of the triangle
+    start, end = int((i + 1) * size) + 1, min(int((i + 2) * size) + 1, len(points))
+    avg_x = sum(p[0] for p in points[start:end]) / (end - start)
+    avg_y = sum(p[1] for p in points[start:end]) / (end - start)
+    ax, ay = points[a]
+    best, best_area = None, -1.0
+    for j in range(int(i * size) + 1, int((i + 1) * size) + 1):
+      x, y = points[j]
+      area = abs((ax - avg_x) * (y - ay) - (ax - x) * (avg_y - ay))
+      if area > best_area:
+        best, best_area = j, area
+    out.append(points[best])
+    a = best
+  out.append(points[-1])
+  return out
+
+
+class _KeyState:
+  def __init__(self, policy: LogPolicy, log_type: int):
+    self.policy = policy
+    self.log_type = log_type
+    self.calls = 0
+    self.last_kept = -math.inf
+    self.last_value: float = None
+    self.gap_min: Point = None # extremes of the dropped values since the last kept one
+    self.gap_max: Point = None
+    self.window: List[Point] = [] # values of the current window, all for lttb and the sample for reservoir
+    self.seen = 0 # values offered to the current window
+    self.w_min: Point = None # extremes of the current window
+    self.w_max: Point = None
+    self.mean = 0.0
+    self.var = 0.0
+    self.n = 0
+
+
+class PolicyRouter:
+  def __init__(self, policies: Optional[Dict[str, LogPolicy]] = None):
+    """Applies the ``LogPolicy`` of the longest matching key prefix to every key, keys without a policy are all kept"""
+    self.policies = dict(policies or {})
+    self._states: Dict[str, _KeyState] = {}
+    self._lock = threading.Lock()
+    self._rng = random.Random()
+    self._counters = {"offered": 0, "kept": 0, "forced": 0}
+
+  def __repr__(self):
+    return f"PolicyRouter({self.policies})"
+
+  def __bool__(self):
+    return bool(self.policies)
+
+  def set(self, prefix: str, policy: LogPolicy):
+    with self._lock:
+      self.policies[prefix] = policy
+      self._states.clear()
+
+  def stats(self) -> Dict[str, int]:
+    """Values ``offered``, ``kept`` and of those ``forced`` by the extremes and anomalies"""
+    return dict(self._counters)
+
+  def _state(self, key: str, log_type: int) -> Optional[_KeyState]:
+    if key not in self._states:
+      # None is cached too, for the keys without a policy
+      prefix = max((p for p in self.policies if key.startswith(p)), key = len, default = None)
+      self._states[key] = _KeyState(self.policies[prefix], log_type) if prefix is not None else None
+    return self._states[key]
+
+  def offer(self, key: str, step: int, value: float, log_type: int) -> List[Point]:
+    """Returns the points of this key that should be sent now, could be none or more than one"""
+    with self._lock:
+      state = self._state(key, log_type)
+      if state is None:
+        return [(step, value)]
+      self._counters["offered"] += 1
+      state.log_type = log_type
+      out = self._offer(state, (step, value))
+      self._counters["kept"] += len(out)
+      return out
+
+  def _is_anomaly(self, state: _KeyState, value: float) -> bool:
+    p = state.policy
+    if not p.anomaly_z:
+      return False
+    std = math.sqrt(state.var)
+    anomaly = state.n >= min(p.anomaly_span, 20) and std > 0 and abs(value - state.mean) > p.anomaly_z * std
+    # exponentially weighted mean and variance, the anomalies are not part of them
+    if not anomaly:
+      alpha = 2 / (p.anomaly_span + 1) if state.n else 1.0
+      diff = value - state.mean
+      state.mean += alpha * diff
+      state.var = (1 - alpha) * (state.var + alpha * diff * diff)
+      state.n += 1
+    return anomaly
+
+  def _offer(self, state: _KeyState, point: Point) -> List[Point]:
+    p = state.policy
+    if self._is_anomaly(state, point[1]):
+      self._counters["forced"] += 1
+      return [point]
+
+    state.calls += 1
+    now = time.monotonic()
+    if (state.calls - 1) % p.every_n or now - state.last_kept < p.min_interval:
+      if p.keep_extremes:
+        if state.gap_min is None or point[1] < state.gap_min[1]:
+          state.gap_min = point
+        if state.gap_max is None or point[1] > state.gap_max[1]:
+          state.gap_max = point
+      return []
+    state.last_kept = now
+
+    out = self._gap_extremes(state, point[1])
+    state.last_value = point[1]
+    out.extend(self._window(state, point))
+    return out
+
+  def _gap_extremes(self, state: _KeyState, value: float = None) -> List[Point]:
+    """The min and max dropped since the last kept value, if they are outside the values kept around them"""
+    out = []
+    if state.policy.keep_extremes:
+      around = [x for x in (state.last_value, value) if x is not None]
+      extremes = sorted(
+        x for x in {state.gap_min, state.gap_max} - {None}
+        if not around or x[1] < min(around) or x[1] > max(around)
+      )
+      self._counters["forced"] += len(extremes)
+      for x in extremes:
+        out.extend(self._window(state, x))
+      state.gap_min = state.gap_max = None
+    return out
+
+  def _window(self, state: _KeyState, point: Point) -> List[Point]:
+    p = state.policy
+    if not p.max_points:
+      return [point]
+    state.seen += 1
+    if state.w_min is None or point[1] < state.w_min[1]:
+      state.w_min = point
+    if state.w_max is None or point[1] > state.w_max[1]:
+      state.w_max = point
+    if p.method == "lttb":
+      state.window.append(point)
+    elif len(state.window) < p.max_points:
+      state.window.append(point)
+    else:
+      i = self._rng.randrange(state.seen)
+      if i < p.max_points:
+        state.window[i] = point
+    if state.seen < p.window:
+      return []
+    return self._close_window(state)
+
+  def _close_window(self, state: _KeyState) -> List[Point]:
+    p = state.policy
+    if not state.seen:
+      return []
+    out = state.window
+    extremes = set()
+    if p.keep_extremes:
+      # the min and max are part of the max_points
+      extremes = {state.w_min, state.w_max}
+      out = [x for x in out if x not in extremes]
+    n = p.max_points - len(extremes)
+    if p.method == "lttb":
+      out = lttb(out, n)
+    elif len(out) > n:
+      out = self._rng.sample(out, n)
+    out = sorted(set(out) | extremes)
+    state.window, state.seen, state.w_min, state.w_max = [], 0, None, None
+    return out
+
+  def flush(self) -> Dict[str, Tuple[int, List[Point]]]:
+    """``{key: (log_type, points)}`` of everything held back that should be sent: the partial windows and the extremes
+    of the values dropped at the end"""
+    out = {}
+    with self._lock:
+      for key, state in self._states.items():
+        if state is None:
+          continue
+        points = self._gap_extremes(state)
+        if state.policy.max_points:
+          points.extend(self._close_window(state))
+        if points:
+          self._counters["kept"] += len(points)
+          out[key] = (state.log_type, points)
+    return out
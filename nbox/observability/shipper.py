@@ -0,0 +1,346 @@
+"""
+Background shipping of the LMAO logs. ``Lmao.log`` only puts the records in a bounded queue, a thread coalesces
+everything queued into one ``RunLog`` per log type and sends it with a single ``on_log`` call. It sends when
+``batch_size`` records are queued, every ``flush_every`` seconds and on ``flush()`` / ``close()``.
+
+When the queue is full the ``backpressure`` policy decides what happens to a new log call:
+
+#. ``block``: wait till the shipper makes space, nothing is lost but the training loop slows down to the network
+#. ``drop_oldest``: the oldest queued call is dropped to make space
+#. ``sample``: keep a uniform sample of the calls made since the last send (reservoir sampling)
+
+``ServingLogShipper`` does the same for the access logs of a serving. By default the requests are not sent one by one,
+the latencies are aggregated per (path, method, status code) in a ``DDSketch`` and every ``flush_every`` seconds one
+summary per key is sent (count, sum, min, max, quantiles and the mergeable buckets). A ``sample_rate`` of the raw
+requests can be sent as well, these are appended as tuples to a bounded ``deque`` (no locks, no protos) and the oldest
+are dropped when the serving gets more requests than can be sent.
+"""
+
+import time
+import atexit
+import random
+import threading
+from collections import deque
+from typing import Callable, Deque, Dict, List, Sequence, Tuple
+
+from nbox.utils import logger, SimplerTimes
+from nbox.observability.sketch import DDSketch
+from nbox.sublime.proto.lmao_pb2 import RunLog, Record, RecordColumn, LogBuffer
+
+BACKPRESSURE_POLICIES = ("block", "drop_oldest", "sample")
+
+
+class RunLogShipper:
+  def __init__(
+    self,
+    send: Callable[[RunLog], bool],
+    experiment_id: str,
+    max_queue: int = 100_000,
+    batch_size: int = 5_000,
+    flush_every: float = 1.0,
+    backpressure: str = "block",
+  ):
+    """Ships the records of one run in batches from a background thread.
+
+    Args:
+      send (Callable): Called with each ``RunLog`` to send, returns ``True`` if it was stored
+      experiment_id (str): The run that the records belong to
+      max_queue (int): Maximum number of records waiting to be sent
+      batch_size (int): Send as soon as these many records are queued
+      flush_every (float): Send whatever is queued at least this often, in seconds
+      backpressure (str): What to do when the queue is full, one of ``BACKPRESSURE_POLICIES``
+    """
+    if backpressure not in BACKPRESSURE_POLICIES:
+      raise ValueError(f"backpressure should be one of {BACKPRESSURE_POLICIES}, got '{backpressure}'")
+    self.send = send
+    self.experiment_id = experiment_id
+    self.max_queue = max(1, max_queue)
+    self.batch_size = max(1, batch_size)
+    self.flush_every = flush_every
+    self.backpressure = backpressure
+
+    # each item is one log call: (log_type, records, columns, number of records), a row of a column is one record
+    self._queue: Deque[Tuple[int, List[Record], Sequence[RecordColumn], int]] = deque()
+    self._queued = 0 # records in the queue
+    self._offered = 0 # calls seen since the last send, for sampling
+    self._in_flight = 0 # records taken by the thread and not yet sent
+    self._taken = 0 # number of times the queue was taken by the thread
+    self._done = 0 # ... and the sends of those were completed
+    self._cond = threading.Condition()
+    self._flush_requested = False
+    self._closed = False
+    self._counters = {"queued": 0, "sent": 0, "dropped": 0, "failed": 0, "batches": 0}
+    self._rng = random.Random()
+
+    self._thread = threading.Thread(target = self._run, daemon = True, name = f"lmao_shipper_{experiment_id}")
+    self._thread.start()
+    atexit.register(self.close)
+
+  def __repr__(self):
+    return f"RunLogShipper({self.experiment_id}, {self.backpressure}, queued = {self._queued})"
+
+  def stats(self) -> Dict[str, int]:
+    """Counters of records: ``queued`` (all the records logged), ``sent``, ``dropped`` by the backpressure, ``failed``
+    to send and ``pending`` right now, along with the number of ``batches`` sent"""
+    with self._cond:
+      return {**self._counters, "pending": self._queued + self._in_flight}
+
+  def put(self, records: List[Record], log_type: int = RunLog.LogType.USER, columns: Sequence[RecordColumn] = ()) -> bool:
+    """Queue the records (and the columns) of one log call, returns ``False`` if they were dropped by the backpressure"""
+    n = len(records) + sum(len(c.rows) for c in columns)
+    item = (log_type, records, columns, n)
+    with self._cond:
+      if self._closed:
+        raise ValueError("Shipper is closed, cannot log more data")
+      self._offered += 1
+      self._counters["queued"] += n
+      if self._queued + n > self.max_queue and self._queue:
+        if self.backpressure == "block":
+          while self._queued + n > self.max_queue and self._queue and not self._closed:
+            self._cond.notify_all()
+            self._cond.wait()
+          if self._closed:
+            raise ValueError("Shipper is closed, cannot log more data")
+        elif self.backpressure == "drop_oldest":
+          while self._queued + n > self.max_queue and self._queue:
+            old = self._queue.popleft()[3]
+            self._queued -= old
+            self._counters["dropped"] += old
+        else:
+          # reservoir sampling over the calls since the last send, replace a random one or drop this one
+          i = self._rng.randrange(self._offered)
+          if i >= len(self._queue):
+            self._counters["dropped"] += n
+            return False
+          old = self._queue[i][3]
+          self._queue[i] = item
+          self._queued += n - old
+          self._counters["dropped"] += old
+          return True
+      self._queue.append(item)
+      self._queued += n
+      if self._queued >= self.batch_size:
+        self._cond.notify_all()
+    return True
+
+  def _take(self) -> List[Tuple[int, List[Record], Sequence[RecordColumn], int]]:
+    items = list(self._queue)
+    self._queue.clear()
+    self._in_flight = self._queued
+    self._queued = 0
+    self._taken += 1
+    self._offered = 0
+    self._cond.notify_all() # wake up the blocked callers
+    return items
+
+  def _ship(self, items: List[Tuple[int, List[Record], Sequence[RecordColumn], int]]):
+    by_type: Dict[int, Tuple[RunLog, int]] = {}
+    for log_type, records, columns, n in items:
+      if log_type not in by_type:
+        by_type[log_type] = (RunLog(experiment_id = self.experiment_id, log_type = log_type), 0)
+      run_log, total = by_type[log_type]
+      run_log.data.extend(records)
+      run_log.column_data.extend(columns)
+      by_type[log_type] = (run_log, total + n)
+    for run_log, n in by_type.values():
+      try:
+        ok = self.send(run_log)
+      except Exception as e:
+        logger.error(f"Could not send {n} records: {e}")
+        ok = False
+      with self._cond:
+        self._counters["sent" if ok else "failed"] += n
+        self._counters["batches"] += 1
+      if not ok:
+        logger.error(f"LMAO server did not store {n} records of run {self.experiment_id}")
+
+  def _run(self):
+    while True:
+      with self._cond:
+        deadline = time.monotonic() + self.flush_every
+        while not (self._closed or self._flush_requested or self._queued >= self.batch_size):
+          left = deadline - time.monotonic()
+          if left <= 0:
+            break
+          self._cond.wait(left)
+        closed = self._closed
+        self._flush_requested = False
+        items = self._take()
+      if items:
+        self._ship(items)
+      with self._cond:
+        self._in_flight = 0
+        self._done = self._taken
+        self._cond.notify_all()
+      if closed and not items:
+        return
+
+  def flush(self, timeout: float = None) -> bool:
+    """Send everything queued till now and wait for it, returns ``False`` on timeout"""
+    deadline = None if timeout is None else time.monotonic() + timeout
+    with self._cond:
+      # whatever is queued now goes in the next take, the one in flight is the current take
+      target = self._taken + 1 if self._queue else self._taken
+      self._flush_requested = True
+      self._cond.notify_all()
+      while self._done < target and self._thread.is_alive():
+        left = None if deadline is None else deadline - time.monotonic()
+        if left is not None and left <= 0:
+          return False
+        self._cond.wait(left)
+    return True
+
+  def close(self, timeout: float = None):
+    """Send everything and stop the thread"""
+    with self._cond:
+      if self._closed:
+        return
+      self._closed = True
+      self._cond.notify_all()
+    self._thread.join(timeout)
+    atexit.unregister(self.close)
+
+
+class ServingLogShipper:
+  def __init__(
+    self,
+    send: Callable[[LogBuffer], bool],
+    agent_token: str,
+    max_buffer: int = 100_000,
+    batch_size: int = 5_000,
+    flush_every: float = 1.0,
+    aggregate: bool = True,
+    sample_rate: float = 0.0,
+    relative_accuracy: float = 0.01,
+  ):
+    """Ships the access logs of a serving in ``LogBuffer`` batches from a background thread.
+
+    Args:
+      send (Callable): Called with each ``LogBuffer`` to send, returns ``True`` if it was stored
+      agent_token (str): The token of the serving from ``init_serving``
+      max_buffer (int): Maximum number of raw requests waiting to be sent, the oldest ones are dropped after that
+      batch_size (int): Maximum number of raw requests in one ``LogBuffer``, a send starts as soon as these many are waiting
+      flush_every (float): Send whatever is waiting at least this often, this is also the interval of the summaries
+      aggregate (bool): Send a latency summary per (path, method, status code) every interval instead of every request
+      sample_rate (float): With ``aggregate``, fraction of the requests also sent as raw ``ServingHTTPLog``
+      relative_accuracy (float): Accuracy of the quantiles in the summaries, see ``DDSketch``
+    """
+    self.send = send
+    self.agent_token = agent_token
+    self.max_buffer = max(1, max_buffer)
+    self.batch_size = max(1, batch_size)
+    self.flush_every = flush_every
+    self.aggregate = aggregate
+    self.sample_rate = sample_rate
+    self.relative_accuracy = relative_accuracy
+
+    # append and popleft on a deque are atomic, the request path never waits on a lock for the raw logs
+    self._buffer: Deque[Tuple[str, str, int, float, float]] = deque(maxlen = self.max_buffer)
+    # the sketches of the current interval, the thread swaps the dict at the end of the interval
+    self._sketches: Dict[Tuple[str, str, int], DDSketch] = {}
+    self._sketch_lock = threading.Lock()
+    self._interval_start = SimplerTimes.get_now_i64()
+    self._rng = random.Random()
+    self._wake = threading.Event()
+    self._closed = False
+    # ``dropped`` is counted on the request threads, the rest on the shipper thread
+    self._counters = {"dropped": 0, "sent": 0, "failed": 0, "batches": 0, "aggregated": 0, "summaries": 0}
+    self._counters_lock = threading.Lock()
+
+    self._thread = threading.Thread(target = self._run, daemon = True, name = f"lmao_serving_{agent_token[:8]}")
+    self._thread.start()
+    atexit.register(self.close)
+
+  def __repr__(self):
+    return f"ServingLogShipper({self.agent_token[:8]}, pending = {len(self._buffer)})"
+
+  def stats(self) -> Dict[str, int]:
+    """Counters of requests: raw ones ``sent``, ``dropped`` because the buffer was full, ``failed`` to send and
+    ``pending``, ``aggregated`` in the summaries that were sent and the number of ``summaries``"""
+    with self._counters_lock:
+      return {**self._counters, "pending": len(self._buffer)}
+
+  def _count(self, counter: str, n: int = 1) -> None:
+    with self._counters_lock:
+      self._counters[counter] += n
+
+  def put(self, path: str, method: str, status_code: int, latency_ms: float, timestamp: float):
+    """Record one request, ``timestamp`` is the unix time in seconds"""
+    if self.aggregate:
+      key = (path, method, status_code)
+      with self._sketch_lock:
+        sketch = self._sketches.get(key)
+        if sketch is None:
+          sketch = self._sketches[key] = DDSketch(self.relative_accuracy)
+        sketch.add(latency_ms)
+      if not self.sample_rate or self._rng.random() >= self.sample_rate:
+        return
+
+    buffer = self._buffer
+    if len(buffer) == self.max_buffer:
+      self._count("dropped")
+    buffer.append((path, method, status_code, latency_ms, timestamp))
+    if len(buffer) >= self.batch_size and not self._wake.is_set():
+      self._wake.set()
+
+  def _send(self, log_buffer: LogBuffer, n: int, counter: str) -> bool:
+    try:
+      ok = self.send(log_buffer)
+    except Exception as e:
+      logger.error(f"Could not send {n} serving logs: {e}")
+      ok = False
+    self._count(counter if ok else "failed", n)
+    return ok
+
+  def _ship(self) -> int:
+    buffer = self._buffer
+    n = min(len(buffer), self.batch_size)
+    if not n:
+      return 0
+    log_buffer = LogBuffer(agent_token = self.agent_token)
+    add = log_buffer.live_logs.add
+    for _ in range(n):
+      path, method, status_code, latency_ms, timestamp = buffer.popleft()
+      add(path = path, method = method, status_code = status_code, latency_ms = latency_ms).timestamp.FromNanoseconds(
+        int(timestamp * 1e9)
+      )
+    self._send(log_buffer, n, "sent")
+    self._count("batches")
+    return n
+
+  def _ship_summary(self):
+    with self._sketch_lock:
+      sketches, self._sketches = self._sketches, {}
+    step, self._interval_start = self._interval_start, SimplerTimes.get_now_i64()
+    if not sketches:
+      return
+    run_log = RunLog(experiment_id = self.agent_token, log_type = RunLog.LogType.NBX)
+    for (path, method, status_code), sketch in sketches.items():
+      run_log.data.extend(sketch.to_records(f"latency_ms/{method} {path} {status_code}", step))
+    n = sum(x.count for x in sketches.values())
+    if self._send(LogBuffer(agent_token = self.agent_token, run_logs = [run_log]), n, "aggregated"):
+      self._count("summaries", len(sketches))
+
+  def _run(self):
+    next_summary = time.monotonic() + self.flush_every
+    while not self._closed:
+      self._wake.wait(max(next_summary - time.monotonic(), 0) if self.aggregate else self.flush_every)
+      self._wake.clear()
+      if self.aggregate and time.monotonic() >= next_summary:
+        self._ship_summary()
+        next_summary = time.monotonic() + self.flush_every
+      while self._ship() == self.batch_size and not self._closed:
+        pass
+    if self.aggregate:
+      self._ship_summary()
+    while self._ship():
+      pass
+
+  def close(self, timeout: float = None):
+    """Send everything and stop the thread"""
+    if self._closed:
+      return
+    self._closed = True
+    self._wake.set()
+    self._thread.join(timeout)
+    atexit.unregister(self.close)
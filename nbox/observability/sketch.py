@@ -0,0 +1,184 @@
+"""
+Mergeable quantile sketch for latencies and logged distributions, this is a DDSketch: a value ``v`` goes to the bucket ``ceil(log_gamma(v))``
+so every quantile it returns is within ``relative_accuracy`` of the true value, and two sketches are merged by adding
+their buckets. This is what the serving middleware keeps per route instead of sending every request, read more in the
+paper: https://arxiv.org/abs/1908.10693
+
+The sketch is sent as ``Record`` objects under one key prefix, ``DDSketch.from_records`` builds it back so the
+intervals (or the replicas of a serving) can be merged when reading. Negative values are kept in a mirrored set of
+buckets so the sketch works for any metric (``Lmao.log_distribution``). NaN and infinite values have no bucket, they
+are only counted in ``non_finite``.
+"""
+
+import math
+from typing import Dict, List
+
+try:
+  import numpy as np
+except ImportError:
+  np = None
+
+from nbox.sublime.proto.lmao_pb2 import Record
+
+
+class DDSketch:
+  def __init__(self, relative_accuracy: float = 0.01, max_bins: int = 2048, min_value: float = 1e-6):
+    """
+    Args:
+      relative_accuracy (float): Quantiles are within this fraction of the true value
+      max_bins (int): Most buckets kept, after that the lowest buckets are merged so only the low quantiles lose accuracy
+      min_value (float): Values below this are counted in a zero bucket
+    """
+    if not 0 < relative_accuracy < 1:
+      raise ValueError(f"relative_accuracy should be in (0, 1), got {relative_accuracy}")
+    self.relative_accuracy = relative_accuracy
+    self.max_bins = max_bins
+    self.min_value = min_value
+    self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+    self._log_gamma = math.log(self.gamma)
+    self.bins: Dict[int, int] = {}
+    self.negative_bins: Dict[int, int] = {} # buckets of -value
+    self.zero_count = 0
+    self.non_finite = 0 # NaN and +/-inf, not part of count
+    self.count = 0
+    self.sum = 0.0
+    self.min = math.inf
+    self.max = -math.inf
+
+  def __repr__(self):
+    return f"DDSketch(count = {self.count}, p50 = {self.quantile(0.5):.3f}, p99 = {self.quantile(0.99):.3f})"
+
+  def add(self, value: float, count: int = 1):
+    if not math.isfinite(value):
+      self.non_finite += count
+      return
+    self.count += count
+    self.sum += value * count
+    if value < self.min:
+      self.min = value
+    if value > self.max:
+      self.max = value
+    if abs(value) <= self.min_value:
+      self.zero_count += count
+      return
+    bins = self.bins if value > 0 else self.negative_bins
+    i = math.ceil(math.log(abs(value)) / self._log_gamma)
+    bins[i] = bins.get(i, 0) + count
+    if len(bins) > self.max_bins:
+      self._collapse(bins)
+
+  def add_many(self, values):
+    """Add all the ``values``, with numpy the buckets of a large array are computed in one go"""
+    if np is None:
+      for v in values:
+        self.add(float(v))
+      return
+    values = np.asarray(values, dtype = np.float64).ravel()
+    finite = np.isfinite(values)
+    self.non_finite += int(values.size - finite.sum())
+    values = values[finite]
+    if not values.size:
+      return
+    self.count += int(values.size)
+    self.sum += float(values.sum())
+    self.min = min(self.min, float(values.min()))
+    self.max = max(self.max, float(values.max()))
+    mag = np.abs(values)
+    zero = mag <= self.min_value
+    self.zero_count += int(zero.sum())
+    for bins, mask in ((self.bins, (values > 0) & ~zero), (self.negative_bins, (values < 0) & ~zero)):
+      if not mask.any():
+        continue
+      idx, counts = np.unique(np.ceil(np.log(mag[mask]) / self._log_gamma).astype(np.int64), return_counts = True)
+      for i, c in zip(idx.tolist(), counts.tolist()):
+        bins[i] = bins.get(i, 0) + c
+      if len(bins) > self.max_bins:
+        self._collapse(bins)
+
+  def _collapse(self, bins: Dict[int, int]):
+    keys = sorted(bins)
+    extra = keys[:len(keys) - self.max_bins + 1]
+    bins[keys[len(extra)]] += sum(bins.pop(k) for k in extra)
+
+  def merge(self, other: "DDSketch"):
+    """Add the values of ``other``, both should have the same ``relative_accuracy``"""
+    if other.gamma != self.gamma:
+      raise ValueError("Cannot merge sketches with different relative_accuracy")
+    for bins, other_bins in ((self.bins, other.bins), (self.negative_bins, other.negative_bins)):
+      for i, c in other_bins.items():
+        bins[i] = bins.get(i, 0) + c
+      if len(bins) > self.max_bins:
+        self._collapse(bins)
+    self.zero_count += other.zero_count
+    self.non_finite += other.non_finite
+    self.count += other.count
+    self.sum += other.sum
+    self.min = min(self.min, other.min)
+    self.max = max(self.max, other.max)
+
+  def quantile(self, q: float) -> float:
+    """Value at the quantile ``q`` in ``[0, 1]``, ``nan`` if the sketch is empty"""
+    if not self.count:
+      return math.nan
+    rank = q * (self.count - 1)
+    seen = 0
+    # the middle of the bucket, clipped to the values seen
+    for i in sorted(self.negative_bins, reverse = True):
+      seen += self.negative_bins[i]
+      if seen > rank:
+        return min(max(-2 * self.gamma ** i / (self.gamma + 1), self.min), self.max)
+    seen += self.zero_count
+    if seen > rank:
+      return min(max(0.0, self.min), self.max)
+    for i in sorted(self.bins):
+      seen += self.bins[i]
+      if seen > rank:
+        return min(max(2 * self.gamma ** i / (self.gamma + 1), self.min), self.max)
+    return self.max
+
+  def to_records(self, prefix: str, step: int, quantiles: List[float] = (0.5, 0.9, 0.99)) -> List[Record]:
+    """Records under ``{prefix}/``: ``count``, ``sum``, ``min``, ``max``, the ``p{..}`` quantiles for the dashboards
+    and the buckets (``bin_index``, ``bin_count``, ``neg_bin_index``, ``neg_bin_count``, ``zero_count``, ``alpha``) for
+    merging, ``non_finite`` is the number of NaN and infinite values left out"""
+    def _f(k, v):
+      return Record(key = f"{prefix}/{k}", value_type = Record.DataType.FLOAT, step = step, float_data = v)
+    def _i(k, v):
+      return Record(key = f"{prefix}/{k}", value_type = Record.DataType.INTEGER, step = step, integer_data = v)
+
+    keys = sorted(self.bins)
+    records = [
+      _i("count", [self.count]),
+      _f("sum", [self.sum]),
+      _f("min", [self.min if self.count else 0.0]),
+      _f("max", [self.max if self.count else 0.0]),
+    ]
+    for q in quantiles:
+      records.append(_f(f"p{q * 100:g}", [self.quantile(q)]))
+    records += [
+      _i("bin_index", keys),
+      _i("bin_count", [self.bins[k] for k in keys]),
+      _i("neg_bin_index", sorted(self.negative_bins)),
+      _i("neg_bin_count", [self.negative_bins[k] for k in sorted(self.negative_bins)]),
+      _i("zero_count", [self.zero_count]),
+      _i("non_finite", [self.non_finite]),
+      _f("alpha", [self.relative_accuracy]),
+    ]
+    return records
+
+  @classmethod
+  def from_records(cls, records: List[Record]) -> "DDSketch":
+    """Build the sketch back from the records of ``to_records`` (of one prefix and one step)"""
+    by_name = {r.key.rsplit("/", 1)[-1]: r for r in records}
+    sketch = cls(relative_accuracy = by_name["alpha"].float_data[0])
+    sketch.bins = dict(zip(by_name["bin_index"].integer_data, by_name["bin_count"].integer_data))
+    if "neg_bin_index" in by_name:
+      sketch.negative_bins = dict(zip(by_name["neg_bin_index"].integer_data, by_name["neg_bin_count"].integer_data))
+    sketch.zero_count = by_name["zero_count"].integer_data[0]
+    if "non_finite" in by_name:
+      sketch.non_finite = by_name["non_finite"].integer_data[0]
+    sketch.count = by_name["count"].integer_data[0]
+    sketch.sum = by_name["sum"].float_data[0]
+    if sketch.count:
+      sketch.min = by_name["min"].float_data[0]
+      sketch.max = by_name["max"].float_data[0]
+    return sketch
@@ -1,83 +1,246 @@
+"""
+System metrics of a LMAO run. ``SystemMetricsLogger`` samples the collectors at a high rate (``resolution``, 100ms by
+default) into a fixed size ring buffer per metric and every ``log_every`` seconds logs one record for the window with
+the ``mean`` (under the metric name), ``min``, ``max`` and ``p95`` of each metric. ``Lmao.log`` only queues, so the
+sampling never waits for the network.
+
+Collectors are pluggable, each returns ``{metric: value}`` and creates its handles (the process, the I/O counters,
+the GPUs) on the first sample. Slow sources set ``every`` to be sampled less often than ``resolution``.
+"""
+
+import math
 import time
 import psutil
 import threading
-from queue import Queue
+from collections import deque
+from typing import Deque, Dict, List
+
+try:
+  import GPUtil
+except ImportError:
+  GPUtil = None
 
+from nbox.utils import logger
 from nbox.sublime.proto.lmao_pb2 import *
 
-import GPUtil
-HAS_GPU = len(GPUtil.getGPUs())
-
-def get_metrics_dict():
-  cpu_usage = psutil.cpu_percent(percpu=True)
-  # total_memory = psutil.virtual_memory().total
-  data = {
-    "cpu_usage": sum(cpu_usage) / len(cpu_usage),
-    "memory_available (MiB)": psutil.virtual_memory().available // (1024 ** 2),
-    "memory_usage (MiB)": psutil.virtual_memory().used // (1024 ** 2),
-    "memory_percentage": psutil.virtual_memory().percent,
-    "disk_utilisation": psutil.disk_usage('/').percent
-  }
-  if HAS_GPU:
+MiB = 1024 ** 2
+
+
+class Collector:
+  # minimum seconds between two samples, 0 means every tick of the logger
+  every = 0.0
+
+  def sample(self) -> Dict[str, float]:
+    raise NotImplementedError
+
+
+class CPUCollector(Collector):
+  def __init__(self):
+    self._primed = False
+
+  def sample(self) -> Dict[str, float]:
+    if not self._primed:
+      # cpu_percent returns the usage since the previous call, the first call is always 0.0
+      psutil.cpu_percent()
+      self._primed = True
+      return {}
+    return {"cpu_usage": psutil.cpu_percent()}
+
+
+class MemoryCollector(Collector):
+  def sample(self) -> Dict[str, float]:
+    vm = psutil.virtual_memory()
+    return {
+      "memory_available (MiB)": vm.available // MiB,
+      "memory_usage (MiB)": vm.used // MiB,
+      "memory_percentage": vm.percent,
+    }
+
+
+class _RateCollector(Collector):
+  """Turns the cumulative counters of ``counters()`` into per second rates"""
+  def __init__(self):
+    self._last = None
+
+  def counters(self) -> Dict[str, float]:
+    raise NotImplementedError
+
+  def sample(self) -> Dict[str, float]:
+    now, values = time.monotonic(), self.counters()
+    if not values:
+      return {}
+    last, self._last = self._last, (now, values)
+    if last is None or now <= last[0]:
+      return {}
+    return {k: (v - last[1].get(k, v)) / (now - last[0]) for k, v in values.items()}
+
+
+class DiskCollector(_RateCollector):
+  def __init__(self, path: str = "/"):
+    super().__init__()
+    self.path = path
+
+  def counters(self) -> Dict[str, float]:
+    io = psutil.disk_io_counters()
+    if io is None:
+      return {}
+    return {"disk_read (MiB/s)": io.read_bytes / MiB, "disk_write (MiB/s)": io.write_bytes / MiB}
+
+  def sample(self) -> Dict[str, float]:
+    out = super().sample()
+    out["disk_utilisation"] = psutil.disk_usage(self.path).percent
+    return out
+
+
+class NetworkCollector(_RateCollector):
+  def counters(self) -> Dict[str, float]:
+    io = psutil.net_io_counters()
+    return {"network_sent (MiB/s)": io.bytes_sent / MiB, "network_recv (MiB/s)": io.bytes_recv / MiB}
+
+
+class ProcessCollector(Collector):
+  def __init__(self, children: bool = True):
+    """RSS of this process and optionally its children, ex. the dataloader workers"""
+    self.children = children
+    self._process: psutil.Process = None
+
+  def sample(self) -> Dict[str, float]:
+    if self._process is None:
+      self._process = psutil.Process()
+    rss = self._process.memory_info().rss
+    if self.children:
+      for c in self._process.children(recursive = True):
+        try:
+          rss += c.memory_info().rss
+        except psutil.Error:
+          pass
+    return {"process_rss (MiB)": rss / MiB}
+
+
+class GPUCollector(Collector):
+  # GPUtil runs nvidia-smi for every call
+  every = 1.0
+
+  def __init__(self):
+    self._available = None
+
+  def sample(self) -> Dict[str, float]:
+    if self._available is None:
+      try:
+        self._available = GPUtil is not None and len(GPUtil.getGPUs()) > 0
+      except Exception:
+        self._available = False
+    if not self._available:
+      return {}
+    data = {}
     for i, gpu in enumerate(GPUtil.getGPUs()):
       data.update({
         f"gpu-{i}_usage": gpu.load,
-        f"gpu-{i}_memory_available": gpu.memoryFree // (1024 ** 2),
-        f"gpu-{i}_memory_usage": gpu.memoryUsed // (1024 ** 2)
+        f"gpu-{i}_memory_available": gpu.memoryFree,
+        f"gpu-{i}_memory_usage": gpu.memoryUsed,
       })
+    return data
+
+
+def get_default_collectors() -> List[Collector]:
+  return [CPUCollector(), MemoryCollector(), DiskCollector(), NetworkCollector(), ProcessCollector(), GPUCollector()]
+
+
+def get_metrics_dict(collectors: List[Collector] = None) -> Dict[str, float]:
+  """One sample of all the ``collectors``"""
+  data = {}
+  for c in collectors or get_default_collectors():
+    data.update(c.sample())
   return data
 
 
+def aggregate(values: List[float]) -> Dict[str, float]:
+  values = sorted(values)
+  return {
+    "mean": sum(values) / len(values),
+    "min": values[0],
+    "max": values[-1],
+    "p95": values[min(int(0.95 * len(values)), len(values) - 1)],
+  }
+
+
 class SystemMetricsLogger:
-  def __init__(self, dk, log_every: int = 1) -> None:
+  def __init__(self, dk, log_every: float = 1, resolution: float = 0.1, collectors: List[Collector] = None) -> None:
+    """Sample the system metrics every ``resolution`` seconds and log one aggregated record every ``log_every`` seconds.
+
+    Args:
+      dk (Lmao): The run to log to
+      log_every (float): Length of the reporting window in seconds
+      resolution (float): Seconds between two samples
+      collectors (List[Collector]): What to sample, defaults to ``get_default_collectors()``
+    """
     self.dk = dk
     self.log_every = log_every
+    self.resolution = min(resolution, log_every)
+    self.collectors = collectors if collectors is not None else get_default_collectors()
+
+    # twice the samples of a window, older samples are overwritten if a window could not be logged
+    self.buffer_size = 2 * max(int(log_every / self.resolution), 1)
+    self._buffers: Dict[str, Deque[float]] = {}
+    self._last_sampled = [-math.inf] * len(self.collectors)
+    self._stop = threading.Event()
+    self.metrics_logger = threading.Thread(target = self._run, daemon = True, name = "lmao_system_metrics")
 
-    # create a rate limiting mechanism
-    self._queue = Queue()
-    self._bar = threading.Barrier(2)
-    def _rate_limiter(s = log_every):
-      while True:
-        self._bar.wait()
-        time.sleep(s)
-    self.rl = threading.Thread(target=_rate_limiter, daemon=True)
-    self.metrics_logger = threading.Thread(target=self._create_metrics_dict, daemon=True)
-
-    # So this function returns the latest cpu usage thast it has gathered from the previous call
-    # and so we need to do an init fire to avoid getting 0.0
-    psutil.cpu_percent(percpu=True)
-
-  def start(self):    
-    self.rl.start()
+  def start(self):
     self.metrics_logger.start()
 
-  def _create_metrics_dict(self):
-    while True:
-      if self.dk.completed:
-        break
-      data = get_metrics_dict()
-      self._queue.put(data)
-      run_comp = self.log()
-      if run_comp:
-        break
-      time.sleep(self.log_every)
-
-  def log(self) -> bool:
-    if self.dk.completed:
-      return True
-    self._bar.wait()
-    items = []
-    while not self._queue.empty():
-      items.append(self._queue.get())
-    for x in items:
-      self.dk.log(x, log_type=RunLog.LogType.SYSTEM)
-    return False
+  def _sample(self):
+    now = time.monotonic()
+    for i, c in enumerate(self.collectors):
+      if c.every and now - self._last_sampled[i] < c.every:
+        continue
+      self._last_sampled[i] = now
+      try:
+        values = c.sample()
+      except Exception as e:
+        logger.debug(f"{c.__class__.__name__} failed: {e}")
+        continue
+      for k, v in values.items():
+        if k not in self._buffers:
+          self._buffers[k] = deque(maxlen = self.buffer_size)
+        self._buffers[k].append(v)
+
+  def log(self):
+    """Log the aggregates of the samples since the last call"""
+    data = {}
+    for k, buffer in self._buffers.items():
+      values = [buffer.popleft() for _ in range(len(buffer))]
+      if not values:
+        continue
+      for stat, v in aggregate(values).items():
+        data[k if stat == "mean" else f"{k}/{stat}"] = v
+    if data and not self.dk.completed:
+      self.dk.log(data, log_type = RunLog.LogType.SYSTEM)
+
+  def _run(self):
+    next_tick = next_log = time.monotonic()
+    next_log += self.log_every
+    while not self._stop.is_set():
+      self._sample()
+      if time.monotonic() >= next_log:
+        try:
+          self.log()
+        except Exception as e:
+          logger.error(f"Could not log system metrics: {e}")
+          return
+        next_log += self.log_every
+      next_tick = max(next_tick + self.resolution, time.monotonic() - self.resolution)
+      self._stop.wait(max(next_tick - time.monotonic(), 0))
+    # the last partial window
+    try:
+      self.log()
+    except Exception as e:
+      logger.error(f"Could not log system metrics: {e}")
 
   def stop(self):
-    self._bar.wait()
-    self._bar.wait()
-    self.rl.join()
-    self.metrics_logger.join()
+    self._stop.set()
+    if self.metrics_logger.is_alive():
+      self.metrics_logger.join()
 
   def __del__(self):
     self.stop()
@@ -0,0 +1,376 @@
+"""
+Write-ahead log for the LMAO runs. Every ``RunLog`` is first appended to a file on the local disk and a background
+uploader sends it to the monitoring instance, so a slow or unreachable server never stops the training. Each run has a
+folder ``{NBOX_HOME_DIR}/lmao/wal/{experiment_id}`` with:
+
+#. ``wal.bin``: the ``RunLog`` protos, each prefixed with its length as a varint (same as ``writeDelimitedTo``)
+#. ``offset``: number of bytes of ``wal.bin`` that the server has stored. Once everything is stored the file is
+   emptied, the offset is first set to ``0`` with the size being emptied (``0 {size}``) and a crash before the
+   truncation finishes it on the next ``acquire``
+#. ``run.json``: what is needed to finish the run later, the ``init_run`` request of a run started offline, the
+   files saved while it was offline (``on_files`` moves them to the real ID) and whether the run has ended
+
+If the process dies the WAL stays on the disk, a new ``Lmao`` for the same experiment continues from the checkpoint
+and ``nbx lmao sync`` pushes whatever is left in all the WALs. Only one process can own a WAL at a time.
+"""
+
+import os
+import json
+import time
+import shutil
+import threading
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+try:
+  import fcntl
+except ImportError:
+  fcntl = None
+
+from nbox.utils import logger, env
+from nbox.sublime._yql.common import b64_to_message
+from nbox.sublime.lmao_client import LMAO_Stub, RunLog, Run, InitRunRequest
+
+# runs created without reaching the server get an ID with this prefix, it is replaced on sync
+OFFLINE_PREFIX = "offline_"
+
+
+def get_wal_folder() -> str:
+  return os.path.join(env.NBOX_HOME_DIR(), "lmao", "wal")
+
+
+def list_wals() -> List[str]:
+  """Experiment IDs of all the WALs on this machine"""
+  folder = get_wal_folder()
+  if not os.path.isdir(folder):
+    return []
+  return sorted(x for x in os.listdir(folder) if os.path.isfile(os.path.join(folder, x, "run.json")))
+
+
+def _varint(n: int) -> bytes:
+  out = bytearray()
+  while n > 0x7F:
+    out.append((n & 0x7F) | 0x80)
+    n >>= 7
+  out.append(n)
+  return bytes(out)
+
+
+def _read_varint(f) -> Tuple[int, int]:
+  """``(value, bytes read)``, value is -1 if the file ends in the middle"""
+  n, shift, read = 0, 0, 0
+  while True:
+    b = f.read(1)
+    if not b:
+      return -1, read
+    read += 1
+    n |= (b[0] & 0x7F) << shift
+    if not b[0] & 0x80:
+      return n, read
+    shift += 7
+
+
+class RunLogWAL:
+  def __init__(
+    self,
+    experiment_id: str,
+    meta: Optional[Dict[str, Any]] = None,
+    fsync: bool = True,
+    on_files: Callable[["RunLogWAL", LMAO_Stub, List[str]], bool] = None,
+  ):
+    """The WAL of one run, creates it if it does not exist.
+
+    Args:
+      experiment_id (str): The run, for the runs started offline this is the local ID
+      meta (Dict[str, Any]): Values to set in ``run.json``, ex. ``username``, ``workspace_id`` and ``init``
+      fsync (bool): ``fsync`` after every append, a crash of the machine (not just the process) loses nothing
+      on_files (Callable): Called by ``sync`` with the files saved while the run was offline once it has its real ID,
+        returns ``True`` if they are moved and listed on the server
+    """
+    self.experiment_id = experiment_id
+    self.folder = os.path.join(get_wal_folder(), experiment_id)
+    self.fsync = fsync
+    self.on_files = on_files
+    os.makedirs(self.folder, exist_ok = True)
+
+    self.meta = {
+      "experiment_id": experiment_id, # the ID on the server, changes after the sync of an offline run
+      "username": "",
+      "workspace_id": "",
+      "init": "", # base64 InitRunRequest of a run started offline
+      "project_name": "",
+      "save_to_relic": False,
+      "files": [], # saved while offline, under the folder of the local ID
+      "ended": False,
+      "status": Run.Status.COMPLETED,
+      "end_sent": False,
+    }
+    if os.path.exists(self._path("run.json")):
+      with open(self._path("run.json"), "r") as f:
+        self.meta.update(json.load(f))
+    if meta:
+      self.meta.update(meta)
+      self._save_meta()
+    elif not os.path.exists(self._path("run.json")):
+      self._save_meta()
+
+    self._lock = threading.Lock() # appends, truncation and the offline files
+    self._sync_lock = threading.Lock() # only one sync at a time
+    self._owner = None
+    self._f = None
+
+  def __repr__(self):
+    return f"RunLogWAL({self.experiment_id}, pending = {self.pending})"
+
+  def _path(self, name: str) -> str:
+    return os.path.join(self.folder, name)
+
+  def _save_meta(self):
+    with open(self._path("run.json.tmp"), "w") as f:
+      json.dump(self.meta, f)
+    os.replace(self._path("run.json.tmp"), self._path("run.json"))
+
+  def _read_offset(self) -> Tuple[int, Optional[int]]:
+    """``(offset, size being emptied)``, the second is ``None`` unless a truncation was interrupted"""
+    try:
+      with open(self._path("offset"), "r") as f:
+        parts = f.read().split()
+    except FileNotFoundError:
+      return 0, None
+    if not parts:
+      return 0, None
+    return int(parts[0]), (int(parts[1]) if len(parts) > 1 else None)
+
+  @property
+  def offset(self) -> int:
+    offset, truncate_from = self._read_offset()
+    if truncate_from is not None and self.size >= truncate_from:
+      # the truncation did not happen, all of the file is on the server
+      return truncate_from
+    return offset
+
+  def _checkpoint(self, offset: int, truncate_from: int = None):
+    with open(self._path("offset.tmp"), "w") as f:
+      f.write(str(offset) if truncate_from is None else f"{offset} {truncate_from}")
+      if self.fsync:
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(self._path("offset.tmp"), self._path("offset"))
+    if self.fsync and hasattr(os, "O_DIRECTORY"):
+      # the rename is durable only once the folder is synced
+      fd = os.open(self.folder, os.O_RDONLY | os.O_DIRECTORY)
+      try:
+        os.fsync(fd)
+      finally:
+        os.close(fd)
+
+  def _truncate(self, size: int):
+    """Empty ``wal.bin`` once the server has its first ``size`` bytes, the checkpoint goes first so that a crash in
+    between is finished by ``_finish_truncate`` instead of leaving an offset past the start of the new records"""
+    self._checkpoint(0, truncate_from = size)
+    self._f.truncate(0)
+    self._checkpoint(0)
+
+  def _finish_truncate(self):
+    _, truncate_from = self._read_offset()
+    if truncate_from is None:
+      return
+    # nothing is appended between the checkpoint and the truncation, the file is either still full or already empty
+    if self.size == truncate_from:
+      logger.warning(f"Finishing the truncation of {self._path('wal.bin')} interrupted by a crash")
+      with open(self._path("wal.bin"), "r+b") as f:
+        f.truncate(0)
+    self._checkpoint(0)
+
+  @property
+  def size(self) -> int:
+    try:
+      return os.path.getsize(self._path("wal.bin"))
+    except FileNotFoundError:
+      return 0
+
+  @property
+  def pending(self) -> int:
+    """Bytes not yet stored by the server"""
+    return max(self.size - self.offset, 0)
+
+  @property
+  def done(self) -> bool:
+    """Everything is on the server, including the end of the run"""
+    return (
+      not self.meta["init"] and not self.meta["files"] and not self.pending
+      and self.meta["ended"] and self.meta["end_sent"]
+    )
+
+  def acquire(self) -> bool:
+    """Become the owner of this WAL, returns ``False`` if another process has it. A partial record at the end, left
+    by a crash in the middle of an append, is removed."""
+    if self._f is not None:
+      return True
+    self._owner = open(self._path("lock"), "w")
+    if fcntl is not None:
+      try:
+        fcntl.flock(self._owner, fcntl.LOCK_EX | fcntl.LOCK_NB)
+      except OSError:
+        self._owner.close()
+        self._owner = None
+        return False
+
+    self._finish_truncate()
+    end = self.offset
+    for end, _ in self._entries(end):
+      pass
+    if end < self.size:
+      logger.warning(f"Removing {self.size - end} bytes of a partial record at the end of {self._path('wal.bin')}")
+      with open(self._path("wal.bin"), "r+b") as f:
+        f.truncate(end)
+    self._f = open(self._path("wal.bin"), "ab")
+    return True
+
+  def close(self):
+    if self._f is not None:
+      self._f.close()
+      self._f = None
+    if self._owner is not None:
+      self._owner.close() # releases the flock
+      self._owner = None
+
+  def append(self, run_log: RunLog) -> bool:
+    """Append one ``RunLog``, it is on the disk when this returns"""
+    if self._f is None:
+      raise ValueError(f"WAL of {self.experiment_id} is not acquired")
+    data = run_log.SerializeToString()
+    with self._lock:
+      self._f.write(_varint(len(data)) + data)
+      self._f.flush()
+      if self.fsync:
+        os.fsync(self._f.fileno())
+    return True
+
+  def add_files(self, names: List[str]):
+    """Record the files saved while the run is offline, ``sync`` hands them to ``on_files``"""
+    with self._lock:
+      self.meta["files"] = self.meta["files"] + [x for x in names if x not in self.meta["files"]]
+      self._save_meta()
+
+  def mark_ended(self, status: int = Run.Status.COMPLETED):
+    """Record that the run has ended, ``on_train_end`` is sent after all the logs"""
+    self.meta.update(ended = True, status = status)
+    self._save_meta()
+
+  def _entries(self, start: int) -> Iterator[Tuple[int, bytes]]:
+    """``(offset after the record, serialised RunLog)`` of the complete records from ``start``"""
+    try:
+      f = open(self._path("wal.bin"), "rb")
+    except FileNotFoundError:
+      return
+    with f:
+      f.seek(start)
+      offset = start
+      while True:
+        n, read = _read_varint(f)
+        if n < 0:
+          return
+        data = f.read(n)
+        if len(data) < n:
+          return
+        offset += read + n
+        yield offset, data
+
+  def sync(self, lmao: LMAO_Stub) -> bool:
+    """Send everything not yet on the server: the ``init_run`` of an offline run, the logs from the checkpoint and the
+    end of the run. Stops at the first failure, returns ``True`` if nothing is left to send."""
+    with self._sync_lock:
+      if self.meta["init"]:
+        run = lmao.init_run(_InitRunRequest = b64_to_message(self.meta["init"], InitRunRequest()))
+        if not run or not run.experiment_id:
+          return False
+        logger.info(f"Offline run {self.experiment_id} is now {run.experiment_id}")
+        self.meta.update(experiment_id = run.experiment_id, init = "")
+        self._save_meta()
+
+      experiment_id = self.meta["experiment_id"]
+      for end, data in self._entries(self.offset):
+        run_log = RunLog()
+        run_log.ParseFromString(data)
+        run_log.experiment_id = experiment_id
+        ack = lmao.on_log(_RunLog = run_log)
+        if ack is None or not ack.success:
+          return False
+        self._checkpoint(end)
+
+      # the file only grows while it is being written, start over once everything is sent
+      with self._lock:
+        if self._f is not None and self.offset and self.offset == self.size:
+          self._truncate(self.offset)
+
+      files = list(self.meta["files"])
+      if files:
+        if self.on_files is None or not self.on_files(self, lmao, files):
+          return False
+        with self._lock:
+          self.meta["files"] = [x for x in self.meta["files"] if x not in files]
+          self._save_meta()
+
+      if self.meta["ended"] and not self.meta["end_sent"]:
+        ack = lmao.on_train_end(_Run = Run(experiment_id = experiment_id, status = self.meta["status"]))
+        if ack is None or not ack.success:
+          return False
+        self.meta["end_sent"] = True
+        self._save_meta()
+    return True
+
+  def remove(self):
+    """Delete the WAL, call only when it is ``done``"""
+    self.close()
+    shutil.rmtree(self.folder, ignore_errors = True)
+
+
+class WALUploader:
+  def __init__(self, wal: RunLogWAL, get_stub: Callable[[], LMAO_Stub], every: float = 1.0, max_backoff: float = 60.0):
+    """Syncs the ``wal`` every ``every`` seconds from a background thread. When the server cannot be reached it waits
+    longer between the attempts, doubling up to ``max_backoff`` seconds."""
+    self.wal = wal
+    self.get_stub = get_stub
+    self.every = every
+    self.max_backoff = max_backoff
+    self._stop = threading.Event()
+    self._thread = threading.Thread(target = self._run, daemon = True, name = f"lmao_wal_{wal.experiment_id}")
+    self._thread.start()
+
+  def _sync_once(self) -> bool:
+    try:
+      return self.wal.sync(self.get_stub())
+    except Exception as e:
+      logger.debug(f"Could not sync {self.wal}: {e}")
+      return False
+
+  def _run(self):
+    wait = self.every
+    while not self._stop.wait(wait):
+      wait = self.every if self._sync_once() else min(wait * 2, self.max_backoff)
+
+  def drain(self, timeout: float = None) -> bool:
+    """Sync till nothing is pending, returns ``False`` if it could not be done in ``timeout`` seconds"""
+    deadline = None if timeout is None else time.monotonic() + timeout
+    wait = self.every
+    while True:
+      if self._sync_once() and not self.wal.pending:
+        return True
+      if deadline is not None and time.monotonic() + wait > deadline:
+        return False
+      time.sleep(wait)
+      wait = min(wait * 2, self.max_backoff)
+
+  def stop(self, timeout: float = None) -> bool:
+    """Stop the thread, whatever is pending stays in the WAL. Returns ``False`` if the thread is still in the middle of
+    a sync after ``timeout`` seconds."""
+    self._stop.set()
+    self._thread.join(timeout)
+    return not self._thread.is_alive()
+
+  def close(self, timeout: float = None) -> bool:
+    """Stop the thread after a last ``drain``, returns ``True`` if everything was sent in ``timeout`` seconds"""
+    deadline = None if timeout is None else time.monotonic() + timeout
+    if not self.stop(timeout):
+      return False
+    return self.drain(None if deadline is None else max(deadline - time.monotonic(), 0))
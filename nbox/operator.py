@@ -125,6 +125,7 @@ from nbox.nbxlib import operator_spec as ospec
 from nbox.nbxlib.tracer import Tracer
 from nbox.version import __version__
 from nbox.sub_utils.latency import log_latency
+from nbox.nbxlib.resource_usage import measure_resources, RESOURCE_USAGE_KEY
 from nbox.framework.on_functions import get_nbx_flow
 from nbox.framework import AirflowMixin, PrefectMixin
 from nbox.hyperloop.job_pb2 import Job as JobProto, Resource
@@ -133,6 +134,7 @@ from nbox.network import _get_job_data
 from nbox.jobs import Schedule, Job, Serve
 from nbox.messages import write_binary_to_file
 from nbox.relics import RelicsNBX, RelicLocal
+from nbox.relics.ref import get_relic, pack_args, unpack
 from nbox.init import nbox_ws_v1
 from nbox.subway import SpecSubway
 
@@ -277,14 +279,15 @@ class Operator():
     def forward(*args, _wait: bool = True, **kwargs):
       """This is the forward method for a NBX-Job. All the parameters will be passed through Relics."""
       logger.debug(f"Running job '{job_name}' ({job_id})")
-      relic = RelicsNBX("cache", workspace_id, create = True)
+      relic = get_relic("cache", workspace_id, tiered = True)
 
       # determining the put location is very tricky because there is no way to create a sync between the
       # key put here and what the run will pull. This can lead to many weird race conditions. So for now
       # I am going to rely on the fact that we cannot have two parallel active runs. Thus at any given
       # moment there can be only one file at /{job_id}/args_kwargs.pkl
       tag = U.get_random_name(True).split("-")[0]
-      relic.put_object(f"{job_id}/args_kwargs_{tag}", (args, kwargs))
+      # large arguments are stored once by their hash and only the references go in args_kwargs
+      relic.put_object(f"{job_id}/args_kwargs_{tag}", pack_args(relic, args, kwargs))
 
       # and then we will trigger the job and wait for the run to complete
       job.trigger(tag = tag)
@@ -318,7 +321,7 @@ class Operator():
         raise Exception(f"Run failed after {max_retries} retries")
 
       # assuming everything went well we should have a file at /{job_id}/return
-      obj = relic.get_object(f"{job_id}/return_{tag}")
+      obj = unpack(relic.get_object(f"{job_id}/return_{tag}"), relic)
       return obj
     
     # create the class and override some values to make more sense
@@ -670,14 +673,16 @@ class Operator():
       self._tracer(self.node)
     # ---- USER SEPERATION BOUNDARY ---- #
 
-    with log_latency(f"{self.__class__.__name__}-forward"):
+    with log_latency(f"{self.__class__.__name__}-forward"), measure_resources() as usage:
       out = self.forward(*args, **kwargs)
 
     # ---- USER SEPERATION BOUNDARY ---- #
     outputs = {}
-    logger.debug(f"Ending operator '{self.__class__.__name__}': {self.node.id}")
+    logger.debug(f"Ending operator '{self.__class__.__name__}': {self.node.id} | {usage}")
     _ts = SimplerTimes.get_now_pb()
-    self.node.run_status.MergeFrom(RunStatus(end = _ts, outputs = {k: str(type(v)) for k, v in outputs.items()}))
+    outputs = {k: str(type(v)) for k, v in outputs.items()}
+    outputs[RESOURCE_USAGE_KEY] = json.dumps({k: round(v, 6) for k, v in usage.items()})
+    self.node.run_status.MergeFrom(RunStatus(end = _ts, outputs = outputs))
     if self._tracer != None:
       self._tracer(self.node)
 
@@ -996,15 +1001,14 @@ if __name__ == "__main__":
       run_status = {rid: None for rid in run_ids}
       active_runs = {rid for rid, done in run_status.items() if not done}
       pbar = tqdm(total = len(inputs), desc = f"Waiting for runs ({html_path})")
-      relic = RelicsNBX("cache", workspace_id = self._op_spec.workspace_id)
+      relic = get_relic("cache", self._op_spec.workspace_id, tiered = True)
 
       def _update_runs():
         # get all runs, filter those in this invocation, update the status
         files_ = {}
-        for t in run_tags:
-          files_[t] = (
-            relic.has(f"{self._op_spec.job_id}/return_{tag}"),
-          )
+        _has = relic.has_many([f"{self._op_spec.job_id}/return_{t}" for t in run_tags])
+        for t, h in zip(run_tags, _has):
+          files_[t] = (h,)
         out = self._op_spec.job.last_n_runs(len(inputs))
         # print(out)
         if not isinstance(out, (list, tuple)):
@@ -1042,7 +1046,7 @@ if __name__ == "__main__":
       # load the results in memory in the exact order of the inputs
       results = []
       for tag, _idx in run_tag_to_input_idx.items():
-        obj = relic.get_object(f"{self._op_spec.job_id}/return_{tag}")
+        obj = unpack(relic.get_object(f"{self._op_spec.job_id}/return_{tag}"), relic)
         results.append(obj)
 
       _end_time = monotonic()
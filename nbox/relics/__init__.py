@@ -5,4 +5,9 @@ This can support local file storage along with AWS S3, GCP Bucket, Azure Blob St
 
 from nbox.relics.base import BaseStore
 from nbox.relics.local import RelicLocal
-from nbox.relics.nbx import RelicsNBX
\ No newline at end of file
+from nbox.relics.nbx import RelicsNBX
+from nbox.relics.tiered import TieredRelic
+from nbox.relics.fs import RelicFileSystem
+from nbox.relics.shards import ShardWriter, ShardReader
+from nbox.relics.dataset import RelicDataset
+from nbox.relics.ref import RelicRef
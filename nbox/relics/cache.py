@@ -0,0 +1,162 @@
+"""
+Read-through cache for the files that are downloaded from NBX-Relics. Every entry is a pair of files:
+
+.. code-block::
+
+  {NBOX_HOME_DIR}/.cache/relics/
+    3b4c...e1        # the actual bytes of the file
+    3b4c...e1.meta   # json with the remote size and last_modified when this entry was filled
+    ...
+
+Writes always go to a temporary file in the same folder followed by an ``os.replace`` so concurrent processes
+either see the complete old file or the complete new one. The data file is replaced before the meta file, so a
+reader can never validate against a newer meta with older bytes. The mtime of the data file is bumped on every
+hit and is used as the access time for LRU eviction (``atime`` is unreliable on ``noatime`` mounts). The data files
+are read-only, ``RelicsNBX.get_from`` copies them out or with ``link = True`` hands out hard links of them.
+"""
+
+import os
+import json
+import stat
+import time
+import threading
+from hashlib import sha256
+from tempfile import mkstemp
+from typing import Callable, Optional
+
+from nbox.utils import logger, env
+from nbox.sub_utils.cache import maybe_gc
+from nbox.sublime.relics_rpc_client import RelicFile
+
+# entries accessed in the last these many seconds are not evicted, this protects files that another thread or
+# process has just looked up and is about to read
+_EVICT_GRACE_SECONDS = 60
+
+
+class RelicCache:
+  def __init__(self, folder: str = "", max_size: int = None):
+    """LRU cache on the local disk, shared by all the relics and all the processes on this machine.
+
+    Args:
+      folder (str): Folder to store the cache in, defaults to ``{NBOX_HOME_DIR}/.cache/relics``
+      max_size (int): Size cap in bytes, defaults to ``NBOX_RELICS_CACHE_SIZE``
+    """
+    self.folder = folder or os.path.join(env.NBOX_HOME_DIR(), ".cache", "relics")
+    self.max_size = max_size if max_size is not None else int(env.NBOX_RELICS_CACHE_SIZE(5 << 30))
+    os.makedirs(self.folder, exist_ok = True)
+
+    # running estimate of the cache size, so that the folder is only scanned when it might be over the cap
+    self._lock = threading.Lock()
+    self._size_estimate = None
+
+  def __repr__(self):
+    return f"RelicCache({self.folder}, max_size = {self.max_size})"
+
+  def _paths(self, key: str):
+    _key = sha256(key.encode("utf-8")).hexdigest()
+    data_path = os.path.join(self.folder, _key)
+    return data_path, data_path + ".meta"
+
+  @staticmethod
+  def _is_fresh(meta: dict, relic_file: RelicFile) -> bool:
+    # if the server does not give us anything to validate against, it cannot be trusted
+    if not (relic_file.size or relic_file.last_modified):
+      return False
+    return meta.get("size") == relic_file.size and meta.get("last_modified") == relic_file.last_modified
+
+  def lookup(self, key: str, relic_file: RelicFile = None) -> Optional[str]:
+    """Get the path to the cached file for ``key``. If ``relic_file`` is provided the entry is validated against
+    it, else the entry is returned as is (offline mode). Returns ``None`` on a miss."""
+    data_path, meta_path = self._paths(key)
+    try:
+      with open(meta_path, "r") as f:
+        meta = json.load(f)
+      if relic_file is not None and not self._is_fresh(meta, relic_file):
+        logger.debug(f"Cache stale: {key}")
+        return None
+      os.utime(data_path)
+    except (FileNotFoundError, ValueError):
+      return None
+    logger.debug(f"Cache hit: {key}")
+    return data_path
+
+  def fill(self, key: str, download_fn: Callable[[str], None], relic_file: RelicFile = None) -> str:
+    """Fill the entry for ``key`` by calling ``download_fn(tmp_path)`` and atomically moving it in place."""
+    data_path, meta_path = self._paths(key)
+    fd, tmp_path = mkstemp(dir = self.folder, suffix = ".tmp")
+    os.close(fd)
+    try:
+      download_fn(tmp_path)
+      size = os.stat(tmp_path).st_size
+      os.chmod(tmp_path, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+      os.replace(tmp_path, data_path)
+    except BaseException:
+      if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+      raise
+
+    meta = {"key": key, "size": 0, "last_modified": 0}
+    if relic_file is not None:
+      meta.update({"size": relic_file.size, "last_modified": relic_file.last_modified})
+    fd, tmp_meta = mkstemp(dir = self.folder, suffix = ".tmp")
+    with os.fdopen(fd, "w") as f:
+      json.dump(meta, f)
+    os.replace(tmp_meta, meta_path)
+
+    with self._lock:
+      if self._size_estimate is not None:
+        self._size_estimate += size
+    self.evict()
+    maybe_gc()
+    return data_path
+
+  def invalidate(self, key: str) -> None:
+    """Remove the entry for ``key``, called whenever we write to that key"""
+    data_path, _ = self._paths(key)
+    self._remove_entry(os.path.basename(data_path))
+
+  def _remove_entry(self, name: str) -> None:
+    # meta goes first so that a reader never validates a missing data file
+    for p in [name + ".meta", name]:
+      try:
+        os.remove(os.path.join(self.folder, p))
+      except FileNotFoundError:
+        pass
+
+  def _entries(self):
+    entries = []
+    for f in os.listdir(self.folder):
+      if f.endswith(".meta") or f.endswith(".tmp"):
+        continue
+      try:
+        st = os.stat(os.path.join(self.folder, f))
+      except FileNotFoundError:
+        continue
+      entries.append((st.st_mtime, st.st_size, f))
+    return entries
+
+  def size(self) -> int:
+    """Total bytes stored in the cache"""
+    return sum(x[1] for x in self._entries())
+
+  def evict(self, max_size: int = None) -> int:
+    """Remove the least recently used entries till the cache is under ``max_size``, returns bytes freed"""
+    max_size = self.max_size if max_size is None else max_size
+    with self._lock:
+      if self._size_estimate is not None and self._size_estimate <= max_size:
+        return 0
+      entries = sorted(self._entries())
+      total = sum(x[1] for x in entries)
+      freed = 0
+      now = time.time()
+      for mtime, size, f in entries:
+        if total - freed <= max_size:
+          break
+        if now - mtime < _EVICT_GRACE_SECONDS:
+          continue
+        self._remove_entry(f)
+        freed += size
+      self._size_estimate = total - freed
+    if freed:
+      logger.debug(f"Evicted {freed} bytes from {self.folder}")
+    return freed
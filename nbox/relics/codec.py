@@ -0,0 +1,92 @@
+"""
+Serialisation of the python objects stored in relics. Tables (``pandas.DataFrame`` and ``pyarrow.Table``) are written
+in the Arrow IPC file format (same as Feather v2), everything else is cloudpickled. Which one was used is detected
+from the first bytes when reading, so old pickled objects keep working.
+
+Arrow files on the local disk are memory mapped, so reading a table (or just a few columns of it with ``columns``)
+does not copy the data into memory. This requires ``pyarrow``, without it all the objects are pickled.
+"""
+
+import sys
+import json
+import cloudpickle
+from typing import Any, List, Optional
+
+try:
+  import pyarrow as pa
+  import pyarrow.ipc
+except ImportError:
+  pa = None
+
+from nbox.utils import logger
+
+ARROW_MAGIC = b"ARROW1"
+
+# key in the schema metadata that tells what type to return on read
+_NBX_TYPE = b"nbx_type"
+
+
+def _table_kind(obj) -> Optional[str]:
+  if pa is None:
+    return None
+  if isinstance(obj, pa.Table):
+    return "arrow"
+  pd = sys.modules.get("pandas")
+  if pd is not None and isinstance(obj, pd.DataFrame):
+    return "pandas"
+  return None
+
+
+def dump_object(obj, f) -> str:
+  """Write ``obj`` to the binary file ``f``, returns the codec used, ``"arrow"`` or ``"pickle"``"""
+  kind = _table_kind(obj)
+  if kind is not None:
+    try:
+      table = pa.Table.from_pandas(obj, preserve_index = None) if kind == "pandas" else obj
+    except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError) as e:
+      logger.debug(f"Could not convert to arrow, falling back to pickle: {e}")
+    else:
+      table = table.replace_schema_metadata({**(table.schema.metadata or {}), _NBX_TYPE: kind.encode()})
+      with pa.ipc.new_file(f, table.schema) as writer:
+        writer.write_table(table)
+      return "arrow"
+  cloudpickle.dump(obj, f)
+  return "pickle"
+
+
+def _project(table: "pa.Table", columns: List[str]) -> "pa.Table":
+  # keep the index of the dataframe along with the selected columns
+  pandas_meta = json.loads((table.schema.metadata or {}).get(b"pandas", b"{}"))
+  index_cols = [c for c in pandas_meta.get("index_columns", []) if isinstance(c, str) and c not in columns]
+  return table.select(list(columns) + index_cols)
+
+
+def _from_table(table: "pa.Table", columns: List[str] = None):
+  if columns is not None:
+    table = _project(table, columns)
+  kind = (table.schema.metadata or {}).get(_NBX_TYPE, b"arrow")
+  if kind == b"pandas":
+    return table.to_pandas(split_blocks = True)
+  return table
+
+
+def load_object(f, columns: List[str] = None) -> Any:
+  """Read an object written by ``dump_object`` from ``f``, which is either a path to a local file (memory mapped)
+  or a binary file object. ``columns`` selects the columns when the object is a table."""
+  if isinstance(f, str):
+    with open(f, "rb") as _f:
+      magic = _f.read(len(ARROW_MAGIC))
+      if magic != ARROW_MAGIC:
+        _f.seek(0)
+        return cloudpickle.load(_f)
+    if pa is None:
+      raise ImportError("This object is an Arrow table, pip install pyarrow to read it")
+    return _from_table(pa.ipc.open_file(pa.memory_map(f, "r")).read_all(), columns)
+
+  magic = f.peek(len(ARROW_MAGIC))[:len(ARROW_MAGIC)]
+  if magic != ARROW_MAGIC:
+    return cloudpickle.load(f)
+  if pa is None:
+    raise ImportError("This object is an Arrow table, pip install pyarrow to read it")
+  # the file format needs random access, so read the body once into an arrow buffer
+  return _from_table(pa.ipc.open_file(pa.py_buffer(f.read())).read_all(), columns)
@@ -0,0 +1,244 @@
+"""
+Parallel copy between local folders and relics, this is what runs behind ``nbx relics cp``:
+
+.. code-block:: bash
+
+  nbx relics cp ./checkpoints relic://experiments/run-12/ckpt --recursive --jobs 16
+  nbx relics cp relic://datasets/imagenet/val ./val --recursive
+  nbx relics cp relic://experiments/run-12 relic://archive/run-12 --recursive
+
+Files that already exist on the destination with the same size and a newer timestamp are skipped, so running the
+same command again resumes an interrupted copy. At most ``RELICS_MAX_WORKERS`` files are copied at a time, that is
+the size of the HTTP connection pool. Downloads are written to a ``.part`` file first and continue from
+where they stopped with a range request.
+"""
+
+import os
+import time
+import threading
+from glob import glob, escape
+from typing import Dict, List, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from tqdm import tqdm
+
+import nbox.utils as U
+from nbox.utils import logger
+from nbox.relics.nbx import RelicsNBX, RELICS_MAX_WORKERS, _get_transfer_session, get_relic_file
+from nbox.sublime.relics_rpc_client import RelicFile
+
+RELIC_SCHEME = "relic://"
+
+
+def _parse(path: str) -> Tuple[Optional[str], str]:
+  """``relic://name/prefix`` -> ``(name, prefix)`` and a local path -> ``(None, path)``"""
+  if path.startswith(RELIC_SCHEME):
+    relic_name, _, prefix = path[len(RELIC_SCHEME):].partition("/")
+    if not relic_name:
+      raise ValueError(f"No relic name in '{path}'")
+    return relic_name, prefix.strip("/")
+  return None, path
+
+
+class _ProgressReader:
+  """File-like that moves ``pbar`` as ``fileobj`` is read"""
+  def __init__(self, fileobj, pbar: tqdm):
+    self.fileobj = fileobj
+    self.pbar = pbar
+
+  def read(self, n: int = -1) -> bytes:
+    chunk = self.fileobj.read(n)
+    self.pbar.update(len(chunk))
+    return chunk
+
+
+class _Copier:
+  def __init__(self, src: str, dst: str, recursive: bool, jobs: int, workspace_id: str):
+    self.src_relic_name, self.src = _parse(src)
+    self.dst_relic_name, self.dst = _parse(dst)
+    if self.src_relic_name is None and self.dst_relic_name is None:
+      raise ValueError("At least one of the paths should be a relic://, use cp for local copies")
+    self.recursive = recursive
+    if jobs > RELICS_MAX_WORKERS:
+      logger.warning(f"cp: --jobs {jobs} is more than the {RELICS_MAX_WORKERS} connections of the pool, using {RELICS_MAX_WORKERS}")
+    self.jobs = min(max(1, jobs), RELICS_MAX_WORKERS)
+    self.workspace_id = workspace_id
+    self._relics: Dict[str, RelicsNBX] = {}
+    self._lock = threading.Lock()
+
+  def _relic(self, relic_name: str, create: bool = False) -> RelicsNBX:
+    with self._lock:
+      if relic_name not in self._relics:
+        # the copies should not fill the local cache
+        self._relics[relic_name] = RelicsNBX(relic_name, self.workspace_id, create = create, cache = False)
+      return self._relics[relic_name]
+
+  def _sources(self) -> List[Tuple[str, int, int]]:
+    """``(relative_path, size, mtime)`` of all the files to copy, relative path is ``""`` for a single file"""
+    if self.src_relic_name is None:
+      if os.path.isdir(self.src):
+        if not self.recursive:
+          raise ValueError(f"'{self.src}' is a folder, pass --recursive")
+        out = []
+        for fp in U.get_files_in_folder(self.src):
+          st = os.stat(fp)
+          out.append((os.path.relpath(fp, os.path.abspath(self.src)).replace(os.sep, "/"), st.st_size, int(st.st_mtime)))
+        return out
+      if not os.path.isfile(self.src):
+        raise ValueError(f"'{self.src}' does not exist")
+      st = os.stat(self.src)
+      return [("", st.st_size, int(st.st_mtime))]
+
+    relic = self._relic(self.src_relic_name)
+    f = relic._stat(self.src) if self.src else None
+    if f is not None and f.type != RelicFile.RelicType.FOLDER:
+      return [("", f.size, f.last_modified)]
+    if not self.recursive:
+      raise ValueError(f"'{self.src}' is not a file in relic '{self.src_relic_name}', pass --recursive for folders")
+    skip = len(self.src) + 1 if self.src else 0
+    return [(f.name.strip("/")[skip:], f.size, f.last_modified) for f in relic._walk(self.src)]
+
+  def _dst_path(self, rel: str) -> str:
+    if rel:
+      return f"{self.dst}/{rel}".lstrip("/") if self.dst_relic_name else os.path.join(self.dst, rel)
+    # single file, copying into a folder keeps the name
+    name = os.path.basename(self.src)
+    if self.dst_relic_name:
+      return f"{self.dst}/{name}".lstrip("/") if (not self.dst or self.dst.endswith("/")) else self.dst
+    return os.path.join(self.dst, name) if os.path.isdir(self.dst) or self.dst.endswith(os.sep) else self.dst
+
+  def _src_path(self, rel: str) -> str:
+    if self.src_relic_name:
+      return f"{self.src}/{rel}".lstrip("/") if rel else self.src
+    return os.path.join(self.src, rel) if rel else self.src
+
+  def _existing(self, dst_paths: List[str]) -> Dict[str, Tuple[int, int]]:
+    """``{dst_path: (size, mtime)}`` of the destination files that already exist"""
+    out = {}
+    if self.dst_relic_name is None:
+      for p in dst_paths:
+        if os.path.isfile(p):
+          st = os.stat(p)
+          out[p] = (st.st_size, int(st.st_mtime))
+      return out
+
+    relic = self._relic(self.dst_relic_name, create = True)
+    if len(dst_paths) == 1:
+      files = {dst_paths[0]: relic._stat(dst_paths[0])}
+    else:
+      files = {f.name.strip("/"): f for f in relic._walk(self.dst)}
+    for p in dst_paths:
+      f = files.get(p)
+      if f is not None:
+        out[p] = (f.size, f.last_modified)
+    return out
+
+  def _download(self, rel: str, size: int, mtime: int, pbar: tqdm) -> None:
+    relic = self._relic(self.src_relic_name)
+    dst = self._dst_path(rel)
+    os.makedirs(os.path.dirname(os.path.abspath(dst)), exist_ok = True)
+
+    # the part file is named after the version of the source so a changed source does not resume old bytes
+    part = f"{dst}.part-{mtime}"
+    for old in glob(escape(dst) + ".part-*"):
+      if old != part:
+        os.remove(old)
+    done = os.path.getsize(part) if os.path.exists(part) else 0
+    headers = {"Range": f"bytes={done}-"} if done else {}
+    with _get_transfer_session().get(relic.get_url(self._src_path(rel)), headers = headers, stream = True) as r:
+      r.raise_for_status()
+      if done and r.status_code != 206:
+        done = 0 # server sent the whole file
+      pbar.update(done)
+      with open(part, "ab" if done else "wb") as f:
+        for chunk in r.iter_content(chunk_size = 1 << 20):
+          f.write(chunk)
+          pbar.update(len(chunk))
+    os.replace(part, dst)
+    # the mtime is the version of the source, used to skip this file next time
+    os.utime(dst, (mtime, mtime))
+
+  def _upload(self, rel: str, size: int, mtime: int, pbar: tqdm) -> None:
+    relic = self._relic(self.dst_relic_name, create = True)
+    src = self._src_path(rel)
+    # same as put_to, with the progress moving as the file is read
+    relic_file = get_relic_file(src, relic.username, relic.workspace_id)
+    relic_file.relic_name = relic.relic_name
+    relic_file.name = self._dst_path(rel)
+    with open(src, "rb") as f:
+      relic._upload_stream(_ProgressReader(f, pbar), os.fstat(f.fileno()).st_size, relic_file, desc = src)
+
+  def _relay(self, rel: str, size: int, mtime: int, pbar: tqdm) -> None:
+    src = self._relic(self.src_relic_name)
+    dst = self._relic(self.dst_relic_name, create = True)
+    with _get_transfer_session().get(src.get_url(self._src_path(rel)), stream = True) as r:
+      r.raise_for_status()
+      # the listing reports empty files with a size of 1, the response has the real one
+      size = int(r.headers.get("Content-Length", size))
+      dst.put_stream(_ProgressReader(r.raw, pbar), self._dst_path(rel), size)
+
+  def run(self, dry_run: bool = False) -> Dict[str, int]:
+    sources = self._sources()
+    dst_paths = [self._dst_path(rel) for rel, _, _ in sources]
+    existing = self._existing(dst_paths)
+
+    todo = []
+    for (rel, size, mtime), dst in zip(sources, dst_paths):
+      have = existing.get(dst)
+      # empty files are listed with a size of 1 in relics
+      if have is not None and max(1, have[0]) == max(1, size) and have[1] >= mtime:
+        continue
+      todo.append((rel, size, mtime))
+    skipped = len(sources) - len(todo)
+    total = sum(x[1] for x in todo)
+    logger.info(f"cp: {len(todo)} files ({total / (1 << 20):.1f} MB) to copy, {skipped} already there")
+    if dry_run or not todo:
+      return {"copied": len(todo), "skipped": skipped, "bytes": total}
+
+    if self.src_relic_name and self.dst_relic_name:
+      fn = self._relay
+    elif self.src_relic_name:
+      fn = self._download
+    else:
+      fn = self._upload
+
+    st = time.monotonic()
+    errors = []
+    with tqdm(total = total, unit = "B", unit_scale = True, desc = "cp") as pbar:
+      with ThreadPoolExecutor(max(1, self.jobs), thread_name_prefix = "relics_cp") as pool:
+        futures = {pool.submit(fn, *x, pbar): x[0] for x in todo}
+        for fut in as_completed(futures):
+          try:
+            fut.result()
+          except Exception as e:
+            logger.error(f"Could not copy '{futures[fut] or self.src}': {e}")
+            errors.append(futures[fut])
+    took = time.monotonic() - st
+    logger.info(f"cp: copied {len(todo) - len(errors)} files in {took:.1f}s ({total / (1 << 20) / max(took, 1e-6):.1f} MB/s)")
+    if errors:
+      raise RuntimeError(f"{len(errors)} files could not be copied, run the same command again to resume")
+    return {"copied": len(todo), "skipped": skipped, "bytes": total}
+
+
+def copy(
+  src: str,
+  dst: str,
+  recursive: bool = False,
+  jobs: int = RELICS_MAX_WORKERS,
+  workspace_id: str = "",
+  dry_run: bool = False,
+) -> Dict[str, int]:
+  """Copy files between local paths and ``relic://{relic_name}/{path}``, at least one of them has to be a relic.
+
+  Args:
+    src (str): Source file or folder
+    dst (str): Destination, a file is copied into it if it is a folder
+    recursive (bool): Copy folders
+    jobs (int): Number of files transferred in parallel, at most ``RELICS_MAX_WORKERS``
+    workspace_id (str): The workspace ID, if not provided, will be one in global config.
+    dry_run (bool): Only tell what would be copied
+
+  Returns:
+    Dict[str, int]: number of files ``copied``, ``skipped`` and the ``bytes`` copied (that would be with ``dry_run``)
+  """
+  return _Copier(src, dst, recursive, jobs, workspace_id).run(dry_run = dry_run)
@@ -0,0 +1,154 @@
+"""
+Streaming loader over the files in a relic folder, the downloads for the upcoming files run in background threads
+while the current batch is being used. It is framework agnostic, batches are lists (or whatever ``collate`` returns)
+so they can be fed to torch, jax or a batch scoring loop.
+
+.. code-block:: python
+
+  ds = RelicDataset(relic, "images/train", decode = lambda b: Image.open(io.BytesIO(b)))
+  for batch in ds.iter(batch_size = 32, shuffle_buffer = 1024, num_workers = 16):
+    ...
+"""
+
+import random
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional
+
+from nbox.utils import logger
+from nbox.relics.nbx import RelicsNBX, _get_transfer_session
+from nbox.sublime.relics_rpc_client import RelicFile
+
+
+class RelicDataset:
+  def __init__(
+    self,
+    relic: RelicsNBX,
+    prefix: str = "",
+    decode: Optional[Callable[[bytes], Any]] = None,
+    recursive: bool = True,
+  ):
+    """Iterable over the files in ``prefix`` of the ``relic``.
+
+    Args:
+      relic (RelicsNBX): The relic to read from
+      prefix (str): Folder in the relic, relative to the prefix of the relic
+      decode (Callable): Called with the bytes of each file, by default the bytes are returned
+      recursive (bool): Also include the files in the sub folders
+    """
+    self.relic = relic
+    self.prefix = prefix.strip("/")
+    self.decode = decode
+    self.recursive = recursive
+    self._files: Optional[List[str]] = None
+    self._remotes: Dict[str, RelicFile] = {} # listing of the files, the cache is validated against it
+
+  def __repr__(self):
+    return f"RelicDataset({self.relic.relic_name}, {self.prefix})"
+
+  @property
+  def files(self) -> List[str]:
+    """Names of all the files in this dataset relative to the relic prefix, listed once and then reused"""
+    if self._files is None:
+      root = self.relic._remote_name(self.prefix) if self.prefix else self.relic.prefix
+      skip = len(self.relic.prefix) + 1 if self.relic.prefix else 0
+      if self.recursive:
+        files = self.relic._walk(root)
+      else:
+        files = [f for f in self.relic._list_prefix(root) if f.type != RelicFile.RelicType.FOLDER]
+      self._remotes = {f.name.strip("/")[skip:]: f for f in files}
+      self._files = sorted(self._remotes)
+      logger.debug(f"{self}: {len(self._files)} files")
+    return self._files
+
+  def __len__(self):
+    return len(self.files)
+
+  def _read(self, name: str) -> bytes:
+    if self.relic.cache is not None:
+      # repeated epochs are served from the local cache
+      with open(self.relic._get_cached(name, self._remotes.get(name)), "rb") as f:
+        return f.read()
+    r = _get_transfer_session().get(self.relic.get_url(name))
+    r.raise_for_status()
+    return r.content
+
+  def _load(self, name: str):
+    data = self._read(name)
+    return self.decode(data) if self.decode is not None else data
+
+  def _stream(self, files: List[str], num_workers: int, prefetch: int) -> Iterator[Any]:
+    # keep ``prefetch`` downloads in flight and yield them in order
+    pool = ThreadPoolExecutor(max(1, num_workers), thread_name_prefix = "relic_dataset")
+    futures: Deque[Future] = deque()
+    try:
+      nxt = 0
+      while nxt < len(files) or futures:
+        while nxt < len(files) and len(futures) < prefetch:
+          futures.append(pool.submit(self._load, files[nxt]))
+          nxt += 1
+        yield futures.popleft().result()
+    finally:
+      # the consumer might stop early, do not download the rest
+      for f in futures:
+        f.cancel()
+      pool.shutdown(wait = False)
+
+  def iter(
+    self,
+    batch_size: int = None,
+    shuffle_buffer: int = 0,
+    num_workers: int = 8,
+    prefetch: int = None,
+    seed: int = None,
+    drop_last: bool = False,
+    collate: Callable[[List[Any]], Any] = None,
+  ) -> Iterator[Any]:
+    """Iterate over the decoded files.
+
+    Args:
+      batch_size (int): Yield lists of this many items, if ``None`` the items are yielded one by one
+      shuffle_buffer (int): Shuffle the order of the files and then shuffle the items in a buffer of this size
+      num_workers (int): Number of parallel downloads
+      prefetch (int): Number of files downloaded ahead, defaults to ``2 * num_workers``
+      seed (int): Seed for the shuffling
+      drop_last (bool): Drop the last batch if it is smaller than ``batch_size``
+      collate (Callable): Called on each batch before it is yielded
+    """
+    files = list(self.files)
+    rng = random.Random(seed)
+    if shuffle_buffer:
+      rng.shuffle(files)
+    items = self._stream(files, num_workers, prefetch or 2 * max(1, num_workers))
+
+    if shuffle_buffer > 1:
+      items = self._shuffle(items, shuffle_buffer, rng)
+
+    if batch_size is None:
+      yield from items
+      return
+
+    batch = []
+    for x in items:
+      batch.append(x)
+      if len(batch) == batch_size:
+        yield collate(batch) if collate is not None else batch
+        batch = []
+    if batch and not drop_last:
+      yield collate(batch) if collate is not None else batch
+
+  @staticmethod
+  def _shuffle(items: Iterator[Any], size: int, rng: random.Random) -> Iterator[Any]:
+    buffer = []
+    for x in items:
+      if len(buffer) < size:
+        buffer.append(x)
+        continue
+      i = rng.randrange(size)
+      buffer[i], x = x, buffer[i]
+      yield x
+    rng.shuffle(buffer)
+    yield from buffer
+
+  def __iter__(self):
+    return self.iter()
@@ -0,0 +1,266 @@
+"""
+``fsspec`` filesystem over NBX-Relics, so anything that can read from ``s3://`` can read from ``relic://``:
+
+.. code-block:: python
+
+  import pandas as pd
+  import nbox.relics # registers the protocol
+
+  df = pd.read_csv("relic://my_relic/data/train.csv")
+  with fsspec.open("relic://my_relic/models/tokenizer.json") as f:
+    ...
+
+Paths are ``relic://{relic_name}/{path}``. Files are read with HTTP range requests against the signed URL of the
+file, the blocks are kept in an LRU block cache and when the reads are sequential the next few blocks are fetched
+in the background. This requires ``fsspec`` which is not a dependency of ``nbox``, ``pip install fsspec``.
+"""
+
+import threading
+from tempfile import SpooledTemporaryFile
+from collections import OrderedDict
+from typing import Dict, List
+from concurrent.futures import ThreadPoolExecutor, Future
+
+try:
+  import fsspec
+  from fsspec.spec import AbstractFileSystem, AbstractBufferedFile
+  from fsspec.caching import BaseCache
+except ImportError:
+  fsspec = None
+  AbstractFileSystem = AbstractBufferedFile = BaseCache = object
+
+from nbox.utils import logger
+from nbox.utils import env
+from nbox.relics.nbx import RelicsNBX, RELICS_SPILL_SIZE, _get_transfer_session
+from nbox.sublime.relics_rpc_client import RelicFile
+
+# default block size for the reads, this is the unit of caching as well
+RELIC_FS_BLOCK_SIZE = 4 << 20
+
+
+class _PrefetchBlockCache(BaseCache):
+  """LRU cache of fixed size blocks, when the file is being read sequentially the next ``prefetch`` blocks are
+  fetched in background threads so the network is busy while the caller is busy with the current block."""
+  name = "relic_prefetch"
+
+  def __init__(self, blocksize: int, fetcher, size: int, maxblocks: int = 32, prefetch: int = 2):
+    super().__init__(blocksize, fetcher, size)
+    self.nblocks = (size + blocksize - 1) // blocksize
+    self.maxblocks = maxblocks
+    self.prefetch = prefetch
+    self._blocks: Dict[int, Future] = OrderedDict()
+    self._lock = threading.RLock() # done callbacks of finished futures run in the thread adding them
+    self._last_block = -2
+    self._pool = ThreadPoolExecutor(max(1, prefetch), thread_name_prefix = "relic_prefetch")
+
+  def _fetch_block(self, i: int) -> bytes:
+    start = i * self.blocksize
+    return self.fetcher(start, min(start + self.blocksize, self.size))
+
+  def _submit(self, i: int) -> Future:
+    # should be called with the lock held
+    fut = self._blocks.get(i)
+    if fut is None:
+      fut = self._pool.submit(self._fetch_block, i)
+      self._blocks[i] = fut
+      fut.add_done_callback(lambda f, i = i: self._evict_failed(i, f))
+      while len(self._blocks) > self.maxblocks:
+        self._blocks.popitem(last = False)
+    else:
+      self._blocks.move_to_end(i)
+    return fut
+
+  def _evict_failed(self, i: int, fut: Future):
+    # a failed block is not kept, else every later read of it fails with the same error
+    if fut.cancelled() or fut.exception() is not None:
+      with self._lock:
+        if self._blocks.get(i) is fut:
+          del self._blocks[i]
+
+  def _result(self, i: int, fut: Future) -> bytes:
+    try:
+      return fut.result()
+    except Exception as e:
+      logger.debug(f"Block {i} failed, fetching it again: {e}")
+      with self._lock:
+        self._evict_failed(i, fut)
+        fut = self._submit(i)
+      return fut.result()
+
+  def _fetch(self, start: int, end: int) -> bytes:
+    start = 0 if start is None else start
+    end = self.size if end is None else min(end, self.size)
+    if start >= self.size or start >= end:
+      return b""
+    first, last = start // self.blocksize, (end - 1) // self.blocksize
+    with self._lock:
+      hits = sum(i in self._blocks for i in range(first, last + 1))
+      self.hit_count += hits
+      self.miss_count += last - first + 1 - hits
+      futures = [(i, self._submit(i)) for i in range(first, last + 1)]
+      if first in [self._last_block, self._last_block + 1]:
+        for i in range(last + 1, min(last + 1 + self.prefetch, self.nblocks)):
+          self._submit(i)
+      self._last_block = last
+    data = b"".join(self._result(i, f) for i, f in futures)
+    offset = first * self.blocksize
+    return data[start - offset: end - offset]
+
+  def close(self):
+    self._pool.shutdown(wait = False)
+
+
+class RelicBufferedFile(AbstractBufferedFile):
+  def __init__(self, fs: "RelicFileSystem", path: str, mode: str = "rb", block_size: int = RELIC_FS_BLOCK_SIZE, prefetch: int = 2, **kwargs):
+    self._url = None
+    self._tmp = None
+    super().__init__(fs, path, mode = mode, block_size = block_size, cache_type = "none", **kwargs)
+    if mode == "rb":
+      self.cache = _PrefetchBlockCache(self.blocksize, self._fetch_range, self.size, prefetch = prefetch)
+
+  def _get_url(self, refresh: bool = False) -> str:
+    if self._url is None or refresh:
+      relic, name = self.fs._split(self.path)
+      self._url = relic.get_url(name)
+    return self._url
+
+  def _fetch_range(self, start: int, end: int) -> bytes:
+    if end <= start:
+      return b""
+    headers = {"Range": f"bytes={start}-{end - 1}"}
+    r = _get_transfer_session().get(self._get_url(), headers = headers)
+    if r.status_code in [401, 403]:
+      # signed URLs expire, get a new one and try once more
+      r = _get_transfer_session().get(self._get_url(refresh = True), headers = headers)
+    if r.status_code == 416:
+      # the listing reports empty files with a size of 1, there is nothing to read
+      return b""
+    r.raise_for_status()
+    if r.status_code == 200:
+      # server does not support range requests and sent the entire file
+      return r.content[start:end]
+    return r.content
+
+  def _initiate_upload(self):
+    self._tmp = SpooledTemporaryFile(max_size = int(env.NBOX_RELICS_SPILL_SIZE(RELICS_SPILL_SIZE)), prefix = "relic_fs_")
+
+  def _upload_chunk(self, final: bool = False):
+    # signed POST uploads are single shot, so spool the chunks and upload once the file is closed
+    self._tmp.write(self.buffer.getvalue())
+    if final:
+      try:
+        size = self._tmp.tell()
+        self._tmp.seek(0)
+        relic, name = self.fs._split(self.path)
+        relic.put_stream(self._tmp, name, size)
+      finally:
+        self._tmp.close()
+    return True
+
+  def close(self):
+    cache = getattr(self, "cache", None)
+    super().close()
+    if isinstance(cache, _PrefetchBlockCache):
+      cache.close()
+
+
+class RelicFileSystem(AbstractFileSystem):
+  protocol = "relic"
+  root_marker = ""
+
+  def __init__(self, workspace_id: str = "", block_size: int = RELIC_FS_BLOCK_SIZE, prefetch: int = 2, **kwargs):
+    """``fsspec`` compatible filesystem for NBX-Relics, the first part of every path is the relic name.
+
+    Args:
+      workspace_id (str): The workspace ID, if not provided, will be one in global config.
+      block_size (int): Size of each range request, also the unit for the block cache
+      prefetch (int): Number of blocks to read ahead when reading sequentially, 0 disables it
+    """
+    if fsspec is None:
+      raise ImportError("fsspec is not installed, pip install fsspec")
+    super().__init__(**kwargs)
+    self.workspace_id = workspace_id
+    self.block_size = block_size
+    self.prefetch = prefetch
+    self._relics: Dict[str, RelicsNBX] = {}
+
+  def _split(self, path: str):
+    path = self._strip_protocol(path)
+    relic_name, _, name = path.partition("/")
+    if relic_name not in self._relics:
+      self._relics[relic_name] = RelicsNBX(relic_name, self.workspace_id)
+    return self._relics[relic_name], name
+
+  @staticmethod
+  def _info(relic_name: str, f: RelicFile) -> dict:
+    return {
+      "name": f"{relic_name}/{f.name.strip('/')}",
+      "size": f.size,
+      "type": "directory" if f.type == RelicFile.RelicType.FOLDER else "file",
+      "last_modified": f.last_modified,
+    }
+
+  def ls(self, path: str, detail: bool = True, **kwargs) -> List:
+    path = self._strip_protocol(path).rstrip("/")
+    relic, prefix = self._split(path)
+    relic_name = relic.relic_name
+    prefix = prefix.strip("/")
+
+    entries = {}
+    for f in relic._list_prefix(prefix):
+      name = f.name.strip("/")
+      rest = name[len(prefix):].lstrip("/") if prefix else name
+      if "/" in rest:
+        # the listing can contain nested files, show them as the folder directly under this prefix
+        child = f"{relic_name}/{prefix}/{rest.split('/')[0]}" if prefix else f"{relic_name}/{rest.split('/')[0]}"
+        entries.setdefault(child, {"name": child, "size": 0, "type": "directory"})
+      else:
+        info = self._info(relic_name, f)
+        entries[info["name"]] = info
+
+    if not entries and prefix:
+      # ls on a file returns the file itself
+      f = relic._stat(prefix)
+      if f is not None:
+        entries[path] = self._info(relic_name, f)
+    out = sorted(entries.values(), key = lambda x: x["name"])
+    return out if detail else [x["name"] for x in out]
+
+  def info(self, path: str, **kwargs) -> dict:
+    path = self._strip_protocol(path).rstrip("/")
+    relic, name = self._split(path)
+    if not name:
+      return {"name": path, "size": 0, "type": "directory"}
+    f = relic._stat(name)
+    if f is not None:
+      return self._info(relic.relic_name, f)
+    if self.ls(path, detail = False):
+      return {"name": path, "size": 0, "type": "directory"}
+    raise FileNotFoundError(path)
+
+  def _open(self, path: str, mode: str = "rb", block_size: int = None, autocommit: bool = True, cache_options = None, **kwargs):
+    if mode not in ["rb", "wb"]:
+      raise ValueError(f"Only 'rb' and 'wb' modes are supported, got '{mode}'")
+    return RelicBufferedFile(
+      self,
+      path,
+      mode = mode,
+      block_size = block_size or self.block_size,
+      prefetch = self.prefetch,
+      autocommit = autocommit,
+      **kwargs
+    )
+
+  def _rm(self, path: str):
+    relic, name = self._split(path)
+    relic.rm(name)
+
+  def rm_file(self, path: str):
+    self._rm(path)
+    self.invalidate_cache(path)
+
+
+if fsspec is not None:
+  fsspec.register_implementation(RelicFileSystem.protocol, RelicFileSystem, clobber = True)
+else:
+  logger.debug("fsspec is not installed, relic:// paths will not be available")
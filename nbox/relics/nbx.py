@@ -1,15 +1,23 @@
 """
 This is the code for NBX-Relics which is a simple file system for your organisation.
 """
+import io
 import os
-import cloudpickle
+import json
+import time
+import shutil
 import requests
+import threading
 import tabulate
-from hashlib import md5
-from typing import List
+from hashlib import sha256
+from uuid import uuid4
+from tempfile import mkstemp, SpooledTemporaryFile
+from typing import List, Dict, Any, Optional, Tuple
 from copy import deepcopy
 from functools import lru_cache
+from requests.adapters import HTTPAdapter
 
+import nbox.utils as U
 from nbox.auth import secret
 from nbox.init import nbox_ws_v1
 from nbox.utils import logger, env
@@ -23,15 +31,24 @@ from nbox.sublime.relics_rpc_client import (
   BucketMetadata
 )
 from nbox.relics.base import BaseStore
+from nbox.relics.cache import RelicCache
+from nbox.relics.codec import dump_object, load_object
 from nbox.auth import ConfigString, secret
 
+def _clean_path(path: str) -> str:
+  """Name of ``path`` on a relic: without a leading ``./`` and the slashes around it. Unlike ``strip("./")`` this
+  keeps the dots of names like ``.nbx_manifest.json``"""
+  while path.startswith("./"):
+    path = path[2:]
+  path = path.strip("/")
+  return "" if path == "." else path
+
 def get_relic_file(fpath: str, username: str, workspace_id: str):
   # assert os.path.exists(fpath), f"File {fpath} does not exist"
   # assert os.path.isfile(fpath), f"File {fpath} is not a file"
 
-  # clean up fpath, remove any trailing slashes
-  # trim any . or / from prefix and suffix
-  fpath_cleaned = fpath.strip("./")
+  # clean up fpath, remove the leading ./ and any slashes around it
+  fpath_cleaned = _clean_path(fpath)
 
   extra = {}
   if os.path.exists(fpath):
@@ -50,16 +67,42 @@ def get_relic_file(fpath: str, username: str, workspace_id: str):
   )
 
 
+# number of parallel transfers in the bulk APIs, this is also the size of the connection pool
+RELICS_MAX_WORKERS = 16
+
+# the bulk APIs process the files in chunks so that very large lists do not create futures all at once
+RELICS_CHUNK_SIZE = 256
+
+# objects up to these many bytes are pickled in memory for put_object, larger ones are spilled to disk
+RELICS_SPILL_SIZE = 1 << 28
+
+
+def _pooled_adapter() -> HTTPAdapter:
+  return HTTPAdapter(pool_connections = RELICS_MAX_WORKERS, pool_maxsize = RELICS_MAX_WORKERS)
+
+
 @lru_cache()
 def _get_stub():
   # url = "http://0.0.0.0:8081/relics" # debug
   url = secret.get("nbx_url") + "/relics"
   logger.debug("Connecting to RelicStore at: " + url)
   session = deepcopy(nbox_ws_v1._session)
+  session.mount("https://", _pooled_adapter())
+  session.mount("http://", _pooled_adapter())
   stub = RelicStore_Stub(url, session)
   return stub
 
 
+@lru_cache()
+def _get_transfer_session() -> requests.Session:
+  """All the uploads and downloads to the signed URLs go through this session, so the TCP + TLS connections
+  to the bucket are reused instead of being made for each file."""
+  session = requests.Session()
+  session.mount("https://", _pooled_adapter())
+  session.mount("http://", _pooled_adapter())
+  return session
+
+
 def print_relics(workspace_id: str = ""):
   stub = _get_stub()
   workspace_id = workspace_id or secret.get(ConfigString.workspace_id)
@@ -71,6 +114,132 @@ def print_relics(workspace_id: str = ""):
     logger.info(l)
 
 
+# name of the manifest that ``RelicsNBX.sync`` keeps at the root of every synced prefix
+MANIFEST_NAME = ".nbx_manifest.json"
+
+# ``RelicsNBX.snapshot`` keeps the blobs at ``_nbx/objects/{sha[:2]}/{sha}``, the manifest of every version at
+# ``_nbx/snapshots/{version_id}.json`` and the known digests of the files at ``_nbx/digests.json``
+SNAPSHOT_ROOT = "_nbx"
+
+
+def hash_file(fpath: str, chunk_size: int = 1 << 20) -> str:
+  """sha256 of the contents of this file, read in chunks so large files do not need to fit in memory"""
+  h = sha256()
+  with open(fpath, "rb") as f:
+    for chunk in iter(lambda: f.read(chunk_size), b""):
+      h.update(chunk)
+  return h.hexdigest()
+
+
+def get_local_manifest(folder: str, workers: int = RELICS_MAX_WORKERS) -> Dict[str, Dict[str, Any]]:
+  """Build the manifest ``{relative_path: {size, mtime, sha256}}`` of all the files in this folder. Hashing is done in
+  parallel threads and the hashes are remembered in ``{NBOX_HOME_DIR}/.cache/sync`` so unchanged files (same size
+  and mtime) are not hashed again."""
+  folder = os.path.abspath(folder)
+  hash_cache_fp = _hash_cache_path(folder)
+  hash_cache = {}
+  if os.path.exists(hash_cache_fp):
+    with open(hash_cache_fp, "r") as f:
+      hash_cache = json.load(f)
+
+  manifest = {}
+  to_hash = []
+  for fp in U.get_files_in_folder(folder):
+    rel = os.path.relpath(fp, folder).replace(os.sep, "/")
+    st = os.stat(fp)
+    manifest[rel] = {"size": st.st_size, "mtime": int(st.st_mtime)}
+    cached = hash_cache.get(rel, {})
+    if cached.get("size") == st.st_size and cached.get("mtime") == int(st.st_mtime):
+      manifest[rel]["sha256"] = cached["sha256"]
+    else:
+      to_hash.append(rel)
+
+  if to_hash:
+    logger.debug(f"Hashing {len(to_hash)} files in {folder}")
+    hashes = U.threaded_map(hash_file, [[os.path.join(folder, rel)] for rel in to_hash], max_threads = workers, _name = "relics_hash")
+    for rel, h in zip(to_hash, hashes):
+      manifest[rel]["sha256"] = h
+
+  _write_json_atomic(hash_cache_fp, manifest)
+  return manifest
+
+
+def _hash_cache_path(folder: str) -> str:
+  return os.path.join(env.NBOX_HOME_DIR(), ".cache", "sync", sha256(os.path.abspath(folder).encode("utf-8")).hexdigest() + ".json")
+
+
+def _blob_name(digest: str) -> str:
+  return f"{SNAPSHOT_ROOT}/objects/{digest[:2]}/{digest}"
+
+
+def _place_file(src: str, dst: str, link: bool = False) -> None:
+  """Put a copy of ``src`` at ``dst``, or with ``link`` a hard link of it (a copy when they are on different file
+  systems). The file is written next to ``dst`` and moved over it, an existing ``dst`` could be a link of a cache
+  entry and writing into it would change that entry."""
+  tmp = f"{dst}.{uuid4().hex[:8]}.tmp"
+  try:
+    try:
+      if not link:
+        raise OSError
+      os.link(src, tmp)
+    except OSError:
+      shutil.copyfile(src, tmp)
+    os.replace(tmp, dst)
+  except BaseException:
+    if os.path.lexists(tmp):
+      os.remove(tmp)
+    raise
+
+
+def _write_json_atomic(fpath: str, data) -> None:
+  os.makedirs(os.path.dirname(fpath), exist_ok = True)
+  fd, tmp = mkstemp(dir = os.path.dirname(fpath), suffix = ".tmp")
+  with os.fdopen(fd, "w") as f:
+    json.dump(data, f)
+  os.replace(tmp, fpath)
+
+
+class _MultipartStream:
+  """``multipart/form-data`` body for the signed POST uploads that reads the file in chunks while the request is
+  being sent. It has a length so requests sends a ``Content-Length`` instead of chunked encoding, which S3 does
+  not accept for POST uploads."""
+  def __init__(self, fields: Dict[str, str], filename: str, fileobj, size: int):
+    boundary = uuid4().hex
+    head = b""
+    for k, v in fields.items():
+      head += f'--{boundary}\r\nContent-Disposition: form-data; name="{k}"\r\n\r\n{v}\r\n'.encode("utf-8")
+    head += (
+      f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+      "Content-Type: application/octet-stream\r\n\r\n"
+    ).encode("utf-8")
+    tail = f"\r\n--{boundary}--\r\n".encode("utf-8")
+    self.content_type = f"multipart/form-data; boundary={boundary}"
+    self._len = len(head) + size + len(tail)
+    self._parts = [io.BytesIO(head), fileobj, io.BytesIO(tail)]
+
+  def __len__(self):
+    return self._len
+
+  def __iter__(self):
+    while True:
+      chunk = self.read(1 << 16)
+      if not chunk:
+        break
+      yield chunk
+
+  def read(self, n: int = -1) -> bytes:
+    out = []
+    while self._parts and n != 0:
+      chunk = self._parts[0].read(n)
+      if not chunk:
+        self._parts.pop(0)
+        continue
+      out.append(chunk)
+      if n > 0:
+        n -= len(chunk)
+    return b"".join(out)
+
+
 class RelicsNBX(BaseStore):
   list = staticmethod(print_relics)
 
@@ -85,6 +254,8 @@ class RelicsNBX(BaseStore):
     region: str = "",
     nbx_resource_id: str = "",
     nbx_integration_token: str = "",
+    cache: bool = True,
+    meta_ttl: float = 5.0,
   ):
     """
     The client for NBX-Relics.
@@ -94,11 +265,31 @@ class RelicsNBX(BaseStore):
       workspace_id (str): The workspace ID, if not provided, will be one in global config.
       create (bool): Create the relic if it does not exist.
       prefix (str): The prefix to use for all files in this relic. If provided all the files are uploaded and downloaded with this prefix.
+      cache (bool): Read files through the local ``RelicCache``, files that have not changed on the relic are not downloaded again.
+      meta_ttl (float): Seconds for which the file listings are trusted, ``has`` calls within this window do not call the server.
     """
     self.workspace_id = workspace_id or secret.get(ConfigString.workspace_id)
     self.relic_name = relic_name
     self.username = secret.get("username") # if its in the job then this part will automatically be filled
     self.prefix = prefix.strip("/")
+
+    # metadata of the files we know about, filled by listing the prefixes and by our own puts. ``_known`` is
+    # {full_name: (time, RelicFile or None if it came from a put)} and ``_listed`` is {prefix: time}. Both are
+    # updated from the bulk worker threads, so they are only touched under ``_known_lock``
+    self.meta_ttl = meta_ttl
+    self._known: Dict[str, Tuple[float, Optional[RelicFile]]] = {}
+    self._listed: Dict[str, float] = {}
+    self._known_lock = threading.Lock()
+
+    # in offline mode there is no server to talk to, only the files already in the cache can be read
+    self.offline = bool(env.NBOX_RELICS_OFFLINE())
+    self.cache = RelicCache() if (cache or self.offline) else None
+    if self.offline:
+      logger.warning(f"Relics are offline, only cached files of '{relic_name}' are available")
+      self.stub = None
+      self.relic = RelicProto(workspace_id = self.workspace_id, name = relic_name)
+      return
+
     self.stub = _get_stub()
     _relic = self.stub.get_relic_details(RelicProto(workspace_id=self.workspace_id, name=relic_name,))
     # print("asdfasdfasdfasdf", _relic, not _relic and create)
@@ -123,14 +314,151 @@ class RelicsNBX(BaseStore):
   def __repr__(self):
     return f"RelicStore({self.workspace_id}, {self.relic_name}, {'CONNECTED' if self.relic else 'NOT CONNECTED'})"
 
+  def _remote_name(self, path: str) -> str:
+    # the name of the file on the relic, including the prefix
+    path = _clean_path(path)
+    if self.prefix:
+      path = f"{self.prefix}/{path}"
+    return path
+
+  def _cache_key(self, full_name: str) -> str:
+    return f"{self.workspace_id}/{self.relic_name}/{full_name}"
+
+  def _list_prefix(self, prefix: str) -> List[RelicFile]:
+    """List all the files directly under this full prefix, going through all the pages, and refresh the known files"""
+    prefix = prefix.strip("/")
+    now = time.monotonic()
+    files = []
+    seen = set()
+    page_no = 0
+    while True:
+      out = self.stub.list_relic_files(
+        ListRelicFilesRequest(
+          workspace_id=self.workspace_id,
+          relic_name=self.relic_name,
+          prefix=prefix,
+          page_no=page_no,
+        )
+      )
+      if out is None:
+        raise ValueError(f"Could not list files in relic '{self.relic_name}' at '{prefix}'")
+      new_files = [f for f in out.files if f.name.strip("/") not in seen]
+      if not new_files:
+        break
+      files.extend(new_files)
+      seen.update(f.name.strip("/") for f in new_files)
+      if len(files) >= out.total_files:
+        break
+      page_no += 1
+
+    # anything we knew about under this prefix which is not in the listing anymore was deleted, entries from puts
+    # that finished after the listing started are newer than the listing and are kept
+    with self._known_lock:
+      for name in [n for n in self._known if os.path.dirname(n) == prefix and n not in seen]:
+        if self._known[name][0] <= now:
+          self._known.pop(name)
+      for f in files:
+        name = f.name.strip("/")
+        if self._known.get(name, (now,))[0] <= now:
+          self._known[name] = (now, f)
+      self._listed[prefix] = now
+    return files
+
+  def _stat(self, full_name: str) -> Optional[RelicFile]:
+    """Get the ``RelicFile`` for the file at this full name (prefix included), returns ``None`` if not found"""
+    full_name = full_name.strip("/")
+    prefix, file_name = os.path.split(full_name)
+    now = time.monotonic()
+    with self._known_lock:
+      if now - self._listed.get(prefix, -self.meta_ttl) < self.meta_ttl:
+        _, f = self._known.get(full_name, (None, None))
+        if f is not None or full_name not in self._known:
+          return f
+
+    out = self.stub.list_relic_files(
+      ListRelicFilesRequest(
+        workspace_id=self.workspace_id,
+        relic_name=self.relic_name,
+        prefix=prefix,
+        file_name=file_name
+      )
+    )
+    if out is None:
+      return None
+    for f in out.files:
+      if f.name.strip("/") == full_name:
+        with self._known_lock:
+          self._known[full_name] = (now, f)
+        return f
+    with self._known_lock:
+      self._known.pop(full_name, None)
+    return None
+
+  def _walk(self, prefix: str) -> List[RelicFile]:
+    """All the files under this full prefix, going into the sub folders"""
+    files = []
+    todo = [prefix.strip("/")]
+    while todo:
+      for f in self._list_prefix(todo.pop()):
+        if f.type == RelicFile.RelicType.FOLDER:
+          todo.append(f.name.strip("/"))
+        else:
+          files.append(f)
+    return files
+
+  def _get_json(self, key: str, default = None):
+    if not self.has(key):
+      return default
+    fd, tmp = mkstemp(prefix = "relic_")
+    os.close(fd)
+    try:
+      self.get_from(tmp, key)
+      with open(tmp, "r") as f:
+        return json.load(f)
+    finally:
+      os.remove(tmp)
+
+  def _put_json(self, key: str, data) -> None:
+    data = json.dumps(data).encode("utf-8")
+    self.put_stream(io.BytesIO(data), key, len(data))
+
+  def _get_cached(self, remote_path: str, remote: RelicFile = None) -> str:
+    """Read the file at ``remote_path`` through the local cache and return the path of the cached file. The entry is
+    validated against ``remote`` if it is passed (ex. from a listing of the whole folder), else the file is looked up."""
+    full_name = self._remote_name(remote_path)
+    key = self._cache_key(full_name)
+    if self.offline:
+      path = self.cache.lookup(key)
+      if path is None:
+        raise ValueError(f"Relics are offline and '{full_name}' is not in the local cache")
+      return path
+
+    if remote is None:
+      remote = self._stat(full_name)
+    if remote is None:
+      raise ValueError(f"Could not find '{full_name}' in relic '{self.relic_name}'")
+    path = self.cache.lookup(key, remote)
+    if path is None:
+      relic_file = RelicFile(name = _clean_path(remote_path), relic_name = self.relic_name, workspace_id = self.workspace_id)
+      path = self.cache.fill(key, lambda tmp_path: self._download_relic_file(tmp_path, relic_file), remote)
+    return path
+
   def _upload_relic_file(self, local_path: str, relic_file: RelicFile):
+    with open(local_path, "rb") as f:
+      self._upload_stream(f, os.fstat(f.fileno()).st_size, relic_file, desc = local_path)
+
+  def _upload_stream(self, fileobj, size: int, relic_file: RelicFile, desc: str = ""):
+    """Upload ``size`` bytes read from ``fileobj``, the body is streamed so nothing is loaded in memory"""
     if not relic_file.relic_name:
       raise ValueError("relic_name not set in RelicFile")
+    if self.offline:
+      raise ValueError("Relics are offline, cannot upload files")
     if self.prefix:
       relic_file.name = f"{self.prefix}/{relic_file.name}"
 
     # ideally this is a lot like what happens in nbox
-    logger.debug(f"Uploading {local_path} to {relic_file.name}")
+    desc = desc or relic_file.name
+    logger.debug(f"Uploading {desc} to {relic_file.name}")
     out = self.stub.create_file(_RelicFile = relic_file,)
     if not out.url:
       raise Exception("Could not get link")
@@ -138,19 +466,22 @@ class RelicsNBX(BaseStore):
     # do not perform merge here because "url" might get stored in MongoDB
     # relic_file.MergeFrom(out)
     if out.size > 10 ** 7:
-      logger.warning(f"File {local_path} is large ({out.size} bytes), this might take a while")
+      logger.warning(f"File {desc} is large ({out.size} bytes), this might take a while")
 
-    # TODO: @yashbonde use poster to upload files, requests doesn't support multipart uploads
-    # https://stackoverflow.com/questions/15973204/using-python-requests-to-bridge-a-file-without-loading-into-memory
     logger.debug(f"URL: {out.url}")
     logger.debug(f"body: {out.body}")
-    r = requests.post(
+    body = _MultipartStream(out.body, out.body["key"], fileobj, size)
+    r = _get_transfer_session().post(
       url = out.url,
-      data = out.body,
-      files = {"file": (out.body["key"], open(local_path, "rb"))}
+      data = body,
+      headers = {"Content-Type": body.content_type},
     )
     logger.debug(f"Upload status: {r.status_code}")
     r.raise_for_status()
+    with self._known_lock:
+      self._known[relic_file.name.strip("/")] = (time.monotonic(), None)
+    if self.cache is not None:
+      self.cache.invalidate(self._cache_key(relic_file.name))
 
   def _download_relic_file(self, local_path: str, relic_file: RelicFile):
     if self.relic is None:
@@ -167,16 +498,24 @@ class RelicsNBX(BaseStore):
     # do not perform merge here because "url" might get stored in MongoDB
     # relic_file.MergeFrom(out)
     logger.debug(f"URL: {out.url}")
-    with requests.get(out.url, stream=True) as r:
-      r.raise_for_status()
-      total_size = 0
-      with open(local_path, 'wb') as f:
-        for chunk in r.iter_content(chunk_size=8192): 
-          # If you have chunk encoded response uncomment if
-          # and set chunk_size parameter to None.
-          #if chunk: 
-          f.write(chunk)
-          total_size += len(chunk)
+    # write next to the file and move it over, ``local_path`` could be a hard link of a cache entry
+    tmp = f"{local_path}.{uuid4().hex[:8]}.tmp"
+    try:
+      with _get_transfer_session().get(out.url, stream=True) as r:
+        r.raise_for_status()
+        total_size = 0
+        with open(tmp, 'wb') as f:
+          for chunk in r.iter_content(chunk_size=8192): 
+            # If you have chunk encoded response uncomment if
+            # and set chunk_size parameter to None.
+            #if chunk: 
+            f.write(chunk)
+            total_size += len(chunk)
+      os.replace(tmp, local_path)
+    except BaseException:
+      if os.path.exists(tmp):
+        os.remove(tmp)
+      raise
     logger.debug(f"Download '{local_path}' status: OK ({total_size//1024} KB)")
 
   """
@@ -207,21 +546,55 @@ class RelicsNBX(BaseStore):
     relic_file.name = remote_path # override the name
     self._upload_relic_file(local_path, relic_file)
 
-  def get(self, local_path: str):
-    """Get the file at this path from the relic"""
+  def put_stream(self, fileobj, remote_path: str, size: int) -> None:
+    """Put ``size`` bytes read from the file-like ``fileobj`` at ``remote_path`` without writing them to disk"""
+    if self.relic is None:
+      raise ValueError("Relic does not exist, pass create=True")
+    relic_file = RelicFile(
+      name = _clean_path(remote_path),
+      username = self.username,
+      type = RelicFile.RelicType.FILE,
+      workspace_id = self.workspace_id,
+      relic_name = self.relic_name,
+      created_on = int(time.time()),
+      last_modified = int(time.time()),
+      size = max(1, size),
+    )
+    self._upload_stream(fileobj, size, relic_file, desc = remote_path)
+
+  def get(self, local_path: str, link: bool = False):
+    """Get the file at this path from the relic, see ``get_from`` for ``link``"""
     if self.relic is None:
       raise ValueError("Relic does not exist, pass create=True")
     logger.debug(f"Getting file: {local_path}")
-    relic_file = RelicFile(name = local_path.strip("./"),)
-    relic_file.relic_name = self.relic_name
-    relic_file.workspace_id = self.workspace_id
-    self._download_relic_file(local_path, relic_file)
+    self.get_from(local_path, local_path, link = link)
 
-  def get_from(self, local_path: str, remote_path: str) -> None:
+  def get_from(self, local_path: str, remote_path: str, link: bool = False) -> None:
+    """Get the file at ``remote_path`` to ``local_path``.
+
+    Args:
+      local_path (str): Path to write the file to
+      remote_path (str): Path of the file in the relic
+      link (bool, optional): With the cache, make ``local_path`` a hard link of the cache entry instead of a copy.
+        This saves a copy of large files but the file is read-only, replace it instead of writing into it.
+    """
+    self._get_from(local_path, remote_path, link = link)
+
+  def _get_from(
+    self,
+    local_path: str,
+    remote_path: str,
+    remote: RelicFile = None,
+    cached: bool = True,
+    link: bool = False,
+  ) -> None:
     if self.relic is None:
       raise ValueError("Relic does not exist, pass create=True")
     logger.debug(f"Getting file: {local_path} from {remote_path}")
-    relic_file = RelicFile(name = remote_path.strip("./"),)
+    if self.cache is not None and (cached or self.offline):
+      _place_file(self._get_cached(remote_path, remote), local_path, link = link)
+      return
+    relic_file = RelicFile(name = _clean_path(remote_path),)
     relic_file.relic_name = self.relic_name
     relic_file.workspace_id = self.workspace_id
     self._download_relic_file(local_path, relic_file)
@@ -233,26 +606,356 @@ class RelicsNBX(BaseStore):
     logger.debug(f"Getting file: {local_path}")
     relic_file = get_relic_file(local_path, self.username, self.workspace_id)
     relic_file.relic_name = self.relic_name
+    relic_file.name = self._remote_name(local_path)
+    if self.offline:
+      raise ValueError("Relics are offline, cannot delete files")
     out = self.stub.delete_relic_file(relic_file)
     if not out.success:
       logger.error(out.message)
       raise ValueError("Could not delete file")
+    with self._known_lock:
+      self._known.pop(self._remote_name(local_path), None)
+    if self.cache is not None:
+      self.cache.invalidate(self._cache_key(self._remote_name(local_path)))
 
-  def has(self, path: str):
-    prefix, file_name = os.path.split(path)
-    out = self.stub.list_relic_files(
-      ListRelicFilesRequest(
-        workspace_id=self.workspace_id,
-        relic_name=self.relic_name,
-        prefix=prefix,
-        file_name=file_name
+  """
+  Bulk APIs, these are the ones to use when moving a lot of files. Each file still needs its own signed URL, but the
+  calls are made in parallel over a shared connection pool so the total time is bound by the bandwidth and not by
+  the round trips.
+  """
+
+  def put_many(self, local_paths: List[str], remote_paths: List[str] = None, *, workers: int = RELICS_MAX_WORKERS):
+    """Put all the files at these paths into the relic, optionally at ``remote_paths``"""
+    if self.relic is None:
+      raise ValueError("Relic does not exist, pass create=True")
+    remote_paths = remote_paths or local_paths
+    if len(remote_paths) != len(local_paths):
+      raise ValueError(f"Got {len(local_paths)} local paths but {len(remote_paths)} remote paths")
+    logger.debug(f"Putting {len(local_paths)} files")
+    items = list(zip(local_paths, remote_paths))
+    for i in range(0, len(items), RELICS_CHUNK_SIZE):
+      U.threaded_map(
+        self.put_to,
+        items[i:i+RELICS_CHUNK_SIZE],
+        max_threads = min(workers, RELICS_MAX_WORKERS),
+        _name = "relics_put",
+      )
+
+  def get_many(
+    self,
+    keys: List[str],
+    local_paths: List[str] = None,
+    *,
+    workers: int = RELICS_MAX_WORKERS,
+    link: bool = False,
+  ):
+    """Get all the files at ``keys`` from the relic, optionally to ``local_paths``. Each folder is listed once and the
+    cache is validated against that listing, ``link`` is the same as in ``get_from``."""
+    self._get_many(keys, local_paths, workers = workers, cached = True, link = link)
+
+  def _get_many(
+    self,
+    keys: List[str],
+    local_paths: List[str] = None,
+    *,
+    workers: int,
+    cached: bool,
+    link: bool = False,
+  ):
+    if self.relic is None:
+      raise ValueError("Relic does not exist, pass create=True")
+    local_paths = local_paths or keys
+    if len(local_paths) != len(keys):
+      raise ValueError(f"Got {len(keys)} keys but {len(local_paths)} local paths")
+    logger.debug(f"Getting {len(keys)} files")
+    for folder in set(os.path.dirname(x) for x in local_paths):
+      if folder:
+        os.makedirs(folder, exist_ok = True)
+
+    # one listing per folder instead of a lookup per file
+    remotes: Dict[str, RelicFile] = {}
+    if self.cache is not None and cached and not self.offline:
+      by_prefix: Dict[str, List[str]] = {}
+      for k in keys:
+        full_name = self._remote_name(k)
+        by_prefix.setdefault(os.path.dirname(full_name), []).append(full_name)
+      for prefix, names in by_prefix.items():
+        if len(names) == 1:
+          continue # a single lookup is as cheap as the listing
+        listed = {f.name.strip("/"): f for f in self._list_prefix(prefix)}
+        remotes.update({n: listed[n] for n in names if n in listed})
+
+    items = [(l, k, remotes.get(self._remote_name(k)), cached, link) for l, k in zip(local_paths, keys)]
+    for i in range(0, len(items), RELICS_CHUNK_SIZE):
+      U.threaded_map(
+        self._get_from,
+        items[i:i+RELICS_CHUNK_SIZE],
+        max_threads = min(workers, RELICS_MAX_WORKERS),
+        _name = "relics_get",
+      )
+
+  def put_objects(self, objects: Dict[str, Any], *, workers: int = RELICS_MAX_WORKERS):
+    """Put many python objects, ``objects`` is a dictionary of ``{key: py_object}``"""
+    if self.relic is None:
+      raise ValueError("Relic does not exist, pass create=True")
+    items = list(objects.items())
+    for i in range(0, len(items), RELICS_CHUNK_SIZE):
+      U.threaded_map(
+        self.put_object,
+        items[i:i+RELICS_CHUNK_SIZE],
+        max_threads = min(workers, RELICS_MAX_WORKERS),
+        _name = "relics_put_object",
       )
+
+  def has(self, path: str):
+    """Check if the file at this path exists in the relic. Files from our own ``put`` and recent listings are
+    answered locally for ``meta_ttl`` seconds."""
+    full_name = self._remote_name(path)
+    if self.offline:
+      return self.cache.lookup(self._cache_key(full_name)) is not None
+    with self._known_lock:
+      ts, _ = self._known.get(full_name, (None, None))
+    if ts is not None and time.monotonic() - ts < self.meta_ttl:
+      return True
+    return self._stat(full_name) is not None
+
+  def has_many(self, paths: List[str]) -> List[bool]:
+    """Check if each of the files exists in the relic. The paths are grouped by their folder and each folder is
+    listed at most once, so checking 100 files in the same folder costs a single call."""
+    if self.offline:
+      return [self.has(p) for p in paths]
+    now = time.monotonic()
+    by_prefix: Dict[str, List[str]] = {}
+    for p in paths:
+      full_name = self._remote_name(p)
+      with self._known_lock:
+        ts, _ = self._known.get(full_name, (None, None))
+      if ts is not None and now - ts < self.meta_ttl:
+        continue
+      by_prefix.setdefault(os.path.dirname(full_name), []).append(full_name)
+    for prefix, names in by_prefix.items():
+      with self._known_lock:
+        listed_at = self._listed.get(prefix, -self.meta_ttl)
+      if len(names) == 1:
+        self._stat(names[0])
+      elif now - listed_at >= self.meta_ttl:
+        self._list_prefix(prefix)
+    with self._known_lock:
+      return [self._remote_name(p) in self._known for p in paths]
+
+
+  """
+  Sync keeps a folder on the relic in the same state as a local folder. A manifest of sizes and hashes is stored
+  next to the files, so only the files that changed are moved.
+  """
+
+  def get_remote_manifest(self, remote_prefix: str) -> Dict[str, Dict[str, Any]]:
+    """Get the manifest of this prefix as written by the last ``sync``, empty if the prefix was never synced"""
+    return self._get_json(f"{remote_prefix.strip('/')}/{MANIFEST_NAME}".lstrip("/"), {})
+
+  def sync(
+    self,
+    local_dir: str,
+    remote_prefix: str,
+    direction: str = "up",
+    delete: bool = False,
+    dry_run: bool = False,
+    *,
+    workers: int = RELICS_MAX_WORKERS,
+  ) -> Dict[str, int]:
+    """Sync a local folder with a prefix on the relic, only the files whose contents changed are transferred.
+
+    Args:
+      local_dir (str): The local folder
+      remote_prefix (str): The folder on the relic
+      direction (str): ``up`` to make the relic look like the local folder, ``down`` for the opposite
+      delete (bool): Delete the files on the destination that are not on the source
+      dry_run (bool): Only log what would be done
+
+    Returns:
+      Dict[str, int]: number of files ``transferred``, ``deleted`` and ``skipped``
+    """
+    if direction not in ["up", "down"]:
+      raise ValueError(f"direction must be 'up' or 'down', got '{direction}'")
+    remote_prefix = remote_prefix.strip("/")
+    _remote = lambda rel: f"{remote_prefix}/{rel}" if remote_prefix else rel
+
+    os.makedirs(local_dir, exist_ok = True)
+    local = get_local_manifest(local_dir, workers = workers)
+    remote = self.get_remote_manifest(remote_prefix)
+    if direction == "down" and not remote:
+      logger.warning(f"No manifest at '{remote_prefix}', was it uploaded with sync?")
+    src, dst = (local, remote) if direction == "up" else (remote, local)
+
+    changed = [rel for rel, meta in src.items() if dst.get(rel, {}).get("sha256") != meta["sha256"]]
+    extra = [rel for rel in dst if rel not in src] if delete else []
+    logger.info(f"sync {direction}: {len(changed)} changed, {len(src) - len(changed)} unchanged, {len(extra)} to delete")
+    if dry_run:
+      for rel in changed:
+        logger.info(f"  transfer: {rel}")
+      for rel in extra:
+        logger.info(f"    delete: {rel}")
+      return {"transferred": len(changed), "deleted": len(extra), "skipped": len(src) - len(changed)}
+
+    if direction == "up":
+      self.put_many([os.path.join(local_dir, rel) for rel in changed], [_remote(rel) for rel in changed], workers = workers)
+      for rel in extra:
+        self.rm(_remote(rel))
+
+      # the new manifest is the local one, without the mtimes which mean nothing on the other side
+      self._put_json(_remote(MANIFEST_NAME), {rel: {"size": m["size"], "sha256": m["sha256"]} for rel, m in local.items()})
+    else:
+      # a working folder, the files are downloaded straight to it and not through the cache
+      self._get_many([_remote(rel) for rel in changed], [os.path.join(local_dir, rel) for rel in changed], workers = workers, cached = False)
+      for rel in extra:
+        os.remove(os.path.join(local_dir, rel))
+        local.pop(rel)
+
+      # we already know the hashes of the files just downloaded, so they need not be hashed again
+      for rel in changed:
+        st = os.stat(os.path.join(local_dir, rel))
+        local[rel] = {"size": st.st_size, "mtime": int(st.st_mtime), "sha256": remote[rel]["sha256"]}
+      _write_json_atomic(_hash_cache_path(local_dir), local)
+
+    return {"transferred": len(changed), "deleted": len(extra), "skipped": len(src) - len(changed)}
+
+  def snapshot(self, prefix: str = "", *, workers: int = RELICS_MAX_WORKERS) -> str:
+    """Take a snapshot of all the files under ``prefix`` and return its version ID. The contents are stored once
+    by their sha256, files that are unchanged since an earlier snapshot (same size and last_modified) only cost
+    metadata. New contents are copied into the blob store once.
+
+    Args:
+      prefix (str): The folder on the relic
+
+    Returns:
+      str: the version ID to pass to ``checkout``
+    """
+    if self.relic is None:
+      raise ValueError("Relic does not exist, pass create=True")
+    prefix = prefix.strip("/")
+    root = self._remote_name(prefix) if prefix else self.prefix
+    skip = len(root) + 1 if root else 0
+    files = {
+      f.name.strip("/")[skip:]: f for f in self._walk(root)
+      if not (f.name.strip("/")[skip:].startswith(SNAPSHOT_ROOT + "/") or f.name.endswith(MANIFEST_NAME))
+    }
+    _remote = lambda rel: f"{prefix}/{rel}" if prefix else rel
+
+    # the digests of files are remembered against their size and last_modified
+    digests_key = f"{SNAPSHOT_ROOT}/digests.json"
+    digests = self._get_json(digests_key, {})
+    manifest = {}
+    to_hash = []
+    for rel, f in files.items():
+      known = digests.get(_remote(rel), {})
+      if known.get("size") == f.size and known.get("last_modified") == f.last_modified:
+        manifest[rel] = {"size": f.size, "sha256": known["sha256"]}
+      else:
+        to_hash.append(rel)
+
+    # known digests whose blob is missing are copied again
+    known_rels = list(manifest)
+    have_blob = self.has_many([_blob_name(manifest[rel]["sha256"]) for rel in known_rels])
+    to_hash.extend(rel for rel, h in zip(known_rels, have_blob) if not h)
+
+    def _copy(rel):
+      fd, tmp = mkstemp(prefix = "relic_")
+      os.close(fd)
+      try:
+        self._get_from(tmp, _remote(rel), files[rel], cached = False)
+        digest = hash_file(tmp)
+        if not self.has(_blob_name(digest)):
+          self.put_to(tmp, _blob_name(digest))
+        return digest, os.stat(tmp).st_size
+      finally:
+        os.remove(tmp)
+
+    if to_hash:
+      logger.info(f"Snapshot '{prefix}': copying {len(to_hash)} new files, {len(files) - len(to_hash)} unchanged")
+      for i in range(0, len(to_hash), RELICS_CHUNK_SIZE):
+        chunk = to_hash[i:i+RELICS_CHUNK_SIZE]
+        out = U.threaded_map(_copy, [[rel] for rel in chunk], max_threads = min(workers, RELICS_MAX_WORKERS), _name = "relics_snapshot")
+        for rel, (digest, size) in zip(chunk, out):
+          manifest[rel] = {"size": size, "sha256": digest}
+          digests[_remote(rel)] = {"size": files[rel].size, "last_modified": files[rel].last_modified, "sha256": digest}
+      self._put_json(digests_key, digests)
+
+    files_json = json.dumps(manifest, sort_keys = True)
+    version_id = sha256(f"{prefix}\n{files_json}".encode("utf-8")).hexdigest()[:16]
+    self._put_json(f"{SNAPSHOT_ROOT}/snapshots/{version_id}.json", {
+      "prefix": prefix,
+      "created_on": int(time.time()),
+      "files": manifest,
+    })
+    logger.info(f"Snapshot '{prefix}': {version_id} ({len(manifest)} files)")
+    return version_id
+
+  def snapshots(self) -> List[str]:
+    """List the version IDs of all the snapshots in this relic"""
+    files = self._list_prefix(self._remote_name(f"{SNAPSHOT_ROOT}/snapshots"))
+    return sorted(os.path.basename(f.name).rsplit(".", 1)[0] for f in files)
+
+  def checkout(
+    self,
+    version_id: str,
+    local_dir: str,
+    delete: bool = False,
+    *,
+    workers: int = RELICS_MAX_WORKERS,
+  ) -> Dict[str, int]:
+    """Make ``local_dir`` look like the snapshot ``version_id``, only the contents that are not already there are
+    downloaded and each distinct content is downloaded once.
+
+    Args:
+      version_id (str): ID returned by ``snapshot``
+      local_dir (str): The local folder
+      delete (bool): Delete the local files that are not in the snapshot
+
+    Returns:
+      Dict[str, int]: number of files ``transferred``, ``deleted`` and ``skipped``
+    """
+    snap = self._get_json(f"{SNAPSHOT_ROOT}/snapshots/{version_id}.json")
+    if snap is None:
+      raise ValueError(f"No snapshot '{version_id}' in relic '{self.relic_name}'")
+    files = snap["files"]
+
+    os.makedirs(local_dir, exist_ok = True)
+    local = get_local_manifest(local_dir, workers = workers)
+    changed = [rel for rel, meta in files.items() if local.get(rel, {}).get("sha256") != meta["sha256"]]
+    extra = [rel for rel in local if rel not in files] if delete else []
+
+    # download every digest once and copy it to the other paths with the same contents
+    local_by_digest = {m["sha256"]: rel for rel, m in local.items() if rel not in changed}
+    first = {}
+    for rel in changed:
+      digest = files[rel]["sha256"]
+      if digest not in local_by_digest:
+        first.setdefault(digest, rel)
+    self._get_many(
+      [_blob_name(d) for d in first],
+      [os.path.join(local_dir, rel) for rel in first.values()],
+      workers = workers,
+      cached = False,
     )
-    for f in out.files:
-      if f.name.strip("/") == path.strip("/"):
-        return True
-    return False
+    for rel in changed:
+      digest = files[rel]["sha256"]
+      src = first.get(digest) or local_by_digest[digest]
+      if src != rel:
+        os.makedirs(os.path.dirname(os.path.join(local_dir, rel)) or ".", exist_ok = True)
+        dst = os.path.join(local_dir, rel)
+        if os.path.lexists(dst):
+          os.remove(dst) # it could be a link of another file
+        shutil.copyfile(os.path.join(local_dir, src), dst)
+    for rel in extra:
+      os.remove(os.path.join(local_dir, rel))
+      local.pop(rel)
 
+    for rel in changed:
+      st = os.stat(os.path.join(local_dir, rel))
+      local[rel] = {"size": st.st_size, "mtime": int(st.st_mtime), "sha256": files[rel]["sha256"]}
+    _write_json_atomic(_hash_cache_path(local_dir), local)
+    logger.info(f"Checkout {version_id}: {len(first)} downloaded, {len(changed) - len(first)} copied locally, {len(files) - len(changed)} unchanged")
+    return {"transferred": len(changed), "deleted": len(extra), "skipped": len(files) - len(changed)}
 
   """
   There are other convinience methods provided to keep consistency between the different types of relics. Note
@@ -260,27 +963,31 @@ class RelicsNBX(BaseStore):
   in common with all.
   """
 
-  def put_object(self, key: str, py_object):
-    """wrapper function for putting a python object"""
-    # we will cache the object in the local file system
-    cache_dir = os.path.join(env.NBOX_HOME_DIR(), ".cache")
-    if not os.path.exists(cache_dir):
-      os.makedirs(cache_dir)
-    _key = os.path.join(cache_dir, md5(key.encode()).hexdigest())
-    with open(_key, "wb") as f:
-      cloudpickle.dump(py_object, f)
-    self.put_to(_key, key)
-
-  def get_object(self, key: str):
-    """wrapper function for getting a python object"""
-    cache_dir = os.path.join(env.NBOX_HOME_DIR(), ".cache")
-    if not os.path.exists(cache_dir):
-      os.makedirs(cache_dir)
-    _key = os.path.join(cache_dir, md5(key.encode()).hexdigest())
-    self.get_from(_key, key)
-    with open(_key, "rb") as f:
-      out = cloudpickle.load(f)
-    return out
+  def put_object(self, key: str, py_object, spill_size: int = None):
+    """wrapper function for putting a python object, it is serialised in memory and streamed into the upload. Tables
+    are stored in the Arrow format, everything else is pickled. Objects larger than ``spill_size`` bytes (defaults to
+    ``NBOX_RELICS_SPILL_SIZE``) are spilled to a temporary file."""
+    if self.relic is None:
+      raise ValueError("Relic does not exist, pass create=True")
+    if spill_size is None:
+      spill_size = int(env.NBOX_RELICS_SPILL_SIZE(RELICS_SPILL_SIZE))
+    with SpooledTemporaryFile(max_size = spill_size, prefix = "relic_") as f:
+      dump_object(py_object, f)
+      size = f.tell()
+      f.seek(0)
+      self.put_stream(f, key, size)
+
+  def get_object(self, key: str, columns: List[str] = None):
+    """wrapper function for getting a python object, when the cache is disabled it is read straight from the
+    network without touching the disk. Tables in the cache are memory mapped, ``columns`` reads only those columns."""
+    if self.cache is not None or self.offline:
+      return load_object(self._get_cached(key), columns)
+
+    url = self.get_url(key)
+    with _get_transfer_session().get(url, stream = True) as r:
+      r.raise_for_status()
+      r.raw.decode_content = True
+      return load_object(io.BufferedReader(r.raw, buffer_size = 1 << 20), columns)
 
   """
   Some APIs are more on the level of the relic itself.
@@ -297,6 +1004,8 @@ class RelicsNBX(BaseStore):
     """List all the files in the relic at path"""
     if self.relic is None:
       raise ValueError("Relic does not exist, pass create=True")
+    if self.offline:
+      raise ValueError("Relics are offline, cannot list files")
     logger.debug(f"Listing files in relic {self.relic_name}")
     out = self.stub.list_relic_files(RelicFile(
       workspace_id = self.workspace_id,
@@ -305,8 +1014,26 @@ class RelicsNBX(BaseStore):
     ))
     return out.files
 
-  def start_fs():
-    # /my_relic/.....
-    pass
+  def get_url(self, remote_path: str) -> str:
+    """Get a signed URL to read the file at ``remote_path``, it supports HTTP range requests"""
+    if self.offline:
+      raise ValueError("Relics are offline, cannot get links")
+    relic_file = RelicFile(name = self._remote_name(remote_path), relic_name = self.relic_name, workspace_id = self.workspace_id)
+    out = self.stub.download_file(_RelicFile = relic_file,)
+    if out is None or not out.url:
+      raise ValueError(f"Could not get link for '{relic_file.name}', are you sure this file exists?")
+    return out.url
+
+  @staticmethod
+  def cp(src: str, dst: str, recursive: bool = False, jobs: int = RELICS_MAX_WORKERS, workspace_id: str = "", dry_run: bool = False):
+    """Copy files between local paths and ``relic://{relic_name}/{path}`` in parallel, see ``nbox.relics.cp``.
+    From the CLI use ``nbx relics cp SRC DST --recursive --jobs N``."""
+    from nbox.relics.cp import copy
+    return copy(src, dst, recursive = recursive, jobs = jobs, workspace_id = workspace_id, dry_run = dry_run)
+
+  def start_fs(self):
+    """Get an ``fsspec`` filesystem over the relics in this workspace, paths look like ``relic://{relic_name}/...``"""
+    from nbox.relics.fs import RelicFileSystem
+    return RelicFileSystem(workspace_id = self.workspace_id)
 
 # nbx jobs ... trigger --mount="dataset:/my-dataset/email/,model_master:/model"
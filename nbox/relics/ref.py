@@ -0,0 +1,175 @@
+"""
+Passing data to and from jobs by reference. A ``RelicRef`` is a pointer to an object stored in a relic, it is tiny
+when pickled so it can be passed as an argument to ``Operator.from_job`` instead of the data itself:
+
+.. code-block:: python
+
+  op = Operator.from_job("train")
+  op(RelicRef("datasets", "imagenet/train.parquet"), lr = 3e-4)  # the job loads the dataframe itself
+
+Large arguments that are not references are stored once by the sha256 of their serialised bytes in
+``_blobs/{sha256}`` of the ``cache`` relic and replaced by a ``RelicRef``, so calling a job many times with the same
+model and different small inputs uploads the model once. The small arguments are pickled once as well, the bytes
+from measuring their size are what ``put_object`` writes. Concurrent calls (eg. from ``Operator.map``) with the same
+object or the same bytes wait for the first one instead of serialising and uploading it again.
+"""
+
+import threading
+import cloudpickle
+from hashlib import sha256
+from concurrent.futures import Future
+from functools import lru_cache
+from tempfile import SpooledTemporaryFile
+from typing import Any, Dict, List, Tuple
+
+from nbox.utils import logger, env
+from nbox.auth import secret, ConfigString
+from nbox.relics.nbx import RelicsNBX, RELICS_SPILL_SIZE
+from nbox.relics.tiered import TieredRelic
+from nbox.relics.codec import dump_object
+
+# values that serialise to more than these many bytes are passed by reference
+REF_MIN_SIZE = 1 << 20
+
+# arguments are stored in this folder of the relic by their hash
+REF_BLOB_PREFIX = "_blobs"
+
+# work that is running right now, {key: (objects kept alive while it runs, future of the result)}
+_inflight: Dict[Tuple, Tuple[Any, Future]] = {}
+_inflight_lock = threading.Lock()
+
+
+@lru_cache(maxsize = 32)
+def get_relic(relic_name: str, workspace_id: str = "", tiered: bool = False):
+  """Reusable handle to a relic, creating one makes an RPC so this should be used where relics are opened often.
+  ``tiered`` gives a ``TieredRelic`` that also keeps the objects on the local disk."""
+  if tiered:
+    return TieredRelic(relic_name, workspace_id, create = True)
+  return RelicsNBX(relic_name, workspace_id)
+
+
+class RelicRef:
+  def __init__(self, relic_name: str, key: str, workspace_id: str = ""):
+    """Reference to the object at ``key`` in the relic ``relic_name``.
+
+    Args:
+      relic_name (str): The name of the relic
+      key (str): Path of the object in the relic, as passed to ``put_object``
+      workspace_id (str): The workspace ID, if not provided, will be one in global config.
+    """
+    self.relic_name = relic_name
+    self.key = key
+    self.workspace_id = workspace_id
+
+  def __repr__(self):
+    return f"RelicRef({self.relic_name}, {self.key})"
+
+  def __eq__(self, other):
+    return isinstance(other, RelicRef) and (self.relic_name, self.key, self.workspace_id) == (other.relic_name, other.key, other.workspace_id)
+
+  def __hash__(self):
+    return hash((self.relic_name, self.key, self.workspace_id))
+
+  def load(self, relic = None, columns: List[str] = None):
+    """Get the object, ``relic`` is used if it is the same relic (and workspace) else a cached handle is opened"""
+    workspace_id = self.workspace_id or secret.get(ConfigString.workspace_id)
+    if relic is None or (relic.relic_name, relic.workspace_id) != (self.relic_name, workspace_id):
+      relic = get_relic(self.relic_name, self.workspace_id)
+    return relic.get_object(self.key, columns = columns) if columns else relic.get_object(self.key)
+
+
+class _Pickled:
+  """A value that ``pack`` has already pickled. Pickling this writes the bytes as they are and unpickling gives back
+  the value itself, so the reader does not know about this class."""
+  __slots__ = ("data",)
+
+  def __init__(self, data: bytes):
+    self.data = data
+
+  def __repr__(self):
+    return f"_Pickled({len(self.data)} bytes)"
+
+  def __reduce__(self):
+    return (cloudpickle.loads, (self.data,))
+
+
+def _once(key: Tuple, pin, fn):
+  """Call ``fn`` for the first caller with this ``key``, the concurrent callers with the same ``key`` wait for and
+  get its result. ``pin`` is kept alive till then so that an ``id()`` in the key cannot be reused."""
+  with _inflight_lock:
+    entry = _inflight.get(key)
+    if entry is None:
+      fut = Future()
+      _inflight[key] = (pin, fut)
+  if entry is not None:
+    return entry[1].result()
+  try:
+    out = fn()
+    fut.set_result(out)
+    return out
+  except BaseException as e:
+    fut.set_exception(e)
+    raise
+  finally:
+    with _inflight_lock:
+      _inflight.pop(key, None)
+
+
+def pack(relic, value, min_size: int = REF_MIN_SIZE):
+  """Store ``value`` in ``relic`` by its hash (once) and return a ``RelicRef`` if it is large. A small value is
+  returned as is, or already pickled if it is not a table, to be written with ``put_object``."""
+  if isinstance(value, RelicRef):
+    return value
+  return _once(("value", id(relic), id(value), min_size), (relic, value), lambda: _pack(relic, value, min_size))
+
+
+def _upload_blob(relic, f, key: str, size: int) -> None:
+  if relic.has(key):
+    logger.debug(f"Already in relic: {key} ({size} bytes)")
+    return
+  f.seek(0)
+  relic.put_stream(f, key, size)
+
+
+def _pack(relic, value, min_size: int):
+  with SpooledTemporaryFile(max_size = int(env.NBOX_RELICS_SPILL_SIZE(RELICS_SPILL_SIZE)), prefix = "ref_") as f:
+    codec = dump_object(value, f)
+    size = f.tell()
+    if size < min_size:
+      if codec != "pickle":
+        # tables stay as they are so that put_object writes them in the arrow format
+        return value
+      f.seek(0)
+      return _Pickled(f.read())
+
+    f.seek(0)
+    h = sha256()
+    for chunk in iter(lambda: f.read(1 << 20), b""):
+      h.update(chunk)
+    key = f"{REF_BLOB_PREFIX}/{h.hexdigest()}"
+    _once(("blob", relic.workspace_id, relic.relic_name, key), None, lambda: _upload_blob(relic, f, key, size))
+  return RelicRef(relic.relic_name, key, relic.workspace_id)
+
+
+def unpack(value, relic = None):
+  """Load ``value`` if it is a ``RelicRef`` else return it as is"""
+  if isinstance(value, RelicRef):
+    return value.load(relic)
+  if isinstance(value, _Pickled):
+    return cloudpickle.loads(value.data)
+  return value
+
+
+def pack_args(relic, args: Tuple, kwargs: Dict[str, Any], min_size: int = REF_MIN_SIZE) -> Tuple[Tuple, Dict[str, Any]]:
+  """``pack`` each of the positional and keyword arguments, an object passed more than once is packed once"""
+  packed = {}
+  def _pack_once(x):
+    if id(x) not in packed:
+      packed[id(x)] = pack(relic, x, min_size)
+    return packed[id(x)]
+  return tuple(_pack_once(x) for x in args), {k: _pack_once(v) for k, v in kwargs.items()}
+
+
+def unpack_args(args: Tuple, kwargs: Dict[str, Any], relic = None) -> Tuple[Tuple, Dict[str, Any]]:
+  """``unpack`` each of the positional and keyword arguments"""
+  return tuple(unpack(x, relic) for x in args), {k: unpack(v, relic) for k, v in kwargs.items()}
@@ -0,0 +1,267 @@
+"""
+Sharded record format for datasets with many small samples. Instead of one relic file (and one ``create_file`` call
+and one S3 object) per sample, the samples are packed into large shards:
+
+.. code-block:: python
+
+  with ShardWriter(relic, "datasets/mnist", shard_size = 64 << 20) as w:
+    for x in samples:
+      w.write(x)
+
+  reader = ShardReader(relic, "datasets/mnist")
+  len(reader), reader[1234]   # random access, reads just that record with a range request
+  for x in reader:            # sequential, the next shards are downloaded in the background
+    ...
+
+Every shard is a sequence of length prefixed records followed by an index and a fixed size footer, all integers
+are little endian ``uint64``:
+
+.. code-block::
+
+  [len][record] [len][record] ... [offset][len] [offset][len] ... [index_offset][count][b"NBXSHRD1"]
+
+The list of shards along with the number of records in each is stored in ``{prefix}/_index.json``.
+"""
+
+import io
+import json
+import struct
+import threading
+import cloudpickle
+from bisect import bisect_right
+from collections import OrderedDict, deque
+from tempfile import SpooledTemporaryFile
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor, Future
+
+from nbox.utils import logger, env
+from nbox.relics.nbx import RelicsNBX, RELICS_SPILL_SIZE, _get_transfer_session
+
+SHARD_MAGIC = b"NBXSHRD1"
+SHARD_INDEX_NAME = "_index.json"
+
+_U64 = struct.Struct("<Q")
+_FOOTER = struct.Struct("<QQ8s")
+
+
+class ShardWriter:
+  def __init__(
+    self,
+    relic: RelicsNBX,
+    prefix: str,
+    shard_size: int = 64 << 20,
+    encode: Optional[Callable[[Any], bytes]] = cloudpickle.dumps,
+    max_uploads: int = 2,
+  ):
+    """Pack records into shards of about ``shard_size`` bytes and upload them to ``{prefix}/shard-00000.nbxs``, ...
+
+    Args:
+      relic (RelicsNBX): The relic to write to
+      prefix (str): Folder in the relic for this dataset
+      shard_size (int): A shard is closed and uploaded once it is bigger than this
+      encode (Callable): Turns each record into bytes, pass ``None`` if you are writing bytes
+      max_uploads (int): Number of shards uploading in the background before ``write`` blocks
+    """
+    self.relic = relic
+    self.prefix = prefix.strip("/")
+    self.shard_size = shard_size
+    self.encode = encode
+    self.shards: List[Dict[str, Any]] = []
+
+    self._pool = ThreadPoolExecutor(max_uploads, thread_name_prefix = "shard_upload")
+    self._uploads: List[Future] = []
+    self._sem = threading.Semaphore(max_uploads)
+    self._f = None
+    self._index: List[Tuple[int, int]] = []
+    self._closed = False
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *_):
+    self.close()
+
+  def __len__(self):
+    return sum(s["count"] for s in self.shards) + len(self._index)
+
+  def _shard_name(self, i: int) -> str:
+    return f"{self.prefix}/shard-{i:05d}.nbxs"
+
+  def write(self, record) -> None:
+    """Add a record to the current shard"""
+    if self._closed:
+      raise ValueError("ShardWriter is closed")
+    data = self.encode(record) if self.encode is not None else record
+    if self._f is None:
+      self._f = SpooledTemporaryFile(max_size = int(env.NBOX_RELICS_SPILL_SIZE(RELICS_SPILL_SIZE)), prefix = "shard_")
+    offset = self._f.tell()
+    self._f.write(_U64.pack(len(data)))
+    self._f.write(data)
+    self._index.append((offset + _U64.size, len(data)))
+    if self._f.tell() >= self.shard_size:
+      self._finish_shard()
+
+  def _finish_shard(self) -> None:
+    f, index = self._f, self._index
+    self._f, self._index = None, []
+    index_offset = f.tell()
+    for offset, length in index:
+      f.write(_U64.pack(offset))
+      f.write(_U64.pack(length))
+    f.write(_FOOTER.pack(index_offset, len(index), SHARD_MAGIC))
+    size = f.tell()
+    f.seek(0)
+
+    name = self._shard_name(len(self.shards))
+    self.shards.append({"name": name, "count": len(index), "size": size})
+    logger.debug(f"Uploading shard {name} with {len(index)} records ({size} bytes)")
+
+    def _upload():
+      try:
+        self.relic.put_stream(f, name, size)
+      finally:
+        f.close()
+        self._sem.release()
+
+    self._sem.acquire()
+    self._uploads.append(self._pool.submit(_upload))
+
+  def close(self) -> None:
+    """Upload the last shard, wait for all the uploads and then write the index"""
+    if self._closed:
+      return
+    self._closed = True
+    if self._index:
+      self._finish_shard()
+    try:
+      for fut in self._uploads:
+        fut.result()
+    finally:
+      self._pool.shutdown(wait = True)
+    data = json.dumps({"shards": self.shards}).encode("utf-8")
+    self.relic.put_stream(io.BytesIO(data), f"{self.prefix}/{SHARD_INDEX_NAME}", len(data))
+
+
+class ShardReader:
+  def __init__(
+    self,
+    relic: RelicsNBX,
+    prefix: str,
+    decode: Optional[Callable[[bytes], Any]] = cloudpickle.loads,
+    prefetch: int = 2,
+    workers: int = 4,
+  ):
+    """Read the records written by ``ShardWriter``, both by index and sequentially.
+
+    Args:
+      relic (RelicsNBX): The relic to read from
+      prefix (str): Folder in the relic for this dataset
+      decode (Callable): Turns the bytes of each record into the object, pass ``None`` to get bytes
+      prefetch (int): Number of shards downloaded ahead of the one being iterated
+      workers (int): Number of parallel downloads
+    """
+    self.relic = relic
+    self.prefix = prefix.strip("/")
+    self.decode = decode
+    self.prefetch = prefetch
+    self.workers = workers
+
+    self._urls: Dict[str, str] = {}
+    self._indices: Dict[str, List[Tuple[int, int]]] = OrderedDict()
+    self._lock = threading.Lock()
+
+    index = json.loads(self._get(f"{self.prefix}/{SHARD_INDEX_NAME}"))
+    self.shards: List[Dict[str, Any]] = index["shards"]
+    self._starts = [0]
+    for s in self.shards:
+      self._starts.append(self._starts[-1] + s["count"])
+
+  def __len__(self):
+    return self._starts[-1]
+
+  def _get(self, name: str, start: int = None, end: int = None) -> bytes:
+    headers = {}
+    if start is not None:
+      headers["Range"] = f"bytes={start}-{end - 1}"
+    for refresh in [False, True]:
+      # signed URLs expire, get a new one and try once more
+      if refresh or name not in self._urls:
+        self._urls[name] = self.relic.get_url(name)
+      r = _get_transfer_session().get(self._urls[name], headers = headers)
+      if r.status_code not in [401, 403]:
+        break
+    r.raise_for_status()
+    if start is not None and r.status_code == 200:
+      # server does not support range requests and sent the entire file
+      return r.content[start:end]
+    return r.content
+
+  @staticmethod
+  def _parse_index(buf: bytes, index_offset: int, count: int, base: int = 0) -> List[Tuple[int, int]]:
+    out = []
+    for i in range(count):
+      pos = index_offset - base + i * 2 * _U64.size
+      out.append((_U64.unpack_from(buf, pos)[0], _U64.unpack_from(buf, pos + _U64.size)[0]))
+    return out
+
+  def _shard_index(self, shard: Dict[str, Any]) -> List[Tuple[int, int]]:
+    name = shard["name"]
+    with self._lock:
+      if name in self._indices:
+        self._indices.move_to_end(name)
+        return self._indices[name]
+
+    # the index is at the end of the file and has a known size, so one range request is enough
+    index_size = shard["count"] * 2 * _U64.size + _FOOTER.size
+    base = shard["size"] - index_size
+    buf = self._get(name, base, shard["size"])
+    index_offset, count, magic = _FOOTER.unpack_from(buf, len(buf) - _FOOTER.size)
+    if magic != SHARD_MAGIC:
+      raise ValueError(f"'{name}' is not a shard")
+    index = self._parse_index(buf, index_offset, count, base)
+    with self._lock:
+      self._indices[name] = index
+      while len(self._indices) > 64:
+        self._indices.popitem(last = False)
+    return index
+
+  def _locate(self, idx: int) -> Tuple[Dict[str, Any], int]:
+    if idx < 0:
+      idx += len(self)
+    if not 0 <= idx < len(self):
+      raise IndexError(f"Record {idx} out of range for {len(self)} records")
+    s = bisect_right(self._starts, idx) - 1
+    return self.shards[s], idx - self._starts[s]
+
+  def _decode(self, data: bytes):
+    return self.decode(data) if self.decode is not None else data
+
+  def __getitem__(self, idx: int):
+    shard, i = self._locate(idx)
+    offset, length = self._shard_index(shard)[i]
+    return self._decode(self._get(shard["name"], offset, offset + length))
+
+  def _read_shard(self, shard: Dict[str, Any]) -> List[bytes]:
+    buf = self._get(shard["name"])
+    index_offset, count, magic = _FOOTER.unpack_from(buf, len(buf) - _FOOTER.size)
+    if magic != SHARD_MAGIC:
+      raise ValueError(f"'{shard['name']}' is not a shard")
+    return [buf[o:o+l] for o, l in self._parse_index(buf, index_offset, count)]
+
+  def iter_shards(self, shards: List[Dict[str, Any]] = None):
+    """Yields the records of each shard as a list of bytes, the next ``prefetch`` shards are downloaded in
+    the background"""
+    shards = self.shards if shards is None else shards
+    with ThreadPoolExecutor(max(1, min(self.workers, self.prefetch + 1)), thread_name_prefix = "shard_read") as pool:
+      futures: Deque[Future] = deque()
+      nxt = 0
+      for _ in range(len(shards)):
+        while nxt < len(shards) and len(futures) <= self.prefetch:
+          futures.append(pool.submit(self._read_shard, shards[nxt]))
+          nxt += 1
+        yield futures.popleft().result()
+
+  def __iter__(self):
+    for records in self.iter_shards():
+      for data in records:
+        yield self._decode(data)
@@ -0,0 +1,392 @@
+"""
+Two tier relic, a folder on the local disk in front of NBX-Relics. Pods and laptops that keep exchanging the same
+intermediate objects read them from the disk and only go to the network when the relic has a newer version.
+
+.. code-block:: python
+
+  relic = TieredRelic("cache", policy = "write-back")
+  relic.put_object("features.pkl", df)  # returns once the object is on the local disk
+  ...
+  relic.get_object("features.pkl")      # served from the disk, no network call
+  relic.flush()                         # wait for the uploads to finish
+
+The local tier is laid out like the ``RelicCache`` with one data file and one json meta file per key:
+
+.. code-block::
+
+  {NBOX_HOME_DIR}/.cache/tiered/{workspace_id}/{relic_name}/
+    3b4c...e1        # the bytes
+    3b4c...e1.meta   # {key, size, last_modified, synced_at, dirty, version, owner}
+
+An entry is fresh if it has not been uploaded yet (``dirty``) or if it was synced with the relic in the last ``ttl``
+seconds, else it is validated against the remote size and ``last_modified``. ``owner`` is the pid of the process
+that wrote the entry, ``flush`` uploads the dirty entries of its own instance and the ones left behind by a process
+that died before flushing, never the ones that another live process is still uploading.
+"""
+
+import os
+import json
+import time
+import shutil
+import atexit
+import psutil
+import weakref
+import threading
+from hashlib import sha256
+from tempfile import mkstemp
+from typing import List, Dict, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor, Future
+
+from nbox.utils import logger, env
+from nbox.sub_utils.cache import maybe_gc
+from nbox.relics.base import BaseStore
+from nbox.relics.codec import dump_object, load_object
+from nbox.relics.nbx import RelicsNBX, RELICS_MAX_WORKERS, _clean_path
+from nbox.sublime.relics_rpc_client import RelicFile
+
+
+# write-back relics that might have uploads left, a single hook flushes them at exit without keeping them alive
+_write_back_relics = weakref.WeakSet()
+
+
+def _flush_at_exit():
+  for relic in list(_write_back_relics):
+    try:
+      relic.flush()
+    except Exception as e:
+      logger.error(f"Could not flush relic '{relic.relic_name}' at exit, run flush() to retry: {e}")
+
+
+atexit.register(_flush_at_exit)
+
+
+class TieredRelic(BaseStore):
+  WRITE_THROUGH = "write-through"
+  WRITE_BACK = "write-back"
+
+  def __init__(
+    self,
+    relic_name: str,
+    workspace_id: str = "",
+    create: bool = False,
+    prefix: str = "",
+    *,
+    local_dir: str = "",
+    policy: str = WRITE_THROUGH,
+    ttl: float = 60.0,
+    workers: int = 4,
+  ):
+    """
+    ``BaseStore`` with a local folder as the first tier and ``RelicsNBX`` as the second one.
+
+    Args:
+      relic_name (str): The name of the relic.
+      workspace_id (str): The workspace ID, if not provided, will be one in global config.
+      create (bool): Create the relic if it does not exist.
+      prefix (str): The prefix to use for all files in this relic.
+      local_dir (str): Folder for the local tier, defaults to ``{NBOX_HOME_DIR}/.cache/tiered/{workspace_id}/{relic_name}``
+      policy (str): ``write-through`` uploads before ``put`` returns, ``write-back`` uploads in the background
+      ttl (float): Seconds for which a synced entry is trusted without asking the relic
+      workers (int): Number of background uploads for ``write-back``
+    """
+    if policy not in [self.WRITE_THROUGH, self.WRITE_BACK]:
+      raise ValueError(f"policy must be '{self.WRITE_THROUGH}' or '{self.WRITE_BACK}', got '{policy}'")
+
+    # the local tier replaces the read-through cache of the remote
+    self.remote = RelicsNBX(relic_name, workspace_id, create = create, prefix = prefix, cache = False)
+    self.relic_name = relic_name
+    self.workspace_id = self.remote.workspace_id
+    self.relic = self.remote.relic
+    self.policy = policy
+    self.ttl = ttl
+    self.local_dir = local_dir or os.path.join(env.NBOX_HOME_DIR(), ".cache", "tiered", self.workspace_id, relic_name)
+    os.makedirs(self.local_dir, exist_ok = True)
+
+    # ``_written`` are the keys this instance wrote that are not uploaded yet, the only ones its ``flush`` touches
+    # besides the orphans of dead processes
+    self._lock = threading.Lock()
+    self._pending: Dict[str, Future] = {}
+    self._written = set()
+    self._pool = None
+    if policy == self.WRITE_BACK:
+      self._pool = ThreadPoolExecutor(min(workers, RELICS_MAX_WORKERS), thread_name_prefix = "tiered_relic")
+      _write_back_relics.add(self)
+
+  def __repr__(self):
+    return f"TieredRelic({self.workspace_id}, {self.relic_name}, {self.policy}, {self.local_dir})"
+
+  """
+  The local tier.
+  """
+
+  def _paths(self, key: str):
+    _key = sha256(_clean_path(key).encode("utf-8")).hexdigest()
+    data_path = os.path.join(self.local_dir, _key)
+    return data_path, data_path + ".meta"
+
+  def _read_meta(self, key: str) -> Optional[dict]:
+    _, meta_path = self._paths(key)
+    try:
+      with open(meta_path, "r") as f:
+        return json.load(f)
+    except (FileNotFoundError, ValueError):
+      return None
+
+  def _write_meta(self, key: str, meta: dict) -> None:
+    _, meta_path = self._paths(key)
+    fd, tmp = mkstemp(dir = self.local_dir, suffix = ".tmp")
+    with os.fdopen(fd, "w") as f:
+      json.dump(meta, f)
+    os.replace(tmp, meta_path)
+
+  def _remove_local(self, key: str) -> None:
+    data_path, meta_path = self._paths(key)
+    for p in [meta_path, data_path]:
+      try:
+        os.remove(p)
+      except FileNotFoundError:
+        pass
+
+  def _store_local(self, key: str, write_fn, remote: RelicFile = None, dirty: bool = False) -> dict:
+    """Write the entry for ``key`` by calling ``write_fn(tmp_path)`` and atomically moving it in place. The data is
+    replaced before the meta, an upload that has the old file open keeps reading the old bytes."""
+    data_path, _ = self._paths(key)
+    fd, tmp = mkstemp(dir = self.local_dir, suffix = ".tmp")
+    os.close(fd)
+    try:
+      write_fn(tmp)
+      size = os.stat(tmp).st_size
+      os.replace(tmp, data_path)
+    except BaseException:
+      if os.path.exists(tmp):
+        os.remove(tmp)
+      raise
+    meta = {
+      "key": _clean_path(key),
+      "size": size,
+      "last_modified": remote.last_modified if remote is not None else None,
+      "synced_at": time.time(),
+      "dirty": dirty,
+      "version": time.time_ns(),
+      "owner": os.getpid(),
+    }
+    if dirty:
+      with self._lock:
+        self._written.add(meta["key"])
+    self._write_meta(key, meta)
+    maybe_gc()
+    return meta
+
+  def _check(self, key: str) -> Tuple[Optional[str], Optional[RelicFile]]:
+    """Returns the path of the local copy of ``key`` if it is fresh (else ``None``) and the remote file if the relic
+    had to be asked"""
+    meta = self._read_meta(key)
+    data_path, _ = self._paths(key)
+    if meta is not None and os.path.exists(data_path):
+      if meta["dirty"] or self.remote.offline or time.time() - meta["synced_at"] < self.ttl:
+        return data_path, None
+    if self.remote.offline:
+      return None, None
+
+    remote = self.remote._stat(self.remote._remote_name(key))
+    if meta is None:
+      return None, remote
+    if remote is None:
+      logger.debug(f"'{key}' is no longer on the relic, dropping the local copy")
+      self._remove_local(key)
+      return None, None
+    # the relic reports empty files with a size of 1
+    if max(1, remote.size) != max(1, meta["size"]):
+      return None, remote
+    if meta["last_modified"] is None:
+      # first check since our own upload, adopt the timestamp of the relic
+      meta["last_modified"] = remote.last_modified
+    elif meta["last_modified"] != remote.last_modified:
+      return None, remote
+    meta["synced_at"] = time.time()
+    self._write_meta(key, meta)
+    return data_path, remote
+
+  def _fetch(self, key: str) -> str:
+    """Path to a fresh local copy of ``key``, downloading it if needed"""
+    data_path, remote = self._check(key)
+    if data_path is not None:
+      logger.debug(f"Local hit: {key}")
+      return data_path
+    if self.remote.offline:
+      raise ValueError(f"Relics are offline and '{key}' is not in the local tier")
+    if remote is None:
+      raise ValueError(f"Could not find '{key}' in relic '{self.relic_name}'")
+    self._store_local(key, lambda tmp: self.remote.get_from(tmp, key), remote)
+    return self._paths(key)[0]
+
+  """
+  Moving the data to the relic.
+  """
+
+  def _upload(self, key: str, version: int) -> None:
+    meta = self._read_meta(key)
+    if meta is None or meta["version"] != version:
+      # written again since, the upload of the newer version takes over
+      return
+    data_path, _ = self._paths(key)
+    self.remote.put_to(data_path, key)
+    meta = self._read_meta(key)
+    # only mark it clean if it was not written again while we were uploading
+    if meta is not None and meta["version"] == version:
+      meta.update({"dirty": False, "synced_at": time.time()})
+      self._write_meta(key, meta)
+      with self._lock:
+        self._written.discard(meta["key"])
+
+  def _upload_bg(self, key: str, version: int, prev: Optional[Future]) -> None:
+    if prev is not None:
+      # at most one upload per key at a time, else an older version could finish last. The pool runs the tasks in
+      # the order they were submitted so ``prev`` is already running or done.
+      try:
+        prev.result()
+      except Exception:
+        pass
+    try:
+      self._upload(key, version)
+    except Exception as e:
+      logger.error(f"Could not upload '{key}' to relic '{self.relic_name}', it will be retried on flush: {e}")
+      raise
+
+  def _commit(self, key: str, meta: dict) -> None:
+    key = _clean_path(key) # same as the keys popped by rm
+    if self.policy == self.WRITE_THROUGH:
+      self._upload(key, meta["version"])
+      return
+
+    def _done(fut):
+      with self._lock:
+        if self._pending.get(key) is fut:
+          del self._pending[key]
+
+    with self._lock:
+      fut = self._pool.submit(self._upload_bg, key, meta["version"], self._pending.get(key))
+      self._pending[key] = fut
+    fut.add_done_callback(_done)
+
+  def _should_flush(self, meta: dict, written: set) -> bool:
+    owner = meta.get("owner")
+    if owner == os.getpid():
+      # another instance in this process uploads its own keys
+      return meta["key"] in written
+    return owner is None or not psutil.pid_exists(owner)
+
+  def flush(self) -> None:
+    """Wait for the background uploads and upload the entries that are still dirty, of this instance or left behind
+    by a process that is gone"""
+    with self._lock:
+      pending = list(self._pending.items())
+      written = set(self._written)
+    for _, fut in pending:
+      try:
+        fut.result()
+      except Exception:
+        pass # retried below
+
+    errors = []
+    for f in os.listdir(self.local_dir):
+      if not f.endswith(".meta"):
+        continue
+      try:
+        with open(os.path.join(self.local_dir, f), "r") as _f:
+          meta = json.load(_f)
+      except (FileNotFoundError, ValueError):
+        continue
+      if meta["dirty"] and self._should_flush(meta, written):
+        if meta.get("owner") != os.getpid():
+          logger.info(f"Uploading '{meta['key']}' left behind by process {meta.get('owner')}")
+          meta["owner"] = os.getpid()
+          self._write_meta(meta["key"], meta)
+        try:
+          self._upload(meta["key"], meta["version"])
+        except Exception as e:
+          errors.append(e)
+    if errors:
+      raise errors[0]
+
+  """
+  Standard set of APIs for put, get, rm, has.
+  """
+
+  def put(self, local_path: str) -> None:
+    """Put the file at this path into the relic"""
+    self.put_to(local_path, local_path)
+
+  def put_to(self, local_path: str, remote_path: str) -> None:
+    meta = self._store_local(remote_path, lambda tmp: shutil.copyfile(local_path, tmp), dirty = True)
+    self._commit(meta["key"], meta)
+
+  def put_stream(self, fileobj, remote_path: str, size: int) -> None:
+    """Put the contents of the file-like ``fileobj`` at ``remote_path``"""
+    def _copy(tmp):
+      with open(tmp, "wb") as f:
+        shutil.copyfileobj(fileobj, f)
+    meta = self._store_local(remote_path, _copy, dirty = True)
+    self._commit(meta["key"], meta)
+
+  def put_object(self, key: str, py_object) -> None:
+    """wrapper function for putting a python object, tables are stored in the Arrow format"""
+    def _dump(tmp):
+      with open(tmp, "wb") as f:
+        dump_object(py_object, f)
+    meta = self._store_local(key, _dump, dirty = True)
+    self._commit(meta["key"], meta)
+
+  def get(self, local_path: str) -> None:
+    """Get the file at this path from the relic"""
+    self.get_from(local_path, local_path)
+
+  def get_from(self, local_path: str, remote_path: str) -> None:
+    shutil.copyfile(self._fetch(remote_path), local_path)
+
+  def get_object(self, key: str, columns: List[str] = None):
+    """wrapper function for getting a python object, tables are memory mapped from the local tier"""
+    return load_object(self._fetch(key), columns)
+
+  def has(self, path: str) -> bool:
+    data_path, remote = self._check(path)
+    return data_path is not None or remote is not None
+
+  def has_many(self, paths: List[str]) -> List[bool]:
+    # only the entries that are fresh locally, the rest are checked in bulk
+    out = []
+    for p in paths:
+      meta = self._read_meta(p)
+      out.append(meta is not None and (meta["dirty"] or time.time() - meta["synced_at"] < self.ttl))
+    missing = [i for i, x in enumerate(out) if not x]
+    if missing and not self.remote.offline:
+      for i, h in zip(missing, self.remote.has_many([paths[i] for i in missing])):
+        out[i] = h
+    return out
+
+  def rm(self, path: str) -> None:
+    """Delete the file from both the tiers"""
+    with self._lock:
+      fut = self._pending.pop(_clean_path(path), None)
+    if fut is not None:
+      # let the upload finish so it does not bring the file back after the delete
+      fut.exception()
+    self._remove_local(path)
+    self.remote.rm(path)
+
+  """
+  Some APIs are more on the level of the relic itself.
+  """
+
+  def list_files(self, path: str = "") -> List[RelicFile]:
+    """List all the files in the relic at path, the pending uploads are flushed first so the listing is complete"""
+    self.flush()
+    return self.remote.list_files(path)
+
+  def delete(self) -> None:
+    """Deletes your relic along with the local tier"""
+    if self._pool is not None:
+      self._pool.shutdown(wait = True)
+      _write_back_relics.discard(self)
+    shutil.rmtree(self.local_dir, ignore_errors = True)
+    self.remote.delete()
@@ -0,0 +1,27 @@
+"""
+Local stand-in for the NimbleBox services: Relics, LMAO and Jobs served from a folder on the local disk. It speaks
+the same Echo + base64 RPCs (and gRPC for jobs) as the hosted services so the client code runs unchanged, which
+makes it possible to benchmark and test ``put_many``, ``Lmao.log``, ``Operator.from_job`` and ``map`` on a laptop
+or a CI box without any network.
+
+Set ``NBOX_LOCAL_BACKEND`` before importing ``nbox`` so every client talks to the stand-in:
+
+.. code-block:: bash
+
+  export NBOX_LOCAL_BACKEND=http://127.0.0.1:8081
+  nbx standin --jobs '{"square": "my_module:square"}'
+
+or run it in the same process:
+
+.. code-block:: python
+
+  os.environ["NBOX_LOCAL_BACKEND"] = "http://127.0.0.1:8081"
+  from nbox import Operator
+  from nbox.standin import StandinServer
+
+  with StandinServer(root = "/tmp/standin") as server:
+    server.add_job("square", lambda x: x * x)
+    Operator.from_job("square")(4) # 16
+"""
+
+from nbox.standin.server import StandinServer, serve, get_grpc_address, DEFAULT_URL
@@ -0,0 +1,247 @@
+"""
+NBX-Jobs on the local disk. The jobs are python callables (or ``Operator``) registered with ``JobService.add_job``,
+triggering a job runs it in a thread with ``NBXLet.run_job``, same as on a pod: the arguments are read from the
+``cache`` relic and the return value is written back to it. Jobs and their runs are kept at ``{root}/jobs/{ws}``.
+
+The gRPC half is a ``WSJobServiceServicer`` and the REST half (job list and runs) is what ``nbox_ws_v1`` needs,
+``OPENAPI_SPEC`` is the part of the webserver spec that the client uses.
+"""
+
+import os
+import grpc
+import json
+import shutil
+import threading
+import traceback
+from uuid import uuid4
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from google.protobuf import symbol_database
+
+from nbox.utils import logger, SimplerTimes
+from nbox.standin.relics import _clean_id
+from nbox.hyperloop import nbox_ws_pb2
+from nbox.hyperloop.nbox_ws_pb2_grpc import WSJobServiceServicer
+from nbox.hyperloop.job_pb2 import Job as JobProto, NBXAuthInfo
+
+# the part of the webserver OpenAPI spec used by ``nbox.jobs``, loaded in ``Sub30`` as is
+OPENAPI_SPEC = {
+  "openapi": "3.0.0",
+  "servers": [{"url": "/api/v1"}],
+  "paths": {
+    "/user/jobs": {"get": {}},
+    "/workspace/{workspace_id}/jobs": {"get": {}},
+    "/workspace/{workspace_id}/job/{job_id}/runs": {"get": {"parameters": [
+      {"name": "limit", "in": "query"},
+      {"name": "page", "in": "query"},
+    ]}},
+  },
+}
+
+
+def _rpc_types(method: str) -> Tuple[Any, Any]:
+  """Request and response classes of a ``WSJobService`` method, read from the service descriptor"""
+  db = symbol_database.Default()
+  for service in nbox_ws_pb2.DESCRIPTOR.services_by_name.values():
+    if method in service.methods_by_name:
+      m = service.methods_by_name[method]
+      return db.GetSymbol(m.input_type.full_name), db.GetSymbol(m.output_type.full_name)
+  raise KeyError(f"No method '{method}' in WSJobService")
+
+
+def _run_op(op: Callable, job_id: str, workspace_id: str, tag: str):
+  """``NBXLet.run`` of a pod without the parts that talk to the jobs service and exit the process"""
+  from nbox.lib.dist import NBXLet
+
+  NBXLet(op).run_job(job_id, workspace_id, tag)
+
+
+class JobService(WSJobServiceServicer):
+  def __init__(self, root: str, workers: int = 8):
+    """Jobs and runs in ``{root}/jobs``, at most ``workers`` runs execute at the same time"""
+    self.root = os.path.join(root, "jobs")
+    self._ops: Dict[str, Callable] = {}
+    self._lock = threading.Lock()
+    self._pool = ThreadPoolExecutor(max(1, workers), thread_name_prefix = "standin_job")
+    os.makedirs(self.root, exist_ok = True)
+
+  def _job_dir(self, workspace_id: str, job_id: str = "") -> str:
+    folder = os.path.join(self.root, _clean_id(workspace_id or "personal", "workspace_id"))
+    return os.path.join(folder, _clean_id(job_id, "job_id")) if job_id else folder
+
+  def _load_job(self, workspace_id: str, job_id: str) -> Optional[JobProto]:
+    try:
+      with open(os.path.join(self._job_dir(workspace_id, job_id), "job.pb"), "rb") as f:
+        job = JobProto()
+        job.ParseFromString(f.read())
+        return job
+    except FileNotFoundError:
+      return None
+
+  def _save_job(self, job: JobProto):
+    folder = self._job_dir(job.auth_info.workspace_id, job.id)
+    os.makedirs(folder, exist_ok = True)
+    with open(os.path.join(folder, "job.pb"), "wb") as f:
+      f.write(job.SerializeToString())
+
+  def _runs(self, workspace_id: str, job_id: str) -> List[Dict[str, Any]]:
+    try:
+      with open(os.path.join(self._job_dir(workspace_id, job_id), "runs.json"), "r") as f:
+        return json.load(f)
+    except FileNotFoundError:
+      return []
+
+  def _update_run(self, workspace_id: str, job_id: str, run_id: str, **kwargs) -> Optional[Dict[str, Any]]:
+    with self._lock:
+      runs = self._runs(workspace_id, job_id)
+      run = next((r for r in runs if r["run_id"] == run_id), None)
+      if run is None:
+        return None
+      run.update(kwargs, updated_at = SimplerTimes.get_now_str())
+      with open(os.path.join(self._job_dir(workspace_id, job_id), "runs.json"), "w") as f:
+        json.dump(runs, f)
+      return run
+
+  def add_job(self, name: str, op: Callable, workspace_id: str = "") -> str:
+    """Register ``op`` as the job ``name``, calling it with ``Operator.from_job(name)`` runs ``op``. Returns the
+    job ID, a job with the same name is replaced."""
+    job = next((j for j in self.list_jobs(workspace_id) if j.name == name), None)
+    if job is None:
+      job = JobProto(
+        id = "jb_" + uuid4().hex[:12],
+        name = name,
+        auth_info = NBXAuthInfo(workspace_id = workspace_id),
+        status = JobProto.Status.SCHEDULED,
+      )
+      job.created_at.CopyFrom(SimplerTimes.get_now_pb())
+      self._save_job(job)
+    self._ops[job.id] = op
+    logger.info(f"Job '{name}' ({job.id}) -> {getattr(op, '__qualname__', op)}")
+    return job.id
+
+  def list_jobs(self, workspace_id: str = "") -> List[JobProto]:
+    folder = self._job_dir(workspace_id)
+    if not os.path.isdir(folder):
+      return []
+    jobs = [self._load_job(workspace_id, x) for x in sorted(os.listdir(folder))]
+    return [j for j in jobs if j is not None]
+
+  def trigger(self, workspace_id: str, job_id: str, tag: str = "") -> Dict[str, Any]:
+    """Create a new run of this job and start it in the background"""
+    job = self._load_job(workspace_id, job_id)
+    if job is None:
+      raise ValueError(f"Job '{job_id}' not found")
+    with self._lock:
+      runs = self._runs(workspace_id, job_id)
+      run_id = "r_" + uuid4().hex[:12]
+      run = {
+        "id": run_id,
+        "run_id": run_id,
+        "s_no": len(runs) + 1,
+        "status": "CREATED",
+        "created_at": SimplerTimes.get_now_str(),
+        "updated_at": SimplerTimes.get_now_str(),
+        "retry_count": 0,
+        "resource": {"max_retries": 0},
+        "tag": tag,
+      }
+      runs.append(run)
+      with open(os.path.join(self._job_dir(workspace_id, job_id), "runs.json"), "w") as f:
+        json.dump(runs, f)
+    self._pool.submit(self._execute, job, run_id, tag)
+    return run
+
+  def _execute(self, job: JobProto, run_id: str, tag: str):
+    workspace_id = job.auth_info.workspace_id
+    self._update_run(workspace_id, job.id, run_id, status = "RUNNING")
+    status = "ERROR"
+    log_file = os.path.join(self._job_dir(workspace_id, job.id), f"{run_id}.log")
+    with open(log_file, "w") as f:
+      try:
+        op = self._ops.get(job.id)
+        if op is None:
+          raise ValueError(f"No callable registered for job '{job.name}', use add_job")
+        f.write(f"[{SimplerTimes.get_now_str()}] Running {job.name} ({job.id}) tag: {tag}\n")
+        _run_op(op, job.id, workspace_id, tag)
+        status = "COMPLETED"
+      except Exception as e:
+        f.write(traceback.format_exc())
+        logger.error(f"Run {run_id} of job {job.name} failed: {e}")
+      f.write(f"[{SimplerTimes.get_now_str()}] {status}\n")
+    self._update_run(workspace_id, job.id, run_id, status = status)
+
+  def rest(self, path: List[str], query: Dict[str, str]) -> Tuple[int, Any]:
+    """``(status_code, data)`` for the REST paths in ``OPENAPI_SPEC``, ``path`` is split on "/" after ``/api/v1``"""
+    if path == ["user", "jobs"]:
+      path = ["workspace", "personal", "jobs"]
+    try:
+      if len(path) == 3 and path[0] == "workspace" and path[2] == "jobs":
+        return 200, [{"job_id": j.id, "name": j.name} for j in self.list_jobs(path[1])]
+      if len(path) == 5 and path[0] == "workspace" and path[2] == "job" and path[4] == "runs":
+        runs = self._runs(path[1], path[3])[::-1] # latest first
+        limit = int(query.get("limit", 10))
+        page = max(int(query.get("page", 1)), 1)
+        return 200, {"runs_list": runs[(page - 1) * limit: page * limit]}
+    except ValueError as e:
+      return 400, str(e)
+    return 404, f"No path '/{'/'.join(path)}'"
+
+  # gRPC methods, only the ones used by ``nbox.jobs`` and ``NBXLet``
+
+  def ListJobs(self, request, context):
+    _, Response = _rpc_types("ListJobs")
+    return Response(Jobs = self.list_jobs(request.auth_info.workspace_id))
+
+  def GetJob(self, request, context):
+    job = self._load_job(request.job.auth_info.workspace_id, request.job.id)
+    if job is None:
+      context.abort(grpc.StatusCode.NOT_FOUND, f"Job '{request.job.id}' not found")
+    return job
+
+  def TriggerJob(self, request, context):
+    _, Response = _rpc_types("TriggerJob")
+    self.trigger(request.job.auth_info.workspace_id, request.job.id, request.job.feature_gates.get("SetRunMetadata", ""))
+    return Response()
+
+  def UpdateJob(self, request, context):
+    _, Response = _rpc_types("UpdateJob")
+    job = self._load_job(request.job.auth_info.workspace_id, request.job.id)
+    if job is None:
+      context.abort(grpc.StatusCode.NOT_FOUND, f"Job '{request.job.id}' not found")
+    for p in request.update_mask.paths:
+      if p in JobProto.DESCRIPTOR.fields_by_name:
+        job.ClearField(p)
+        if JobProto.DESCRIPTOR.fields_by_name[p].message_type is not None:
+          getattr(job, p).CopyFrom(getattr(request.job, p))
+        else:
+          setattr(job, p, getattr(request.job, p))
+    self._save_job(job)
+    return Response()
+
+  def DeleteJob(self, request, context):
+    _, Response = _rpc_types("DeleteJob")
+    folder = self._job_dir(request.job.auth_info.workspace_id, request.job.id)
+    if os.path.isdir(folder):
+      shutil.rmtree(folder)
+    self._ops.pop(request.job.id, None)
+    return Response()
+
+  def UpdateRun(self, request, context):
+    _, Response = _rpc_types("UpdateRun")
+    status = JobProto.Status.keys()[request.job.status]
+    self._update_run(request.job.auth_info.workspace_id, request.job.id, request.token, status = status)
+    return Response()
+
+  def GetJobLogs(self, request, context):
+    _, Response = _rpc_types("GetJobLogs")
+    job = request.job.job
+    runs = self._runs(job.auth_info.workspace_id, job.id)
+    if not runs:
+      return
+    fp = os.path.join(self._job_dir(job.auth_info.workspace_id, job.id), f"{runs[-1]['run_id']}.log")
+    if os.path.exists(fp):
+      with open(fp, "r") as f:
+        yield Response(log = [l.rstrip("\n") for l in f])
+
+  def stop(self):
+    self._pool.shutdown(wait = True)
@@ -0,0 +1,226 @@
+"""
+LMAO on the local disk. Each run is a folder ``{root}/lmao/runs/{experiment_id}`` with the ``Run`` proto and the logs
+appended one ``RunLog`` per line (base64 of the proto), projects are in ``{root}/lmao/projects.json``.
+"""
+
+import os
+import json
+import threading
+from uuid import uuid4
+from typing import Dict, Optional
+
+from nbox.utils import logger, SimplerTimes
+from nbox.standin.relics import _clean_id
+from nbox.sublime._yql.common import message_to_b64, b64_to_message
+from nbox.sublime.lmao_client import (
+  Run, RunLog, Record, FileList, InitRunRequest, Acknowledge, ListProjectsRequest, ListProjectsResponse,
+  ListRunsRequest, ListRunsResponse, RunLogRequest, Serving, LogBuffer
+)
+
+
+class LmaoService:
+  def __init__(self, root: str):
+    """The ``LMAO`` RPCs over the folder ``{root}/lmao``"""
+    self.root = os.path.join(root, "lmao")
+    self._lock = threading.Lock()
+    self._run_locks: Dict[str, threading.Lock] = {}
+    os.makedirs(os.path.join(self.root, "runs"), exist_ok = True)
+    os.makedirs(os.path.join(self.root, "servings"), exist_ok = True)
+
+  def _run_lock(self, experiment_id: str) -> threading.Lock:
+    with self._lock:
+      return self._run_locks.setdefault(experiment_id, threading.Lock())
+
+  def _projects(self) -> Dict[str, Dict[str, str]]:
+    try:
+      with open(os.path.join(self.root, "projects.json"), "r") as f:
+        return json.load(f)
+    except FileNotFoundError:
+      return {}
+
+  def _run_dir(self, experiment_id: str) -> str:
+    return os.path.join(self.root, "runs", _clean_id(experiment_id, "experiment_id"))
+
+  def _serving_path(self, agent_token: str, ext: str) -> str:
+    return os.path.join(self.root, "servings", f"{_clean_id(agent_token, 'agent_token')}.{ext}")
+
+  def _load_run(self, experiment_id: str) -> Optional[Run]:
+    try:
+      with open(os.path.join(self._run_dir(experiment_id), "run.pb"), "rb") as f:
+        run = Run()
+        run.ParseFromString(f.read())
+        return run
+    except (FileNotFoundError, ValueError):
+      return None
+
+  def _save_run(self, run: Run):
+    folder = self._run_dir(run.experiment_id)
+    os.makedirs(folder, exist_ok = True)
+    with open(os.path.join(folder, "run.pb.tmp"), "wb") as f:
+      f.write(run.SerializeToString())
+    os.replace(os.path.join(folder, "run.pb.tmp"), os.path.join(folder, "run.pb"))
+
+  # RPCs, a string return is sent to the client as a 400
+
+  def init_run(self, req: InitRunRequest) -> Run:
+    with self._lock:
+      projects = self._projects()
+      project_id = req.project_id
+      if not project_id:
+        project_id = next((k for k, v in projects.items() if v["project_name"] == req.project_name), "")
+      if not project_id:
+        project_id = "p_" + uuid4().hex[:12]
+      projects.setdefault(project_id, {"project_name": req.project_name or project_id, "experiments": []})
+      experiment_id = uuid4().hex[:16]
+      projects[project_id]["experiments"].append(experiment_id)
+      with open(os.path.join(self.root, "projects.json"), "w") as f:
+        json.dump(projects, f)
+
+    run = Run(
+      agent = req.agent_details,
+      experiment_id = experiment_id,
+      created_at = req.created_at or SimplerTimes.get_now_i64(),
+      config = req.config,
+      status = Run.Status.RUNNING,
+      save_location = f"{projects[project_id]['project_name']}/{experiment_id}",
+      updated_at = SimplerTimes.get_now_i64(),
+    )
+    self._save_run(run)
+    logger.debug(f"Created run {experiment_id} in project {project_id}")
+    return run
+
+  def update_run_status(self, run: Run) -> Acknowledge:
+    with self._run_lock(run.experiment_id):
+      existing = self._load_run(run.experiment_id)
+      if existing is None:
+        return f"Run '{run.experiment_id}' not found"
+      if run.HasField("agent"):
+        existing.agent.CopyFrom(run.agent)
+      if run.status:
+        existing.status = run.status
+      existing.updated_at = SimplerTimes.get_now_i64()
+      self._save_run(existing)
+    return Acknowledge(success = True)
+
+  def on_log(self, run_log: RunLog) -> Acknowledge:
+    with self._run_lock(run_log.experiment_id):
+      if not os.path.isdir(self._run_dir(run_log.experiment_id)):
+        return f"Run '{run_log.experiment_id}' not found"
+      with open(os.path.join(self._run_dir(run_log.experiment_id), "logs.b64"), "a") as f:
+        f.write(message_to_b64(run_log) + "\n")
+    return Acknowledge(success = True)
+
+  def on_save(self, file_list: FileList) -> Acknowledge:
+    with self._run_lock(file_list.experiment_id):
+      run = self._load_run(file_list.experiment_id)
+      if run is None:
+        return f"Run '{file_list.experiment_id}' not found"
+      run.file_list.experiment_id = file_list.experiment_id
+      run.file_list.files.extend(file_list.files)
+      self._save_run(run)
+    return Acknowledge(success = True)
+
+  def on_train_end(self, run: Run) -> Acknowledge:
+    with self._run_lock(run.experiment_id):
+      existing = self._load_run(run.experiment_id)
+      if existing is None:
+        return f"Run '{run.experiment_id}' not found"
+      existing.completed = True
+      existing.status = run.status or Run.Status.COMPLETED
+      existing.ended_at = existing.updated_at = SimplerTimes.get_now_i64()
+      self._save_run(existing)
+    return Acknowledge(success = True)
+
+  def list_projects(self, req: ListProjectsRequest) -> ListProjectsResponse:
+    out = ListProjectsResponse(total_pages = 1)
+    for project_id, p in self._projects().items():
+      if req.project_id_or_name and req.project_id_or_name not in (project_id, p["project_name"]):
+        continue
+      out.projects.append(ListProjectsResponse.Project(
+        project_id = project_id, project_name = p["project_name"], total_experiments = len(p["experiments"])
+      ))
+    return out
+
+  def list_runs(self, req: ListRunsRequest) -> ListRunsResponse:
+    project = self._projects().get(req.project_id)
+    if project is None:
+      return f"Project '{req.project_id}' not found"
+    runs = [r for r in (self._load_run(x) for x in project["experiments"]) if r is not None]
+    runs.sort(key = lambda r: r.created_at, reverse = req.desc)
+    out = ListRunsResponse(total_pages = 1)
+    for r in runs:
+      out.experiment_ids.append(r.experiment_id)
+      out.created_at.append(r.created_at)
+    return out
+
+  def get_run_details(self, run: Run) -> Run:
+    # an empty run tells the client that this run does not exist yet
+    if not run.experiment_id:
+      return Run()
+    return self._load_run(run.experiment_id) or Run()
+
+  def get_run_log(self, req: RunLogRequest) -> RunLog:
+    fp = os.path.join(self._run_dir(req.experiment_id), "logs.b64")
+    out = RunLog(experiment_id = req.experiment_id)
+    if not os.path.exists(fp):
+      return out
+    records = []
+    with open(fp, "r") as f:
+      for line in f:
+        run_log = b64_to_message(line.strip(), RunLog())
+        for r in run_log.data:
+          if not req.key or r.key == req.key:
+            records.append(r)
+        # columns from log_many are returned as one record per row
+        for c in run_log.column_data:
+          if not req.key or c.key == req.key:
+            for row in c.rows:
+              r = Record(key = c.key, value_type = c.value_type, step = row.x)
+              getattr(r, ("float_data", "integer_data", "string_data")[c.value_type]).append(
+                getattr(row, ("float_data", "integer_data", "string_data")[c.value_type])
+              )
+              records.append(r)
+    records = records[req.start_at:req.end_at or None]
+    if req.sample and len(records) > req.sample:
+      records = records[::-(-len(records) // req.sample)]
+    out.data.extend(records)
+    return out
+
+  def list_files(self, run: Run) -> FileList:
+    existing = self._load_run(run.experiment_id)
+    if existing is None:
+      return f"Run '{run.experiment_id}' not found"
+    return existing.file_list
+
+  def init_serving(self, req: InitRunRequest) -> Serving:
+    serving = Serving(
+      agent = req.agent_details,
+      agent_token = uuid4().hex,
+      created_at = SimplerTimes.get_now_i64(),
+      config = req.config,
+      status = Serving.Status.RUNNING,
+    )
+    with open(self._serving_path(serving.agent_token, "pb"), "wb") as f:
+      f.write(serving.SerializeToString())
+    return serving
+
+  def on_serving_log(self, buffer: LogBuffer) -> Acknowledge:
+    if not buffer.agent_token or not os.path.exists(self._serving_path(buffer.agent_token, "pb")):
+      return f"Serving '{buffer.agent_token}' not found"
+    with self._run_lock(buffer.agent_token):
+      with open(self._serving_path(buffer.agent_token, "b64"), "a") as f:
+        f.write(message_to_b64(buffer) + "\n")
+    return Acknowledge(success = True)
+
+  def on_serving_end(self, serving: Serving) -> Acknowledge:
+    if not serving.agent_token or not os.path.exists(self._serving_path(serving.agent_token, "pb")):
+      return f"Serving '{serving.agent_token}' not found"
+    fp = self._serving_path(serving.agent_token, "pb")
+    with open(fp, "rb") as f:
+      existing = Serving()
+      existing.ParseFromString(f.read())
+    existing.status = Serving.Status.COMPLETED
+    existing.updated_at = SimplerTimes.get_now_i64()
+    with open(fp, "wb") as f:
+      f.write(existing.SerializeToString())
+    return Acknowledge(success = True)
@@ -0,0 +1,182 @@
+"""
+Relics on the local disk, files of relic ``name`` in workspace ``ws`` are kept at ``{root}/relics/{ws}/{name}/files``.
+The signed URLs handed out by ``create_file`` and ``download_file`` point back to the stand-in server which reads
+and writes the files directly, so uploads and downloads take the same path as they do against a bucket.
+"""
+
+import os
+import time
+import shutil
+import threading
+from typing import List, Optional, Tuple
+from urllib.parse import quote
+
+from nbox.utils import logger
+from nbox.sublime.relics_rpc_client import (
+  Relic, RelicFile, CreateRelicRequest, ListRelicsRequest, ListRelicsResponse,
+  ListRelicFilesRequest, ListRelicFilesResponse, Acknowledge
+)
+
+# same page size as the hosted service, the client goes through the pages
+FILES_PER_PAGE = 100
+
+# URL path of the files, ``/_objects/{workspace_id}/{relic_name}/{name}``
+OBJECTS_PATH = "/_objects"
+
+
+def _clean(name: str) -> str:
+  name = name.strip("/")
+  parts = name.split("/")
+  if any(p in ("", ".", "..") or "\\" in p for p in parts):
+    raise ValueError(f"Invalid file name: '{name}'")
+  return name
+
+
+def _clean_id(value: str, what: str) -> str:
+  """``value`` from a request that is used as a single folder name, a workspace or job id"""
+  if value in ("", ".", "..") or "/" in value or "\\" in value:
+    raise ValueError(f"Invalid {what}: '{value}'")
+  return value
+
+
+class RelicStoreService:
+  def __init__(self, root: str, url: str):
+    """The ``RelicStore`` RPCs over the folder ``{root}/relics``, ``url`` is where the stand-in server is reachable"""
+    self.root = os.path.join(root, "relics")
+    self.url = url.rstrip("/")
+    self._lock = threading.Lock()
+    os.makedirs(self.root, exist_ok = True)
+
+  def _relic_dir(self, workspace_id: str, relic_name: str) -> str:
+    return os.path.join(self.root, _clean_id(workspace_id or "personal", "workspace_id"), _clean(relic_name))
+
+  def _meta_path(self, workspace_id: str, relic_name: str) -> str:
+    return os.path.join(self._relic_dir(workspace_id, relic_name), "relic.pb")
+
+  def _load(self, workspace_id: str, relic_name: str) -> Optional[Relic]:
+    try:
+      with open(self._meta_path(workspace_id, relic_name), "rb") as f:
+        relic = Relic()
+        relic.ParseFromString(f.read())
+        return relic
+    except FileNotFoundError:
+      return None
+
+  def file_path(self, workspace_id: str, relic_name: str, name: str) -> str:
+    """Path on the disk of the file ``name`` of this relic, also used by the server for uploads and downloads"""
+    return os.path.join(self._relic_dir(workspace_id, relic_name), "files", *_clean(name).split("/"))
+
+  def _file_url(self, workspace_id: str, relic_name: str, name: str) -> str:
+    return f"{self.url}{OBJECTS_PATH}/{quote(workspace_id or 'personal')}/{quote(relic_name)}/{quote(_clean(name))}"
+
+  def _stat(self, path: str, name: str) -> RelicFile:
+    st = os.stat(path)
+    if os.path.isdir(path):
+      return RelicFile(name = name + "/", type = RelicFile.RelicType.FOLDER)
+    return RelicFile(
+      name = name,
+      size = st.st_size,
+      created_on = int(st.st_ctime),
+      last_modified = int(st.st_mtime),
+      type = RelicFile.RelicType.FILE,
+    )
+
+  # RPCs, a string return is sent to the client as a 400
+
+  def create_relic(self, req: CreateRelicRequest) -> Relic:
+    with self._lock:
+      relic = self._load(req.workspace_id, req.name)
+      if relic is not None:
+        return relic
+      now = int(time.time())
+      relic = Relic(
+        id = f"relic_{req.workspace_id or 'personal'}_{req.name}",
+        name = req.name,
+        workspace_id = req.workspace_id,
+        created_on = now,
+        last_modified = now,
+        bucket_meta = req.bucket_meta,
+      )
+      os.makedirs(os.path.join(self._relic_dir(req.workspace_id, req.name), "files"), exist_ok = True)
+      with open(self._meta_path(req.workspace_id, req.name), "wb") as f:
+        f.write(relic.SerializeToString())
+    logger.debug(f"Created relic {relic.id}")
+    return relic
+
+  def list_relics(self, req: ListRelicsRequest) -> ListRelicsResponse:
+    folder = os.path.join(self.root, _clean_id(req.workspace_id or "personal", "workspace_id"))
+    out = ListRelicsResponse()
+    for name in sorted(os.listdir(folder)) if os.path.isdir(folder) else []:
+      if req.relic_name and name != req.relic_name:
+        continue
+      relic = self._load(req.workspace_id, name)
+      if relic is not None:
+        out.relics.append(relic)
+    out.total_relics = len(out.relics)
+    return out
+
+  def update_relic_meta(self, relic: Relic) -> Acknowledge:
+    if self._load(relic.workspace_id, relic.name) is None:
+      return f"Relic '{relic.name}' not found"
+    with open(self._meta_path(relic.workspace_id, relic.name), "wb") as f:
+      f.write(relic.SerializeToString())
+    return Acknowledge(success = True)
+
+  def delete_relic(self, relic: Relic) -> Acknowledge:
+    folder = self._relic_dir(relic.workspace_id, relic.name)
+    if not os.path.isdir(folder):
+      return f"Relic '{relic.name}' not found"
+    shutil.rmtree(folder)
+    return Acknowledge(success = True)
+
+  def get_relic_details(self, relic: Relic) -> Relic:
+    out = self._load(relic.workspace_id, relic.name)
+    if out is None:
+      return f"Relic '{relic.name}' not found"
+    return out
+
+  def create_file(self, relic_file: RelicFile) -> RelicFile:
+    if self._load(relic_file.workspace_id, relic_file.relic_name) is None:
+      return f"Relic '{relic_file.relic_name}' not found"
+    name = _clean(relic_file.name)
+    out = RelicFile(name = name, url = self._file_url(relic_file.workspace_id, relic_file.relic_name, name))
+    out.body["key"] = name
+    return out
+
+  def download_file(self, relic_file: RelicFile) -> RelicFile:
+    path = self.file_path(relic_file.workspace_id, relic_file.relic_name, relic_file.name)
+    if not os.path.isfile(path):
+      return f"File '{relic_file.name}' not found"
+    out = self._stat(path, _clean(relic_file.name))
+    out.url = self._file_url(relic_file.workspace_id, relic_file.relic_name, relic_file.name)
+    return out
+
+  def list_relic_files(self, req: ListRelicFilesRequest) -> ListRelicFilesResponse:
+    prefix = req.prefix.strip("/")
+    folder = os.path.join(self._relic_dir(req.workspace_id, req.relic_name), "files", *(prefix.split("/") if prefix else []))
+    entries: List[Tuple[str, str]] = []
+    if os.path.isdir(folder):
+      for x in sorted(os.listdir(folder)):
+        if x.endswith(".tmp") or (req.file_name and not x.startswith(req.file_name)):
+          continue
+        entries.append((os.path.join(folder, x), f"{prefix}/{x}" if prefix else x))
+
+    out = ListRelicFilesResponse(total_files = len(entries))
+    start = req.page_no * FILES_PER_PAGE
+    for path, name in entries[start:start + FILES_PER_PAGE]:
+      try:
+        out.files.append(self._stat(path, name))
+      except FileNotFoundError:
+        # deleted while listing
+        pass
+    return out
+
+  def delete_relic_file(self, relic_file: RelicFile) -> Acknowledge:
+    path = self.file_path(relic_file.workspace_id, relic_file.relic_name, relic_file.name)
+    if os.path.isdir(path):
+      shutil.rmtree(path)
+    elif os.path.isfile(path):
+      os.remove(path)
+    else:
+      return f"File '{relic_file.name}' not found"
+    return Acknowledge(success = True)
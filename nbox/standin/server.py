@@ -0,0 +1,290 @@
+"""
+The HTTP server of the stand-in backend, it speaks the same Echo + base64 protocol as the hosted services:
+
+* ``POST /relics/{rpc}`` and ``POST /lmao/{rpc}``: the RPCs, routed to ``RelicStoreService`` and ``LmaoService``
+* ``POST|GET /_objects/{workspace_id}/{relic_name}/{name}``: the "signed URLs" for uploading and downloading files,
+  uploads are the same multipart form as S3 POST uploads and downloads support range requests
+* ``GET /api/v1/...``: the REST APIs of the webserver used by ``nbox.jobs``
+
+The gRPC ``WSJobService`` runs on the next port. Everything is threaded so the parallel clients (``put_many``, ``map``)
+are served in parallel like they would be by the hosted services.
+"""
+
+import os
+import json
+import threading
+from typing import Any, Callable, Dict, Tuple
+from inspect import signature
+from urllib.parse import urlparse, unquote, parse_qsl
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from nbox.utils import logger, env
+from nbox.sublime._yql.rest_pb2 import Echo
+from nbox.sublime._yql.common import run_rpc, message_to_b64, b64_to_message, dict_to_message, message_to_dict
+from nbox.sublime.relics_rpc_client import RelicStore_Stub
+from nbox.sublime.lmao_client import LMAO_Stub
+from nbox.standin.relics import RelicStoreService, OBJECTS_PATH
+from nbox.standin.lmao import LmaoService
+from nbox.standin.jobs import JobService, OPENAPI_SPEC
+
+# the URL used when ``NBOX_LOCAL_BACKEND`` is not set
+DEFAULT_URL = "http://127.0.0.1:8081"
+
+
+def _rpc_types(stub_cls) -> Dict[str, Tuple[Any, Any]]:
+  """``{rpc_name: (request_class, response_class)}`` read from the type hints of the generated client stub"""
+  out = {}
+  for name in dir(stub_cls):
+    fn = getattr(stub_cls, name)
+    if name.startswith("_") or not callable(fn):
+      continue
+    params = list(signature(fn).parameters.values())
+    if len(params) == 2:
+      out[name] = (params[1].annotation, signature(fn).return_annotation)
+  return out
+
+
+def get_grpc_address(url: str) -> str:
+  """The gRPC job service listens on the port after the HTTP port of ``url``"""
+  u = urlparse(url)
+  return f"{u.hostname}:{(u.port or 80) + 1}"
+
+
+class _Handler(BaseHTTPRequestHandler):
+  protocol_version = "HTTP/1.1"
+  # small replies would otherwise wait for the delayed ACK of the headers
+  disable_nagle_algorithm = True
+  server: "_HTTPServer"
+
+  def log_message(self, format, *args):
+    logger.debug(f"standin: {format % args}")
+
+  def _reply(self, code: int, body: bytes = b"", content_type: str = "application/json", headers: Dict[str, str] = {}):
+    self.send_response(code)
+    self.send_header("Content-Type", content_type)
+    self.send_header("Content-Length", str(len(body)))
+    for k, v in headers.items():
+      self.send_header(k, v)
+    self.end_headers()
+    if body:
+      self.wfile.write(body)
+
+  def _reply_json(self, code: int, data):
+    self._reply(code, json.dumps(data).encode("utf-8"))
+
+  def _object_path(self, path: str) -> str:
+    workspace_id, relic_name, name = unquote(path[len(OBJECTS_PATH) + 1:]).split("/", 2)
+    return self.server.standin.relics.file_path(workspace_id, relic_name, name)
+
+  def do_POST(self):
+    path = urlparse(self.path).path
+    try:
+      if path.startswith(OBJECTS_PATH + "/"):
+        return self._upload(self._object_path(path))
+      service, _, rpc_name = path.strip("/").rpartition("/")
+      return self._rpc(service, rpc_name)
+    except Exception as e:
+      logger.error(f"standin: POST {path} failed: {e}")
+      self._reply_json(500, {"message": "500: INTERNAL SERVER ERROR"})
+
+  def do_GET(self):
+    u = urlparse(self.path)
+    try:
+      if u.path.startswith(OBJECTS_PATH + "/"):
+        return self._download(self._object_path(u.path))
+      parts = [unquote(x) for x in u.path.strip("/").split("/")]
+      if parts[:2] != ["api", "v1"]:
+        return self._reply_json(404, {"message": f"No path '{u.path}'"})
+      if parts[2:] == ["openapi.json"]:
+        return self._reply_json(200, OPENAPI_SPEC)
+      code, data = self.server.standin.jobs.rest(parts[2:], dict(parse_qsl(u.query)))
+      self._reply_json(code, {"data": data} if code == 200 else {"message": data})
+    except Exception as e:
+      logger.error(f"standin: GET {u.path} failed: {e}")
+      self._reply_json(500, {"message": "500: INTERNAL SERVER ERROR"})
+
+  def _rpc(self, service: str, rpc_name: str):
+    data = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+    target = self.server.standin.services.get(service)
+    if target is None or rpc_name not in target[1]:
+      return self._reply_json(501, {"message": "501: NOT IMPLEMENTED"})
+    impl, types = target
+    fn = getattr(impl, rpc_name, None)
+    if fn is None:
+      return self._reply_json(501, {"message": "501: NOT IMPLEMENTED"})
+
+    echo = dict_to_message(json.loads(data or b"{}"), Echo())
+    request_cls, _ = types[rpc_name]
+    out = run_rpc(fn, b64_to_message(echo.base64_string, request_cls()))
+    if isinstance(out, Echo):
+      # errors come back as an Echo with the status code in the message
+      code = int(out.message[:3]) if out.message[:3].isdigit() else 500
+      if code == 400:
+        # the client adds the code when logging it
+        out.message = out.message[len("400: "):]
+      return self._reply_json(code, message_to_dict(out))
+    self._reply_json(200, message_to_dict(Echo(
+      message = out.__class__.__name__, base64_string = message_to_b64(out), rpc_name = rpc_name
+    )))
+
+  def _upload(self, fp: str):
+    # multipart form with the "file" as the last field, the file is copied to disk as it is received
+    remaining = int(self.headers["Content-Length"])
+    boundary = self.headers["Content-Type"].split("boundary=", 1)[1].strip('"').encode("utf-8")
+    while True:
+      line = self.rfile.readline(1 << 16)
+      remaining -= len(line)
+      if not line:
+        return self._reply_json(400, {"message": "400: no file in the form"})
+      if line.startswith(b"Content-Disposition") and b'name="file"' in line:
+        break
+    while True:
+      line = self.rfile.readline(1 << 16)
+      remaining -= len(line)
+      if line in (b"\r\n", b""):
+        break
+    tail = len(b"\r\n--" + boundary + b"--\r\n")
+    size = remaining - tail
+    if size < 0:
+      return self._reply_json(400, {"message": "400: malformed form"})
+
+    os.makedirs(os.path.dirname(fp), exist_ok = True)
+    tmp = f"{fp}.{threading.get_ident()}.tmp"
+    with open(tmp, "wb") as f:
+      while size > 0:
+        chunk = self.rfile.read(min(size, 1 << 20))
+        if not chunk:
+          os.remove(tmp)
+          return self._reply_json(400, {"message": "400: incomplete upload"})
+        f.write(chunk)
+        size -= len(chunk)
+    self.rfile.read(tail)
+    os.replace(tmp, fp)
+    self._reply(204)
+
+  def _download(self, fp: str):
+    if not os.path.isfile(fp):
+      return self._reply(404, b"NoSuchKey", "text/plain")
+    total = os.path.getsize(fp)
+    start, end = 0, total - 1
+    code, headers = 200, {"Accept-Ranges": "bytes"}
+    rng = self.headers.get("Range")
+    if rng and rng.startswith("bytes="):
+      a, _, b = rng[len("bytes="):].partition("-")
+      start = int(a) if a else max(total - int(b), 0)
+      end = min(int(b), total - 1) if (a and b) else total - 1
+      if start >= total:
+        return self._reply(416, b"", "text/plain", {"Content-Range": f"bytes */{total}"})
+      code = 206
+      headers["Content-Range"] = f"bytes {start}-{end}/{total}"
+    self.send_response(code)
+    self.send_header("Content-Type", "application/octet-stream")
+    self.send_header("Content-Length", str(end - start + 1))
+    for k, v in headers.items():
+      self.send_header(k, v)
+    self.end_headers()
+    with open(fp, "rb") as f:
+      f.seek(start)
+      left = end - start + 1
+      while left > 0:
+        chunk = f.read(min(left, 1 << 20))
+        if not chunk:
+          break
+        self.wfile.write(chunk)
+        left -= len(chunk)
+
+
+class _HTTPServer(ThreadingHTTPServer):
+  daemon_threads = True
+  standin: "StandinServer"
+
+
+class StandinServer:
+  def __init__(self, root: str = "", url: str = "", workers: int = 8, grpc: bool = True):
+    """Local stand-in for the NimbleBox services (Relics, LMAO and Jobs) that keeps everything on the disk.
+
+    Args:
+      root (str): Folder for all the data, defaults to ``{NBOX_HOME_DIR}/standin``
+      url (str): Where to listen, defaults to ``NBOX_LOCAL_BACKEND`` or ``DEFAULT_URL``, gRPC is on the next port
+      workers (int): Number of job runs that can execute at the same time
+      grpc (bool): Also start the gRPC job service
+    """
+    self.root = root or os.path.join(env.NBOX_HOME_DIR(), "standin")
+    self.url = (url or env.NBOX_LOCAL_BACKEND() or DEFAULT_URL).rstrip("/")
+    self.relics = RelicStoreService(self.root, self.url)
+    self.lmao = LmaoService(self.root)
+    self.jobs = JobService(self.root, workers = workers)
+    self.services = {
+      "relics": (self.relics, _rpc_types(RelicStore_Stub)),
+      "lmao": (self.lmao, _rpc_types(LMAO_Stub)),
+    }
+    self._use_grpc = grpc
+    self._http = None
+    self._grpc = None
+
+  def __repr__(self):
+    return f"StandinServer({self.url}, {self.root})"
+
+  def add_job(self, name: str, op: Callable, workspace_id: str = "") -> str:
+    """Register ``op`` as a job, see ``JobService.add_job``"""
+    return self.jobs.add_job(name, op, workspace_id)
+
+  def start(self) -> "StandinServer":
+    """Start serving in background threads"""
+    u = urlparse(self.url)
+    self._http = _HTTPServer((u.hostname, u.port or 80), _Handler)
+    self._http.standin = self
+    threading.Thread(target = self._http.serve_forever, daemon = True, name = "standin_http").start()
+
+    if self._use_grpc:
+      import grpc
+      from concurrent.futures import ThreadPoolExecutor
+      from nbox.hyperloop.nbox_ws_pb2_grpc import add_WSJobServiceServicer_to_server
+      self._grpc = grpc.server(ThreadPoolExecutor(16, thread_name_prefix = "standin_grpc"))
+      add_WSJobServiceServicer_to_server(self.jobs, self._grpc)
+      self._grpc.add_insecure_port(get_grpc_address(self.url))
+      self._grpc.start()
+    logger.info(f"Stand-in backend at {self.url} (data: {self.root})")
+    return self
+
+  def stop(self):
+    if self._http is not None:
+      self._http.shutdown()
+      self._http.server_close()
+      self._http = None
+    if self._grpc is not None:
+      self._grpc.stop(grace = None)
+      self._grpc = None
+    self.jobs.stop()
+
+  def __enter__(self):
+    return self.start()
+
+  def __exit__(self, *_):
+    self.stop()
+
+
+def serve(root: str = "", url: str = "", workers: int = 8, jobs: Dict[str, str] = {}):
+  """Run the stand-in backend till interrupted, point the clients to it with ``NBOX_LOCAL_BACKEND={url}``.
+
+  Args:
+    root (str): Folder for all the data, defaults to ``{NBOX_HOME_DIR}/standin``
+    url (str): Where to listen, defaults to ``NBOX_LOCAL_BACKEND`` or ``DEFAULT_URL``
+    workers (int): Number of job runs that can execute at the same time
+    jobs (Dict[str, str]): ``{job_name: "module:function"}`` of the jobs to register
+  """
+  import time
+  from importlib import import_module
+
+  server = StandinServer(root, url, workers)
+  for name, target in jobs.items():
+    module, _, attr = target.partition(":")
+    server.add_job(name, getattr(import_module(module), attr))
+  server.start()
+  try:
+    while True:
+      time.sleep(3600)
+  except KeyboardInterrupt:
+    pass
+  finally:
+    server.stop()
@@ -0,0 +1,238 @@
+"""
+Garbage collection of the files that ``nbox`` keeps in ``NBOX_HOME_DIR``. Every folder that grows over time is an
+*area* with its own size and age budget, when an area is over its size the least recently used entries are removed.
+The access time of an entry is the later of its ``atime`` and ``mtime``, the caches bump the ``mtime`` on every hit
+since ``atime`` is not updated on ``noatime`` mounts.
+
+.. code-block:: bash
+
+  nbx cache stats
+  nbx cache gc --dry_run
+  nbx cache gc --area=relics --max_size=1073741824
+
+A file ``x`` and its sidecar ``x.meta`` are one entry and are removed together, meta first. The collection also runs
+on its own in a background thread when something is written to a cache (relic cache fills, the tiered relics and
+``U.fetch``), at most once every ``GC_INTERVAL`` seconds, set ``NBOX_NO_CACHE_GC`` to disable it.
+"""
+
+import os
+import json
+import time
+import threading
+from glob import glob
+from typing import Callable, Dict, List, Optional, Tuple
+
+from nbox.utils import logger, env
+
+# entries used in the last these many seconds are never removed, another process might be reading or writing them
+GC_GRACE_SECONDS = 60
+
+# the background collection runs at most this often
+GC_INTERVAL = 24 * 60 * 60
+
+_DAY = 24 * 60 * 60
+
+
+def _tiered_keep(data_path: str) -> bool:
+  # entries of a write-back tier that have not been uploaded yet are the only copy of the data
+  try:
+    with open(data_path + ".meta", "r") as f:
+      return bool(json.load(f).get("dirty"))
+  except (FileNotFoundError, ValueError):
+    return False
+
+
+class CacheArea:
+  def __init__(
+    self,
+    name: str,
+    path: str,
+    max_size: Optional[int],
+    max_age: Optional[float],
+    recursive: bool = True,
+    pattern: str = "*",
+    keep: Callable[[str], bool] = None,
+  ):
+    """One folder in ``NBOX_HOME_DIR`` with its budgets.
+
+    Args:
+      name (str): Name shown in the CLI
+      path (str): Folder relative to ``NBOX_HOME_DIR``
+      max_size (int): Size budget in bytes, ``None`` for no limit
+      max_age (float): Entries not used for these many seconds are removed, ``None`` for no limit
+      recursive (bool): Go into the sub folders
+      pattern (str): Only the files matching this glob pattern are managed
+      keep (Callable): Called with the path of the entry, if it returns ``True`` the entry is never removed
+    """
+    self.name = name
+    self.path = path
+    self.max_size = max_size
+    self.max_age = max_age
+    self.recursive = recursive
+    self.pattern = pattern
+    self.keep = keep
+
+  def __repr__(self):
+    return f"CacheArea({self.name}, {self.path}, max_size = {self.max_size}, max_age = {self.max_age})"
+
+  @property
+  def folder(self) -> str:
+    return os.path.join(env.NBOX_HOME_DIR(), self.path)
+
+  def entries(self) -> List[Tuple[float, int, str, List[str]]]:
+    """List of ``(last_access, size, data_path, all_paths)`` of the entries in this area"""
+    if not os.path.isdir(self.folder):
+      return []
+    pattern = os.path.join(self.folder, "**", self.pattern) if self.recursive else os.path.join(self.folder, self.pattern)
+    entries: Dict[str, List] = {}
+    for fp in glob(pattern, recursive = self.recursive):
+      if fp.endswith(".tmp") or not os.path.isfile(fp):
+        continue
+      try:
+        st = os.stat(fp)
+      except FileNotFoundError:
+        continue
+      key = fp[:-len(".meta")] if fp.endswith(".meta") else fp
+      e = entries.setdefault(key, [0, 0, key, []])
+      e[0] = max(e[0], st.st_atime, st.st_mtime)
+      e[1] += st.st_size
+      e[3].append(fp)
+    return [tuple(e) for e in entries.values()]
+
+  def stats(self) -> Dict[str, float]:
+    entries = self.entries()
+    return {
+      "entries": len(entries),
+      "size": sum(e[1] for e in entries),
+      "oldest": min([e[0] for e in entries], default = 0),
+    }
+
+  def gc(self, max_size: int = None, max_age: float = None, dry_run: bool = False) -> Tuple[int, int]:
+    """Remove the expired entries and then the least recently used ones till the area is under ``max_size``.
+    Returns the number of entries and bytes removed."""
+    max_size = self.max_size if max_size is None else max_size
+    max_age = self.max_age if max_age is None else max_age
+    if max_size is None and max_age is None:
+      return 0, 0
+
+    now = time.time()
+    entries = sorted(self.entries())
+    total = sum(e[1] for e in entries)
+    removed, freed = 0, 0
+    for last_access, size, data_path, paths in entries:
+      expired = max_age is not None and now - last_access > max_age
+      over = max_size is not None and total - freed > max_size
+      if not (expired or over):
+        # sorted by access time, nothing after this is expired either
+        break
+      if now - last_access < GC_GRACE_SECONDS or (self.keep is not None and self.keep(data_path)):
+        continue
+      if dry_run:
+        logger.info(f"  [{self.name}] remove: {data_path} ({size} bytes)")
+      else:
+        for fp in sorted(paths, key = lambda x: not x.endswith(".meta")):
+          try:
+            os.remove(fp)
+          except FileNotFoundError:
+            pass
+      removed += 1
+      freed += size
+    return removed, freed
+
+
+def get_areas() -> Dict[str, CacheArea]:
+  """All the areas that ``nbox`` writes to, the budgets are read each time so the environment can change them"""
+  return {x.name: x for x in [
+    CacheArea("relics", ".cache/relics", int(env.NBOX_RELICS_CACHE_SIZE(5 << 30)), 30 * _DAY),
+    CacheArea("tiered", ".cache/tiered", 5 << 30, 30 * _DAY, keep = _tiered_keep),
+    CacheArea("sync", ".cache/sync", 64 << 20, 90 * _DAY),
+    CacheArea("fetch", ".cache/fetch", 1 << 30, 30 * _DAY),
+    CacheArea("pages", ".cache", 64 << 20, 7 * _DAY, recursive = False, pattern = "*.html"),
+    CacheArea("traces", "traces", 1 << 30, 30 * _DAY),
+    CacheArea("tunnel_logs", "tunnel_logs", 256 << 20, 30 * _DAY),
+    # this is the storage of RelicLocal and not a cache, removing files there loses data so no budgets by default
+    CacheArea("relic_items", "relics/items", None, None),
+  ]}
+
+
+class CacheManager:
+  def __init__(self):
+    """Manage the caches in ``NBOX_HOME_DIR``, see ``nbox.sub_utils.cache`` for the areas."""
+    self.areas = get_areas()
+
+  def _select(self, area: str = "") -> List[CacheArea]:
+    if not area:
+      return list(self.areas.values())
+    if area not in self.areas:
+      raise ValueError(f"Unknown area '{area}', should be one of {list(self.areas)}")
+    return [self.areas[area]]
+
+  def stats(self, area: str = "") -> Dict[str, Dict[str, float]]:
+    """Number of entries and bytes used by each area along with its budgets"""
+    out = {}
+    for a in self._select(area):
+      s = a.stats()
+      s.update({"max_size": a.max_size, "max_age": a.max_age})
+      out[a.name] = s
+      budget = f"{a.max_size / (1 << 20):.1f} MB" if a.max_size is not None else "no limit"
+      logger.info(f"{a.name:>12}: {s['entries']:>6} entries, {s['size'] / (1 << 20):>8.1f} MB / {budget} ({a.folder})")
+    return out
+
+  def gc(self, area: str = "", max_size: int = None, max_age: float = None, dry_run: bool = False) -> Dict[str, int]:
+    """Remove the expired and least recently used entries till every area is in its budget.
+
+    Args:
+      area (str): Only collect this area, by default all the areas are collected
+      max_size (int): Override the size budget in bytes
+      max_age (float): Override the age budget in seconds
+      dry_run (bool): Only log what would be removed
+    """
+    out = {}
+    for a in self._select(area):
+      removed, freed = a.gc(max_size = max_size, max_age = max_age, dry_run = dry_run)
+      out[a.name] = freed
+      if removed:
+        logger.info(f"{a.name}: {'would remove' if dry_run else 'removed'} {removed} entries, {freed / (1 << 20):.1f} MB")
+    return out
+
+
+def _stamp_path() -> str:
+  return os.path.join(env.NBOX_HOME_DIR(), ".cache", ".last_gc")
+
+
+# time after which this process checks the stamp again, the cache writes call maybe_gc for every file
+_next_check = 0.0
+
+
+def maybe_gc() -> Optional[threading.Thread]:
+  """Run the garbage collection in a background thread if it has not run in the last ``GC_INTERVAL`` seconds"""
+  global _next_check
+  if env.NBOX_NO_CACHE_GC() or time.time() < _next_check:
+    return None
+  stamp = _stamp_path()
+  try:
+    last = os.stat(stamp).st_mtime
+    if time.time() - last < GC_INTERVAL:
+      _next_check = last + GC_INTERVAL
+      return None
+  except FileNotFoundError:
+    pass
+  _next_check = time.time() + GC_INTERVAL
+
+  # touch the stamp first, so that the other processes starting now do not run it as well
+  try:
+    os.makedirs(os.path.dirname(stamp), exist_ok = True)
+    with open(stamp, "w") as f:
+      f.write(str(int(time.time())))
+  except OSError:
+    return None
+
+  def _gc():
+    try:
+      CacheManager().gc()
+    except Exception as e:
+      logger.debug(f"Background cache gc failed: {e}")
+
+  t = threading.Thread(target = _gc, daemon = True, name = "nbox_cache_gc")
+  t.start()
+  return t
@@ -67,6 +67,12 @@ class env:
   #. ``NBOX_NO_LOAD_WS``: If set, will not load webserver subway
   #. ``NBOX_LMAO_DISABLE_RELICS``: If set, Monitoring data will be stored on the cloud Relic
   #. ``NBOX_LMAO_DISABLE_SYSTEM_METRICS``: If set, system metrics will not logged in monitoring
+  #. ``NBOX_RELICS_CACHE_SIZE``: Size cap in bytes of the local cache for Relics, by default 5GiB
+  #. ``NBOX_RELICS_OFFLINE``: If set, Relics will only serve files already in the local cache and never call the server
+  #. ``NBOX_RELICS_SPILL_SIZE``: Objects larger than these many bytes are spilled to disk while being uploaded, by default 256MiB
+  #. ``NBOX_NO_CACHE_GC``: If set, the caches in ``NBOX_HOME_DIR`` are not garbage collected in the background
+  #. ``NBOX_LOCAL_BACKEND``: URL of a stand-in backend (``nbox.standin``), if set all the services are called there\
+    and no login is needed, ex. ``NBOX_LOCAL_BACKEND=http://127.0.0.1:8081``
   """
   NBOX_LOG_LEVEL = lambda x: os.getenv("NBOX_LOG_LEVEL", x)
   NBOX_JSON_LOG = lambda x: os.getenv("NBOX_JSON_LOG", x)
@@ -78,6 +84,11 @@ class env:
   NBOX_NO_LOAD_GRPC = lambda: os.getenv("NBOX_NO_LOAD_GRPC", False)
   NBOX_NO_LOAD_WS = lambda: os.getenv("NBOX_NO_LOAD_WS", False)
   NBOX_NO_CHECK_VERSION = lambda: os.getenv("NBOX_NO_CHECK_VERSION", False)
+  NBOX_RELICS_CACHE_SIZE = lambda x: os.getenv("NBOX_RELICS_CACHE_SIZE", x)
+  NBOX_RELICS_OFFLINE = lambda: os.getenv("NBOX_RELICS_OFFLINE", False)
+  NBOX_RELICS_SPILL_SIZE = lambda x: os.getenv("NBOX_RELICS_SPILL_SIZE", x)
+  NBOX_NO_CACHE_GC = lambda: os.getenv("NBOX_NO_CACHE_GC", False)
+  NBOX_LOCAL_BACKEND = lambda: os.getenv("NBOX_LOCAL_BACKEND", "")
 
   def set(key, value):
     os.environ[key] = value
@@ -230,8 +241,11 @@ def get_files_in_folder(folder, ext = ["*"], abs_path: bool = True, followlinks:
 
 def fetch(url, force = False):
   """Fetch and cache a url for faster loading, ``force`` re-downloads"""
-  fp = join(tempfile.gettempdir(), hash_(url))
+  folder = join(env.NBOX_HOME_DIR(), ".cache", "fetch")
+  os.makedirs(folder, exist_ok = True)
+  fp = join(folder, hash_(url))
   if os.path.isfile(fp) and os.stat(fp).st_size > 0 and not force:
+    os.utime(fp) # used as the access time by the cache gc
     with open(fp, "rb") as f:
       dat = f.read()
   else:
@@ -239,6 +253,8 @@ def fetch(url, force = False):
     with open(fp + ".tmp", "wb") as f:
       f.write(dat)
     os.rename(fp + ".tmp", fp)
+    from nbox.sub_utils.cache import maybe_gc # imports nbox.utils
+    maybe_gc()
   return dat
 
 def folder(x):
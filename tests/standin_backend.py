@@ -0,0 +1,24 @@
+"""
+Stand-in backend (``nbox.standin``) for the tests that talk to relics and LMAO, one server per test process on a free
+port. Import this before ``nbox`` so that ``NBOX_LOCAL_BACKEND`` is set when the clients are created.
+"""
+
+import os
+import socket
+import atexit
+import tempfile
+
+
+def _free_port() -> int:
+  with socket.socket() as s:
+    s.bind(("127.0.0.1", 0))
+    return s.getsockname()[1]
+
+
+os.environ["NBOX_LOCAL_BACKEND"] = f"http://127.0.0.1:{_free_port()}"
+
+from nbox.standin import StandinServer
+
+ROOT = tempfile.mkdtemp(prefix = "nbox_standin_")
+server = StandinServer(root = ROOT, grpc = False).start()
+atexit.register(server.stop)
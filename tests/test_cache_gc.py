@@ -0,0 +1,131 @@
+import os
+import time
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from nbox.sub_utils import cache
+from nbox.sub_utils.cache import CacheArea, CacheManager, maybe_gc
+
+
+class CacheAreaTest(unittest.TestCase):
+  def setUp(self):
+    self.home = tempfile.mkdtemp()
+    self.env = mock.patch.dict(os.environ, {"NBOX_HOME_DIR": self.home})
+    self.env.start()
+    self.area = CacheArea("test", "area", max_size = None, max_age = None)
+    self.now = time.time()
+
+  def tearDown(self):
+    self.env.stop()
+    shutil.rmtree(self.home, ignore_errors = True)
+
+  def write(self, name: str, size: int, age: float, meta: str = None) -> str:
+    fp = os.path.join(self.area.folder, name)
+    os.makedirs(os.path.dirname(fp), exist_ok = True)
+    with open(fp, "wb") as f:
+      f.write(b"x" * size)
+    os.utime(fp, (self.now - age, self.now - age))
+    if meta is not None:
+      with open(fp + ".meta", "w") as f:
+        f.write(meta)
+      os.utime(fp + ".meta", (self.now - age, self.now - age))
+    return fp
+
+  def left(self) -> list:
+    return sorted(os.path.relpath(e[2], self.area.folder) for e in self.area.entries())
+
+  def test_entries_join_the_sidecar(self):
+    self.write("a", 10, 100, meta = "{}")
+    self.write("sub/b", 5, 100)
+    self.write("c.tmp", 5, 100)
+    self.assertEqual(self.area.stats()["entries"], 2)
+    self.assertEqual(self.area.stats()["size"], 17)
+
+  def test_lru_till_under_size(self):
+    for i, age in enumerate([1000, 3000, 2000, 500]):
+      self.write(f"{i}", 100, age)
+    self.assertEqual(self.area.gc(max_size = 250, dry_run = True), (2, 200))
+    self.assertEqual(len(self.left()), 4)
+    self.assertEqual(self.area.gc(max_size = 250), (2, 200))
+    self.assertEqual(self.left(), ["0", "3"])
+
+  def test_age(self):
+    self.write("old", 10, 3000, meta = "{}")
+    self.write("new", 10, 100)
+    self.assertEqual(self.area.gc(max_age = 1000), (1, 12))
+    self.assertEqual(self.left(), ["new"])
+    self.assertFalse(os.path.exists(os.path.join(self.area.folder, "old.meta")))
+
+  def test_recent_and_kept_entries_stay(self):
+    self.write("recent", 100, 1)
+    self.write("dirty", 100, 3000, meta = '{"dirty": true}')
+    self.write("clean", 100, 3000, meta = '{"dirty": false}')
+    self.area.keep = cache._tiered_keep
+    self.assertEqual(self.area.gc(max_size = 0), (1, 100 + len('{"dirty": false}')))
+    self.assertEqual(self.left(), ["dirty", "recent"])
+
+  def test_no_budget(self):
+    self.write("a", 100, 3000)
+    self.assertEqual(self.area.gc(), (0, 0))
+
+  def test_manager(self):
+    with self.assertRaises(ValueError):
+      CacheManager().gc("nope")
+    fp = os.path.join(self.home, ".cache", "relics", "x")
+    os.makedirs(os.path.dirname(fp))
+    with open(fp, "wb") as f:
+      f.write(b"x" * 100)
+    os.utime(fp, (self.now - 3000, self.now - 3000))
+    self.assertEqual(CacheManager().stats("relics")["relics"]["entries"], 1)
+    self.assertEqual(CacheManager().gc("relics", max_size = 0)["relics"], 100)
+    self.assertFalse(os.path.exists(fp))
+
+
+class MaybeGCTest(unittest.TestCase):
+  def setUp(self):
+    self.home = tempfile.mkdtemp()
+    self.env = mock.patch.dict(os.environ, {"NBOX_HOME_DIR": self.home})
+    self.env.start()
+    os.environ.pop("NBOX_NO_CACHE_GC", None)
+    cache._next_check = 0.0
+
+  def tearDown(self):
+    self.env.stop()
+    cache._next_check = 0.0
+    shutil.rmtree(self.home, ignore_errors = True)
+
+  def test_runs_once_per_interval(self):
+    with mock.patch.object(CacheManager, "gc") as m:
+      t = maybe_gc()
+      self.assertIsNotNone(t)
+      t.join()
+      self.assertTrue(os.path.exists(cache._stamp_path()))
+      self.assertIsNone(maybe_gc())
+    self.assertEqual(m.call_count, 1)
+
+  def test_stamp_of_another_process(self):
+    os.makedirs(os.path.dirname(cache._stamp_path()))
+    with open(cache._stamp_path(), "w") as f:
+      f.write("0")
+    with mock.patch.object(cache.os, "stat", wraps = os.stat) as m:
+      self.assertIsNone(maybe_gc())
+      self.assertIsNone(maybe_gc()) # the stamp is not read again till the interval is over
+    self.assertEqual(m.call_count, 1)
+
+    old = time.time() - cache.GC_INTERVAL - 10
+    os.utime(cache._stamp_path(), (old, old))
+    cache._next_check = 0.0
+    with mock.patch.object(CacheManager, "gc") as m:
+      maybe_gc().join()
+    self.assertEqual(m.call_count, 1)
+
+  def test_disabled(self):
+    with mock.patch.dict(os.environ, {"NBOX_NO_CACHE_GC": "1"}):
+      self.assertIsNone(maybe_gc())
+    self.assertFalse(os.path.exists(cache._stamp_path()))
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,59 @@
+import io
+import os
+import tempfile
+import unittest
+
+from nbox.relics.codec import dump_object, load_object, pa
+
+try:
+  import pandas as pd
+except ImportError:
+  pd = None
+
+
+def dump(obj):
+  f = io.BytesIO()
+  codec = dump_object(obj, f)
+  return codec, f.getvalue()
+
+
+@unittest.skipIf(pa is None or pd is None, "needs pyarrow and pandas")
+class CodecTest(unittest.TestCase):
+  def test_dataframe_round_trip_with_index(self):
+    df = pd.DataFrame({"a": [1, 2, 3], "b": ["x", "y", "z"], "c": [0.5, 1.5, 2.5]}, index = pd.Index([10, 20, 30], name = "id"))
+    codec, data = dump(df)
+    self.assertEqual(codec, "arrow")
+    out = load_object(io.BufferedReader(io.BytesIO(data)))
+    pd.testing.assert_frame_equal(out, df)
+
+  def test_column_projection_keeps_index(self):
+    df = pd.DataFrame({"a": [1, 2], "b": [3, 4]}, index = pd.Index(["p", "q"], name = "key"))
+    _, data = dump(df)
+    with tempfile.TemporaryDirectory() as d:
+      path = os.path.join(d, "df")
+      with open(path, "wb") as f:
+        f.write(data)
+      out = load_object(path, columns = ["b"])
+    pd.testing.assert_frame_equal(out, df[["b"]])
+
+  def test_arrow_table_stays_a_table(self):
+    table = pa.table({"x": [1, 2, 3]})
+    codec, data = dump(table)
+    self.assertEqual(codec, "arrow")
+    out = load_object(io.BufferedReader(io.BytesIO(data)))
+    self.assertIsInstance(out, pa.Table)
+    self.assertEqual(out.column("x").to_pylist(), [1, 2, 3])
+
+  def test_other_objects_are_pickled(self):
+    obj = {"a": [1, 2, 3], "f": lambda x: x + 1}
+    codec, data = dump(obj)
+    self.assertEqual(codec, "pickle")
+    out = load_object(io.BufferedReader(io.BytesIO(data)))
+    self.assertEqual(out["a"], [1, 2, 3])
+    self.assertEqual(out["f"](1), 2)
+
+  def test_unconvertible_dataframe_is_pickled(self):
+    df = pd.DataFrame({"a": [object(), object()]})
+    codec, data = dump(df)
+    self.assertEqual(codec, "pickle")
+    self.assertEqual(len(load_object(io.BufferedReader(io.BytesIO(data)))), 2)
@@ -0,0 +1,84 @@
+import asyncio
+import threading
+import unittest
+
+from nbox.lmao import LmaoASGIMiddleware
+
+
+class FakeShipper:
+  def __init__(self):
+    self.closed = 0
+
+  def close(self, timeout: float = None):
+    self.closed += 1
+
+
+class FakeLmao:
+  def __init__(self):
+    self.ended = []
+
+  def on_serving_end(self, _Serving):
+    self.ended.append(_Serving.agent_token)
+
+
+def middleware(app) -> LmaoASGIMiddleware:
+  # skip the handshake with the monitoring instance
+  m = LmaoASGIMiddleware.__new__(LmaoASGIMiddleware)
+  m.app = app
+  m.shipper = FakeShipper()
+  m.lmao = FakeLmao()
+  m.serving = type("Serving", (), {"agent_token": "token"})()
+  m._closed = False
+  m._close_lock = threading.Lock()
+  return m
+
+
+def run_lifespan(m: LmaoASGIMiddleware) -> list:
+  messages = [{"type": "lifespan.startup"}, {"type": "lifespan.shutdown"}]
+  sent = []
+  async def receive():
+    return messages.pop(0)
+  async def send(message):
+    # the logs are sent before the server is told that the app is done
+    sent.append((message["type"], m.shipper.closed))
+  asyncio.run(m({"type": "lifespan"}, receive, send))
+  return sent
+
+
+class LifespanTest(unittest.TestCase):
+  def test_shutdown_closes(self):
+    async def app(scope, receive, send):
+      while True:
+        message = await receive()
+        await send({"type": message["type"] + ".complete"})
+        if message["type"] == "lifespan.shutdown":
+          return
+
+    m = middleware(app)
+    sent = run_lifespan(m)
+    self.assertEqual(sent, [("lifespan.startup.complete", 0), ("lifespan.shutdown.complete", 1)])
+    self.assertEqual(m.lmao.ended, ["token"])
+
+  def test_shutdown_closes_when_the_app_does_not_complete(self):
+    async def app(scope, receive, send):
+      await receive()
+      await send({"type": "lifespan.startup.complete"})
+      await receive()
+      raise RuntimeError("shutdown handler failed")
+
+    m = middleware(app)
+    with self.assertRaises(RuntimeError):
+      run_lifespan(m)
+    self.assertEqual(m.shipper.closed, 1)
+    self.assertEqual(m.lmao.ended, ["token"])
+
+  def test_close_once(self):
+    m = middleware(None)
+    m.close()
+    m.close()
+    self.assertEqual(m.shipper.closed, 1)
+    self.assertEqual(m.lmao.ended, ["token"])
+
+
+if __name__ == "__main__":
+  unittest.main()
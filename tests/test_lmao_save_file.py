@@ -0,0 +1,96 @@
+import os
+import shutil
+import tempfile
+import unittest
+import threading
+from unittest import mock
+
+from nbox.lmao import Lmao, snapshot_file, OFFLINE_PREFIX
+
+
+class FakeRelic:
+  def __init__(self, fail: bool = False):
+    self.fail = fail
+    self.release = threading.Event()
+    self.uploaded = {}
+
+  def put_many(self, local_paths, names):
+    self.release.wait(5)
+    if self.fail:
+      raise ConnectionError("reset")
+    for fp, name in zip(local_paths, names):
+      with open(fp, "r") as f:
+        self.uploaded[name] = f.read()
+
+
+def offline_lmao(relic: FakeRelic) -> Lmao:
+  # skip the connection to the monitoring instance
+  lmao = Lmao.__new__(Lmao)
+  lmao.save_to_relic = True
+  lmao.lmao = None
+  lmao.run = type("Run", (), {"experiment_id": f"{OFFLINE_PREFIX}run"})()
+  lmao.system_monitoring = lmao._shipper = lmao._uploader = lmao._wal = None
+  lmao._upload_pool = None
+  lmao._uploads = []
+  lmao.get_relic = lambda: relic
+  return lmao
+
+
+class SaveFileTest(unittest.TestCase):
+  def setUp(self):
+    self.home = tempfile.mkdtemp()
+    self.env = mock.patch.dict(os.environ, {"NBOX_HOME_DIR": self.home})
+    self.env.start()
+    self.ckpt = os.path.join(self.home, "ckpt.pt")
+    self.write(self.ckpt, "step 1")
+
+  def tearDown(self):
+    self.env.stop()
+    shutil.rmtree(self.home, ignore_errors = True)
+
+  def write(self, fp: str, data: str):
+    with open(fp, "w") as f:
+      f.write(data)
+
+  def uploads_dir(self) -> list:
+    return os.listdir(os.path.join(self.home, "lmao", "uploads"))
+
+  def test_snapshot_file(self):
+    dst = os.path.join(self.home, "a", "b")
+    snapshot_file(self.ckpt, dst)
+    self.write(self.ckpt, "step 2")
+    with open(dst, "r") as f:
+      self.assertEqual(f.read(), "step 1")
+
+  def test_background_upload_is_not_changed_by_later_writes(self):
+    relic = FakeRelic()
+    lmao = offline_lmao(relic)
+    future = lmao.save_file(self.ckpt, blocking = False)
+    self.assertFalse(future.done())
+    self.write(self.ckpt, "step 2") # training goes on and overwrites the checkpoint
+    relic.release.set()
+    self.assertEqual(future.result(5), [self.ckpt])
+    self.assertEqual(relic.uploaded, {self.ckpt: "step 1"})
+    self.assertEqual(self.uploads_dir(), []) # the snapshot is removed after the upload
+    lmao._upload_pool.shutdown()
+
+  def test_failed_upload(self):
+    relic = FakeRelic(fail = True)
+    relic.release.set()
+    lmao = offline_lmao(relic)
+    with mock.patch("nbox.lmao.logger.error") as m:
+      future = lmao.save_file(self.ckpt, blocking = False)
+      self.assertIsInstance(future.exception(5), ConnectionError)
+      lmao._upload_pool.shutdown()
+    self.assertEqual(m.call_count, 1)
+    self.assertEqual(self.uploads_dir(), [])
+
+  def test_blocking(self):
+    relic = FakeRelic()
+    relic.release.set()
+    self.assertIsNone(offline_lmao(relic).save_file(self.ckpt))
+    self.assertEqual(relic.uploaded, {self.ckpt: "step 1"})
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,84 @@
+import math
+import unittest
+
+from nbox.observability.policy import LogPolicy, PolicyRouter, lttb
+
+
+def offer_all(router: PolicyRouter, key: str, values) -> list:
+  out = []
+  for step, v in enumerate(values):
+    out.extend(router.offer(key, step, v, 0))
+  return out
+
+
+class LTTBTest(unittest.TestCase):
+  def test_keeps_ends_and_size(self):
+    points = [(i, math.sin(i / 10)) for i in range(1000)]
+    out = lttb(points, 50)
+    self.assertEqual(len(out), 50)
+    self.assertEqual(out[0], points[0])
+    self.assertEqual(out[-1], points[-1])
+    self.assertEqual(out, sorted(out))
+
+  def test_keeps_a_spike(self):
+    points = [(i, 0.0) for i in range(100)]
+    points[57] = (57, 10.0)
+    self.assertIn((57, 10.0), lttb(points, 10))
+
+  def test_small_n(self):
+    points = [(i, float(i)) for i in range(5)]
+    self.assertEqual(lttb(points, 10), points)
+    self.assertEqual(lttb(points, 2), points[:2])
+
+
+class PolicyRouterTest(unittest.TestCase):
+  def test_keys_without_policy_are_kept(self):
+    router = PolicyRouter({"grad/": LogPolicy(every_n = 10)})
+    self.assertEqual(len(offer_all(router, "loss", range(20))), 20)
+    self.assertEqual(len(offer_all(router, "grad/w", range(20))), 2)
+
+  def test_longest_prefix_wins(self):
+    router = PolicyRouter({"": LogPolicy(every_n = 2), "grad/": LogPolicy(every_n = 5)})
+    self.assertEqual(len(offer_all(router, "loss", range(10))), 5)
+    self.assertEqual(len(offer_all(router, "grad/w", range(10))), 2)
+
+  def test_window_bound_with_extremes(self):
+    for method in ["lttb", "reservoir"]:
+      router = PolicyRouter({"": LogPolicy(max_points = 10, window = 100, method = method, keep_extremes = True)})
+      values = [math.sin(i / 7) for i in range(1000)]
+      values[333] = 50.0
+      values[666] = -50.0
+      out = offer_all(router, "x", values)
+      self.assertEqual(len(out), 100, method)
+      self.assertIn((333, 50.0), out)
+      self.assertIn((666, -50.0), out)
+      self.assertEqual(router.flush(), {})
+
+  def test_flush_sends_the_partial_window(self):
+    router = PolicyRouter({"": LogPolicy(max_points = 5, window = 100)})
+    self.assertEqual(offer_all(router, "x", range(30)), [])
+    log_type, points = router.flush()["x"]
+    self.assertEqual(len(points), 5)
+    self.assertEqual(router.flush(), {})
+
+  def test_anomaly_is_sent_immediately(self):
+    router = PolicyRouter({"": LogPolicy(every_n = 100, anomaly_z = 5)})
+    offer_all(router, "x", [float(i % 2) for i in range(50)])
+    self.assertEqual(router.offer("x", 50, 1000.0, 0), [(50, 1000.0)])
+    self.assertEqual(router.stats()["forced"], 1)
+
+  def test_gap_extremes_without_window(self):
+    router = PolicyRouter({"": LogPolicy(every_n = 10, keep_extremes = True)})
+    values = [0.0] * 20
+    values[4] = 9.0
+    out = offer_all(router, "x", values)
+    self.assertEqual(out, [(0, 0.0), (4, 9.0), (10, 0.0)])
+
+  def test_default_is_not_shared(self):
+    a = PolicyRouter()
+    a.set("x", LogPolicy(every_n = 2))
+    self.assertFalse(PolicyRouter())
+
+  def test_extremes_need_two_points(self):
+    with self.assertRaises(ValueError):
+      LogPolicy(max_points = 1, keep_extremes = True)
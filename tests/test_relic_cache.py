@@ -0,0 +1,124 @@
+import os
+import time
+import shutil
+import tempfile
+import unittest
+from uuid import uuid4
+from unittest import mock
+
+import standin_backend
+
+from nbox.relics.nbx import RelicsNBX
+from nbox.relics.cache import RelicCache
+from nbox.sublime.relics_rpc_client import RelicFile
+
+
+def write_fn(data: bytes):
+  def _fn(tmp):
+    with open(tmp, "wb") as f:
+      f.write(data)
+  return _fn
+
+
+class RelicCacheTest(unittest.TestCase):
+  def setUp(self):
+    self.folder = tempfile.mkdtemp()
+    self.cache = RelicCache(self.folder, max_size = 1 << 20)
+
+  def tearDown(self):
+    shutil.rmtree(self.folder)
+
+  def test_hit_and_miss(self):
+    remote = RelicFile(name = "a", size = 3, last_modified = 10)
+    self.assertIsNone(self.cache.lookup("a", remote))
+    path = self.cache.fill("a", write_fn(b"abc"), remote)
+    self.assertEqual(self.cache.lookup("a", remote), path)
+    with open(path, "rb") as f:
+      self.assertEqual(f.read(), b"abc")
+    self.assertIsNone(self.cache.lookup("b", remote))
+
+  def test_invalidated_by_size_and_last_modified(self):
+    self.cache.fill("a", write_fn(b"abc"), RelicFile(name = "a", size = 3, last_modified = 10))
+    self.assertIsNone(self.cache.lookup("a", RelicFile(name = "a", size = 4, last_modified = 10)))
+    self.assertIsNone(self.cache.lookup("a", RelicFile(name = "a", size = 3, last_modified = 11)))
+    self.assertIsNone(self.cache.lookup("a", RelicFile(name = "a")))
+    self.assertIsNotNone(self.cache.lookup("a")) # offline, no validation
+    self.cache.invalidate("a")
+    self.assertIsNone(self.cache.lookup("a"))
+
+  def test_evicts_least_recently_used(self):
+    old = time.time() - 3600
+    for i, k in enumerate(["a", "b", "c"]):
+      path = self.cache.fill(k, write_fn(b"x" * 100), RelicFile(name = k, size = 100, last_modified = 1))
+      os.utime(path, (old + i, old + i))
+    os.utime(self.cache.lookup("a"), (old + 10, old + 10)) # "a" is now the most recent
+
+    self.assertEqual(self.cache.evict(max_size = 150), 200)
+    self.assertIsNotNone(self.cache.lookup("a"))
+    self.assertIsNone(self.cache.lookup("b"))
+    self.assertIsNone(self.cache.lookup("c"))
+
+  def test_recent_entries_are_not_evicted(self):
+    self.cache.fill("a", write_fn(b"x" * 100), RelicFile(name = "a", size = 100, last_modified = 1))
+    self.assertEqual(self.cache.evict(max_size = 0), 0)
+    self.assertIsNotNone(self.cache.lookup("a"))
+
+
+class RelicsNBXCacheTest(unittest.TestCase):
+  def setUp(self):
+    self.home = tempfile.mkdtemp()
+    self.env = mock.patch.dict(os.environ, {"NBOX_HOME_DIR": self.home})
+    self.env.start()
+    self.relic = RelicsNBX(f"cache_{uuid4().hex[:8]}", create = True)
+    self.local = os.path.join(self.home, "local")
+    os.makedirs(self.local)
+
+  def tearDown(self):
+    self.env.stop()
+    shutil.rmtree(self.home, ignore_errors = True)
+
+  def put(self, key: str, data: bytes, relic: RelicsNBX = None):
+    fpath = os.path.join(self.home, "upload")
+    with open(fpath, "wb") as f:
+      f.write(data)
+    (relic or self.relic).put_to(fpath, key)
+
+  def sync_up(self, relic: RelicsNBX, data: bytes):
+    src = os.path.join(self.home, "src")
+    os.makedirs(src, exist_ok = True)
+    with open(os.path.join(src, "a.txt"), "wb") as f:
+      f.write(data)
+    relic.sync(src, "d", direction = "up")
+
+  def read(self, fpath: str) -> bytes:
+    with open(fpath, "rb") as f:
+      return f.read()
+
+  def test_get_copies_out_by_default(self):
+    self.put("a.txt", b"first")
+    dst = os.path.join(self.local, "a.txt")
+    self.relic.get_from(dst, "a.txt")
+    cached = self.relic._get_cached("a.txt")
+    self.assertFalse(os.path.samefile(dst, cached))
+    with open(dst, "wb") as f:
+      f.write(b"edited")
+    self.assertEqual(self.read(cached), b"first")
+
+  def test_redownload_over_a_link_keeps_the_cache(self):
+    self.sync_up(self.relic, b"first")
+    dst = os.path.join(self.local, "a.txt")
+    self.relic.get_from(dst, "d/a.txt", link = True)
+    cached = self.relic._get_cached("d/a.txt")
+    self.assertTrue(os.path.samefile(dst, cached))
+
+    # another client changes the file, our cache entry is now stale but still on disk
+    self.sync_up(RelicsNBX(self.relic.relic_name, cache = False), b"second!")
+    out = self.relic.sync(self.local, "d", direction = "down")
+    self.assertEqual(out["transferred"], 1)
+    self.assertEqual(self.read(dst), b"second!")
+    self.assertEqual(self.read(cached), b"first")
+    self.assertEqual(self.read(self.relic._get_cached("d/a.txt")), b"second!")
+
+
+if __name__ == "__main__":
+  unittest.main()
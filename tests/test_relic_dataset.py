@@ -0,0 +1,83 @@
+import os
+import shutil
+import random
+import tempfile
+import unittest
+from uuid import uuid4
+from unittest import mock
+
+import standin_backend
+
+from nbox.relics.nbx import RelicsNBX
+from nbox.relics.dataset import RelicDataset
+
+
+class RelicDatasetTest(unittest.TestCase):
+  @classmethod
+  def setUpClass(cls):
+    cls.home = tempfile.mkdtemp()
+    cls.env = mock.patch.dict(os.environ, {"NBOX_HOME_DIR": cls.home})
+    cls.env.start()
+    cls.relic_name = f"ds_{uuid4().hex[:8]}"
+    relic = RelicsNBX(cls.relic_name, create = True)
+    paths, keys = [], []
+    for i in range(25):
+      fp = os.path.join(cls.home, f"{i}.txt")
+      with open(fp, "w") as f:
+        f.write(str(i))
+      paths.append(fp)
+      keys.append(f"train/{'sub/' if i >= 20 else ''}{i:02d}.txt")
+    relic.put_many(paths, keys)
+
+  @classmethod
+  def tearDownClass(cls):
+    cls.env.stop()
+    shutil.rmtree(cls.home, ignore_errors = True)
+
+  def dataset(self, cache: bool = True, **kwargs) -> RelicDataset:
+    return RelicDataset(RelicsNBX(self.relic_name, cache = cache), "train", decode = lambda b: int(b), **kwargs)
+
+  def test_in_order(self):
+    for cache in [True, False]:
+      ds = self.dataset(cache)
+      self.assertEqual(len(ds), 25)
+      self.assertEqual(list(ds), list(range(25)))
+
+  def test_not_recursive(self):
+    self.assertEqual(list(self.dataset(recursive = False)), list(range(20)))
+
+  def test_relic_prefix(self):
+    ds = RelicDataset(RelicsNBX(self.relic_name, prefix = "train"), "sub")
+    self.assertEqual(ds.files, [f"sub/{i}.txt" for i in range(20, 25)])
+    self.assertEqual(list(ds), [str(i).encode() for i in range(20, 25)])
+
+  def test_batches(self):
+    ds = self.dataset()
+    batches = list(ds.iter(batch_size = 10, num_workers = 4))
+    self.assertEqual([len(b) for b in batches], [10, 10, 5])
+    self.assertEqual(list(ds.iter(batch_size = 10, drop_last = True, collate = sum)), [45, 145])
+
+  def test_shuffle(self):
+    ds = self.dataset()
+    a = list(ds.iter(shuffle_buffer = 8, seed = 1))
+    self.assertNotEqual(a, list(range(25)))
+    self.assertEqual(sorted(a), list(range(25)))
+    self.assertEqual(a, list(ds.iter(shuffle_buffer = 8, seed = 1)))
+
+  def test_shuffle_buffer(self):
+    out = list(RelicDataset._shuffle(iter(range(100)), 10, random.Random(0)))
+    self.assertEqual(sorted(out), list(range(100)))
+    # an item can only move back by the size of the buffer
+    self.assertTrue(all(x <= i + 10 for i, x in enumerate(out)))
+
+  def test_stopping_early_cancels_the_rest(self):
+    ds = self.dataset(cache = False)
+    with mock.patch.object(ds, "_load", wraps = ds._load) as m:
+      it = ds.iter(num_workers = 1, prefetch = 2)
+      next(it)
+      it.close()
+    self.assertLess(m.call_count, 25)
+
+
+if __name__ == "__main__":
+  unittest.main()
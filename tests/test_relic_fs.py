@@ -0,0 +1,126 @@
+import os
+import shutil
+import tempfile
+import unittest
+import threading
+from uuid import uuid4
+from unittest import mock
+
+import standin_backend
+
+from nbox.relics.nbx import RelicsNBX
+from nbox.relics.fs import fsspec, _PrefetchBlockCache, RelicFileSystem
+
+
+class Fetcher:
+  def __init__(self, data: bytes, fail: int = 0):
+    self.data = data
+    self.fail = fail
+    self.calls = []
+    self.lock = threading.Lock()
+
+  def __call__(self, start: int, end: int) -> bytes:
+    with self.lock:
+      self.calls.append(start)
+      if self.fail:
+        self.fail -= 1
+        raise ConnectionError("reset")
+    return self.data[start:end]
+
+
+@unittest.skipIf(fsspec is None, "needs fsspec")
+class PrefetchBlockCacheTest(unittest.TestCase):
+  def make(self, fetcher: Fetcher, **kwargs) -> _PrefetchBlockCache:
+    cache = _PrefetchBlockCache(10, fetcher, len(fetcher.data), **kwargs)
+    self.addCleanup(cache.close)
+    return cache
+
+  def test_reads(self):
+    data = bytes(range(95))
+    cache = self.make(Fetcher(data))
+    self.assertEqual(cache._fetch(0, 95), data)
+    self.assertEqual(cache._fetch(15, 37), data[15:37])
+    self.assertEqual(cache._fetch(90, 200), data[90:])
+    self.assertEqual(cache._fetch(95, 100), b"")
+    self.assertEqual(cache._fetch(None, None), data)
+
+  def test_sequential_reads_prefetch(self):
+    fetcher = Fetcher(bytes(100))
+    cache = self.make(fetcher, prefetch = 2)
+    cache._fetch(0, 10)   # first read, no pattern yet
+    cache._fetch(10, 20)  # sequential, blocks 2 and 3 are fetched ahead
+    cache._pool.shutdown(wait = True)
+    self.assertEqual(sorted(fetcher.calls), [0, 10, 20, 30])
+    self.assertEqual(cache.miss_count, 2)
+
+  def test_random_reads_do_not_prefetch(self):
+    fetcher = Fetcher(bytes(100))
+    cache = self.make(fetcher, prefetch = 2)
+    cache._fetch(50, 60)
+    cache._fetch(10, 20)
+    cache._pool.shutdown(wait = True)
+    self.assertEqual(sorted(fetcher.calls), [10, 50])
+
+  def test_lru(self):
+    fetcher = Fetcher(bytes(100))
+    cache = self.make(fetcher, maxblocks = 2, prefetch = 0)
+    for start in [0, 50, 0, 80, 0]:
+      cache._fetch(start, start + 10)
+    # 50 was evicted by 80, 0 was kept because it was used again
+    self.assertEqual(fetcher.calls, [0, 50, 80])
+    self.assertEqual(list(cache._blocks), [8, 0]) # block indexes
+
+  def test_failed_block_is_fetched_again(self):
+    fetcher = Fetcher(bytes(range(30)), fail = 1)
+    cache = self.make(fetcher, prefetch = 0)
+    self.assertEqual(cache._fetch(0, 10), bytes(range(10)))
+    self.assertEqual(fetcher.calls, [0, 0])
+    self.assertEqual(cache._fetch(0, 10), bytes(range(10)))
+    self.assertEqual(len(fetcher.calls), 2)
+
+
+@unittest.skipIf(fsspec is None, "needs fsspec")
+class RelicFileSystemTest(unittest.TestCase):
+  def setUp(self):
+    self.home = tempfile.mkdtemp()
+    self.env = mock.patch.dict(os.environ, {"NBOX_HOME_DIR": self.home})
+    self.env.start()
+    self.relic_name = f"fs_{uuid4().hex[:8]}"
+    self.fs = RelicFileSystem(block_size = 1000, skip_instance_cache = True)
+    RelicsNBX(self.relic_name, create = True)
+
+  def tearDown(self):
+    self.env.stop()
+    shutil.rmtree(self.home, ignore_errors = True)
+
+  def test_write_read(self):
+    data = os.urandom(10_500)
+    path = f"relic://{self.relic_name}/d/x.bin"
+    with self.fs.open(path, "wb") as f:
+      f.write(data[:5000])
+      f.write(data[5000:])
+    with self.fs.open(path, "rb") as f:
+      self.assertEqual(f.read(100), data[:100])
+      f.seek(9_990)
+      self.assertEqual(f.read(), data[9_990:])
+      f.seek(0)
+      self.assertEqual(f.read(), data)
+    with fsspec.open(path, "rb") as f:
+      self.assertEqual(f.read(), data)
+
+  def test_ls_info_rm(self):
+    for name in ["d/a.txt", "d/e/b.txt", "empty.txt"]:
+      with self.fs.open(f"{self.relic_name}/{name}", "wb") as f:
+        f.write(b"" if name == "empty.txt" else b"abc")
+    self.assertEqual(self.fs.ls(f"{self.relic_name}/d", detail = False), [f"{self.relic_name}/d/a.txt", f"{self.relic_name}/d/e"])
+    self.assertEqual(self.fs.info(f"{self.relic_name}/d/a.txt")["type"], "file")
+    self.assertEqual(self.fs.info(f"{self.relic_name}/d")["type"], "directory")
+    with self.fs.open(f"{self.relic_name}/empty.txt", "rb") as f:
+      self.assertEqual(f.read(), b"")
+    self.fs.rm_file(f"{self.relic_name}/d/a.txt")
+    with self.assertRaises(FileNotFoundError):
+      self.fs.info(f"{self.relic_name}/d/a.txt")
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,80 @@
+import time
+import unittest
+import threading
+from unittest import mock
+
+import nbox.relics.ref as ref
+from nbox.relics.ref import RelicRef, pack, pack_args, unpack
+
+
+class FakeRelic:
+  def __init__(self):
+    self.relic_name = "cache"
+    self.workspace_id = "w"
+    self.blobs = {}
+    self.puts = 0
+    self.lock = threading.Lock()
+
+  def has(self, key: str) -> bool:
+    return key in self.blobs
+
+  def put_stream(self, fileobj, key: str, size: int) -> None:
+    time.sleep(0.05) # long enough for the other threads to get here
+    data = fileobj.read(size)
+    with self.lock:
+      self.puts += 1
+      self.blobs[key] = data
+
+
+def run_threads(fn, n: int = 8) -> list:
+  barrier = threading.Barrier(n)
+  out = [None] * n
+  def _run(i):
+    barrier.wait()
+    out[i] = fn()
+  threads = [threading.Thread(target = _run, args = (i,)) for i in range(n)]
+  for t in threads:
+    t.start()
+  for t in threads:
+    t.join()
+  return out
+
+
+class PackTest(unittest.TestCase):
+  def setUp(self):
+    self.relic = FakeRelic()
+    self.model = {"weights": list(range(10000))}
+
+  def test_small_values(self):
+    self.assertEqual(unpack(pack(self.relic, self.model)), self.model)
+    self.assertEqual(self.relic.puts, 0)
+
+  def test_same_object_from_many_threads_is_uploaded_once(self):
+    dumps = []
+    dump_object = ref.dump_object
+    def _dump(value, f):
+      dumps.append(1)
+      return dump_object(value, f)
+
+    with mock.patch.object(ref, "dump_object", _dump):
+      out = run_threads(lambda: pack(self.relic, self.model, min_size = 1000))
+    self.assertEqual(self.relic.puts, 1)
+    self.assertEqual(len(dumps), 1)
+    self.assertTrue(all(isinstance(x, RelicRef) and x == out[0] for x in out))
+
+  def test_equal_objects_are_uploaded_once(self):
+    out = run_threads(lambda: pack(self.relic, dict(self.model), min_size = 1000))
+    self.assertEqual(self.relic.puts, 1)
+    self.assertEqual(len(set(out)), 1)
+
+  def test_pack_args_packs_an_object_once(self):
+    with mock.patch.object(ref, "pack", wraps = ref.pack) as m:
+      args, kwargs = pack_args(self.relic, (self.model, self.model, 1), {"m": self.model}, min_size = 1000)
+    self.assertEqual(m.call_count, 2)
+    self.assertEqual(self.relic.puts, 1)
+    self.assertIs(args[0], kwargs["m"])
+    self.assertEqual(unpack(args[2]), 1)
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,83 @@
+import os
+import glob
+import shutil
+import tempfile
+import unittest
+from uuid import uuid4
+from unittest import mock
+
+import standin_backend
+
+from nbox.relics.nbx import RelicsNBX
+from nbox.relics.cp import copy
+
+
+class RelicsCopyTest(unittest.TestCase):
+  def setUp(self):
+    self.home = tempfile.mkdtemp()
+    self.env = mock.patch.dict(os.environ, {"NBOX_HOME_DIR": self.home})
+    self.env.start()
+    self.relic_name = f"cp_{uuid4().hex[:8]}"
+    self.src = os.path.join(self.home, "src")
+    self.files = {"a.txt": b"a" * 1000, "b/c.txt": b"c" * 3000, "empty.txt": b""}
+    for name, data in self.files.items():
+      fp = os.path.join(self.src, name)
+      os.makedirs(os.path.dirname(fp), exist_ok = True)
+      with open(fp, "wb") as f:
+        f.write(data)
+
+  def tearDown(self):
+    self.env.stop()
+    shutil.rmtree(self.home, ignore_errors = True)
+
+  def read(self, fp: str) -> bytes:
+    with open(fp, "rb") as f:
+      return f.read()
+
+  def test_upload_then_skip(self):
+    dst = f"relic://{self.relic_name}/data"
+    self.assertEqual(copy(self.src, dst, recursive = True, dry_run = True), {"copied": 3, "skipped": 0, "bytes": 4000})
+    self.assertEqual(copy(self.src, dst, recursive = True), {"copied": 3, "skipped": 0, "bytes": 4000})
+    self.assertEqual(copy(self.src, dst, recursive = True), {"copied": 0, "skipped": 3, "bytes": 0})
+
+    # a changed file is copied again
+    with open(os.path.join(self.src, "a.txt"), "wb") as f:
+      f.write(b"changed")
+    out = copy(self.src, dst, recursive = True, dry_run = True)
+    self.assertEqual(out, {"copied": 1, "skipped": 2, "bytes": 7})
+
+  def test_download_and_relay(self):
+    copy(self.src, f"relic://{self.relic_name}/data", recursive = True)
+    down = os.path.join(self.home, "down")
+    self.assertEqual(copy(f"relic://{self.relic_name}/data", down, recursive = True)["copied"], 3)
+    for name, data in self.files.items():
+      self.assertEqual(self.read(os.path.join(down, name)), data)
+    self.assertEqual(copy(f"relic://{self.relic_name}/data", down, recursive = True)["skipped"], 3)
+
+    other = f"relic://{self.relic_name}_copy/data"
+    copy(f"relic://{self.relic_name}/data", other, recursive = True)
+    down = os.path.join(self.home, "down2")
+    copy(other, down, recursive = True)
+    for name, data in self.files.items():
+      self.assertEqual(self.read(os.path.join(down, name)), data)
+
+  def test_download_resumes_the_part_file(self):
+    copy(self.src, f"relic://{self.relic_name}/data", recursive = True)
+    f = RelicsNBX(self.relic_name, cache = False)._stat("data/b/c.txt")
+    down = os.path.join(self.home, "down")
+    os.makedirs(os.path.join(down, "b"))
+    dst = os.path.join(down, "b", "c.txt")
+    # the first 1000 bytes were downloaded before, a part of an older version is dropped
+    with open(f"{dst}.part-{f.last_modified}", "wb") as _f:
+      _f.write(b"x" * 1000)
+    with open(f"{dst}.part-1", "wb") as _f:
+      _f.write(b"old")
+
+    copy(f"relic://{self.relic_name}/data/b/c.txt", dst)
+    self.assertEqual(self.read(dst), b"x" * 1000 + b"c" * 2000)
+    self.assertEqual(glob.glob(dst + ".part-*"), [])
+    self.assertEqual(int(os.stat(dst).st_mtime), f.last_modified)
+
+
+if __name__ == "__main__":
+  unittest.main()
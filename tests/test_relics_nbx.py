@@ -0,0 +1,147 @@
+import os
+import shutil
+import tempfile
+import unittest
+import threading
+from uuid import uuid4
+from unittest import mock
+
+import standin_backend
+
+from nbox.relics.nbx import RelicsNBX
+from nbox.relics.codec import pa
+
+try:
+  import pandas as pd
+except ImportError:
+  pd = None
+
+
+class RelicsNBXTest(unittest.TestCase):
+  def setUp(self):
+    self.home = tempfile.mkdtemp()
+    self.env = mock.patch.dict(os.environ, {"NBOX_HOME_DIR": self.home})
+    self.env.start()
+    self.relic = RelicsNBX(f"nbx_{uuid4().hex[:8]}", create = True)
+
+  def tearDown(self):
+    self.env.stop()
+    shutil.rmtree(self.home, ignore_errors = True)
+
+  def write_files(self, n: int, folder: str = "src"):
+    paths = []
+    os.makedirs(os.path.join(self.home, folder), exist_ok = True)
+    for i in range(n):
+      fpath = os.path.join(self.home, folder, f"{i}.txt")
+      with open(fpath, "w") as f:
+        f.write(f"file {i}")
+      paths.append(fpath)
+    return paths
+
+  def read(self, fp: str) -> str:
+    with open(fp, "r") as f:
+      return f.read()
+
+  def test_put_many_get_many(self):
+    paths = self.write_files(20)
+    keys = [f"d/{i}.txt" for i in range(20)]
+    self.relic.put_many(paths, keys, workers = 4)
+    self.assertEqual(self.relic.has_many(keys), [True] * 20)
+
+    out = [os.path.join(self.home, "out", f"{i}.txt") for i in range(20)]
+    with mock.patch.object(self.relic.stub, "list_relic_files", wraps = self.relic.stub.list_relic_files) as m:
+      self.relic._known.clear()
+      self.relic._listed.clear()
+      self.relic.get_many(keys, out, workers = 4)
+    self.assertEqual(m.call_count, 1) # one listing of the folder validates the cache for all the files
+    self.assertEqual([self.read(p) for p in out], [f"file {i}" for i in range(20)])
+
+  def test_bulk_length_mismatch(self):
+    with self.assertRaises(ValueError):
+      self.relic.put_many(["a", "b"], ["a"])
+    with self.assertRaises(ValueError):
+      self.relic.get_many(["a", "b"], ["a"])
+
+  def test_put_objects(self):
+    objects = {f"objs/{i}.pkl": {"i": i, "x": list(range(i))} for i in range(10)}
+    self.relic.put_objects(objects, workers = 4)
+    for k, v in objects.items():
+      self.assertEqual(self.relic.get_object(k), v)
+
+  def test_prefix(self):
+    relic = RelicsNBX(self.relic.relic_name, prefix = "p")
+    relic.put_many(self.write_files(3), ["0.txt", "1.txt", "2.txt"])
+    self.assertEqual(self.relic.has_many(["p/0.txt", "0.txt"]), [True, False])
+    out = os.path.join(self.home, "out.txt")
+    relic.get_from(out, "2.txt")
+    self.assertEqual(self.read(out), "file 2")
+
+  def test_has_many_while_putting(self):
+    paths = self.write_files(64)
+    keys = [f"d/{i}.txt" for i in range(64)]
+    errors = []
+    done = threading.Event()
+
+    def _list():
+      try:
+        while not done.is_set():
+          self.relic._list_prefix("d")
+          self.relic.has_many(keys[:8])
+      except Exception as e:
+        errors.append(e)
+
+    t = threading.Thread(target = _list)
+    t.start()
+    try:
+      self.relic.put_many(paths, keys, workers = 8)
+    finally:
+      done.set()
+      t.join()
+    self.assertEqual(errors, [])
+    self.assertEqual(self.relic.has_many(keys + ["d/missing.txt"]), [True] * 64 + [False])
+
+
+class RelicsObjectTest(unittest.TestCase):
+  def setUp(self):
+    self.home = tempfile.mkdtemp()
+    self.env = mock.patch.dict(os.environ, {"NBOX_HOME_DIR": self.home})
+    self.env.start()
+    self.relic_name = f"obj_{uuid4().hex[:8]}"
+    self.relic = RelicsNBX(self.relic_name, create = True, cache = False)
+
+  def tearDown(self):
+    self.env.stop()
+    shutil.rmtree(self.home, ignore_errors = True)
+
+  def uploaded_files(self, **kwargs) -> list:
+    """put an object and return the spooled file it was streamed from"""
+    files = []
+    put_stream = self.relic.put_stream
+    def _put_stream(f, key, size):
+      files.append(f)
+      return put_stream(f, key, size)
+    with mock.patch.object(self.relic, "put_stream", _put_stream):
+      self.relic.put_object("x.pkl", {"x": list(range(10000))}, **kwargs)
+    return files
+
+  def test_round_trip_without_the_cache(self):
+    obj = {"a": [1, 2, 3], "b": "text"}
+    self.relic.put_object("o.pkl", obj)
+    self.assertEqual(self.relic.get_object("o.pkl"), obj)
+    self.assertEqual(RelicsNBX(self.relic_name).get_object("o.pkl"), obj) # through the cache
+
+  def test_small_objects_stay_in_memory(self):
+    self.assertFalse(self.uploaded_files()[0]._rolled)
+    self.assertTrue(self.uploaded_files(spill_size = 1000)[0]._rolled)
+    self.assertEqual(self.relic.get_object("x.pkl"), {"x": list(range(10000))})
+
+  @unittest.skipIf(pa is None or pd is None, "needs pyarrow and pandas")
+  def test_dataframe_columns(self):
+    df = pd.DataFrame({"a": [1, 2, 3], "b": ["x", "y", "z"]})
+    self.relic.put_object("df.arrow", df)
+    pd.testing.assert_frame_equal(self.relic.get_object("df.arrow"), df)
+    pd.testing.assert_frame_equal(RelicsNBX(self.relic_name).get_object("df.arrow", columns = ["b"]), df[["b"]])
+
+
+if __name__ == "__main__":
+  unittest.main()
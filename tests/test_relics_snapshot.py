@@ -0,0 +1,93 @@
+import os
+import shutil
+import tempfile
+import unittest
+from uuid import uuid4
+from unittest import mock
+
+import standin_backend
+
+from nbox.relics.nbx import RelicsNBX, SNAPSHOT_ROOT
+
+
+class RelicsSnapshotTest(unittest.TestCase):
+  def setUp(self):
+    self.home = tempfile.mkdtemp()
+    self.env = mock.patch.dict(os.environ, {"NBOX_HOME_DIR": self.home})
+    self.env.start()
+    self.relic = RelicsNBX(f"snap_{uuid4().hex[:8]}", create = True, cache = False)
+    self.put({"a.txt": "a", "b/c.txt": "same", "d.txt": "same"})
+
+  def tearDown(self):
+    self.env.stop()
+    shutil.rmtree(self.home, ignore_errors = True)
+
+  def put(self, files: dict, prefix: str = "data"):
+    paths = []
+    for i, data in enumerate(files.values()):
+      fp = os.path.join(self.home, f"up_{uuid4().hex[:8]}_{i}")
+      with open(fp, "w") as f:
+        f.write(data)
+      paths.append(fp)
+    self.relic.put_many(paths, [f"{prefix}/{rel}" for rel in files])
+
+  def tree(self, folder: str) -> dict:
+    out = {}
+    for root, _, files in os.walk(folder):
+      for x in files:
+        if x.startswith("."):
+          continue # the local hash cache
+        with open(os.path.join(root, x), "r") as f:
+          out[os.path.relpath(os.path.join(root, x), folder).replace(os.sep, "/")] = f.read()
+    return out
+
+  def copied(self, m) -> list:
+    return [c[0][1] for c in m.call_args_list if not c[0][1].startswith(SNAPSHOT_ROOT)]
+
+  def blobs(self) -> list:
+    return [f.name for f in self.relic._walk(self.relic._remote_name(f"{SNAPSHOT_ROOT}/objects"))]
+
+  def test_unchanged_files_are_not_copied_again(self):
+    v1 = self.relic.snapshot("data")
+    self.assertEqual(len(self.blobs()), 2) # b/c.txt and d.txt have the same contents
+    with mock.patch.object(self.relic, "_get_from", wraps = self.relic._get_from) as m:
+      self.assertEqual(self.relic.snapshot("data"), v1)
+    self.assertEqual(self.copied(m), [])
+
+    self.put({"a.txt": "new a"})
+    with mock.patch.object(self.relic, "_get_from", wraps = self.relic._get_from) as m:
+      v2 = self.relic.snapshot("data")
+    self.assertEqual(self.copied(m), ["data/a.txt"])
+    self.assertNotEqual(v1, v2)
+    self.assertEqual(self.relic.snapshots(), sorted([v1, v2]))
+    self.assertEqual(len(self.blobs()), 3)
+
+  def test_snapshot_of_the_whole_relic_skips_its_own_files(self):
+    self.relic.snapshot("data")
+    v = self.relic.snapshot()
+    out = os.path.join(self.home, "out")
+    self.relic.checkout(v, out)
+    self.assertEqual(self.tree(out), {"data/a.txt": "a", "data/b/c.txt": "same", "data/d.txt": "same"})
+
+  def test_checkout_older_version(self):
+    v1 = self.relic.snapshot("data")
+    self.put({"a.txt": "new a", "e.txt": "e"})
+    v2 = self.relic.snapshot("data")
+
+    out = os.path.join(self.home, "out")
+    with mock.patch.object(self.relic, "_get_many", wraps = self.relic._get_many) as m:
+      self.assertEqual(self.relic.checkout(v2, out), {"transferred": 4, "deleted": 0, "skipped": 0})
+    self.assertEqual(len(m.call_args[0][0]), 3) # the same contents are downloaded once
+    self.assertEqual(self.tree(out), {"a.txt": "new a", "b/c.txt": "same", "d.txt": "same", "e.txt": "e"})
+
+    self.assertEqual(self.relic.checkout(v1, out, delete = True), {"transferred": 1, "deleted": 1, "skipped": 2})
+    self.assertEqual(self.tree(out), {"a.txt": "a", "b/c.txt": "same", "d.txt": "same"})
+    self.assertEqual(self.relic.checkout(v1, out), {"transferred": 0, "deleted": 0, "skipped": 3})
+
+  def test_unknown_version(self):
+    with self.assertRaises(ValueError):
+      self.relic.checkout("0" * 16, os.path.join(self.home, "out"))
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,78 @@
+import os
+import shutil
+import tempfile
+import unittest
+from uuid import uuid4
+from unittest import mock
+
+import standin_backend
+
+from nbox.relics.nbx import RelicsNBX, MANIFEST_NAME
+
+
+class RelicsSyncTest(unittest.TestCase):
+  def setUp(self):
+    self.home = tempfile.mkdtemp()
+    self.env = mock.patch.dict(os.environ, {"NBOX_HOME_DIR": self.home})
+    self.env.start()
+    self.relic = RelicsNBX(f"sync_{uuid4().hex[:8]}", create = True)
+    self.up = os.path.join(self.home, "up")
+    self.down = os.path.join(self.home, "down")
+    self.write(self.up, {"a.txt": "a", "b/c.txt": "c", ".hidden": "h"})
+
+  def tearDown(self):
+    self.env.stop()
+    shutil.rmtree(self.home, ignore_errors = True)
+
+  def write(self, folder: str, files: dict):
+    for name, data in files.items():
+      fp = os.path.join(folder, name)
+      os.makedirs(os.path.dirname(fp), exist_ok = True)
+      with open(fp, "w") as f:
+        f.write(data)
+
+  def tree(self, folder: str) -> dict:
+    out = {}
+    for root, _, files in os.walk(folder):
+      for x in files:
+        with open(os.path.join(root, x), "r") as f:
+          out[os.path.relpath(os.path.join(root, x), folder).replace(os.sep, "/")] = f.read()
+    return out
+
+  def test_up_and_down(self):
+    self.assertEqual(self.relic.sync(self.up, "data"), {"transferred": 3, "deleted": 0, "skipped": 0})
+    self.assertEqual(set(self.relic.get_remote_manifest("data")), {"a.txt", "b/c.txt", ".hidden"})
+    self.assertTrue(self.relic.has(f"data/{MANIFEST_NAME}"))
+    self.assertEqual(self.relic.sync(self.up, "data"), {"transferred": 0, "deleted": 0, "skipped": 3})
+
+    self.assertEqual(self.relic.sync(self.down, "data", "down")["transferred"], 3)
+    self.assertEqual(self.tree(self.down), self.tree(self.up))
+    self.assertEqual(self.relic.sync(self.down, "data", "down")["transferred"], 0)
+
+  def test_only_changed_files_move(self):
+    self.relic.sync(self.up, "data")
+    self.write(self.up, {"a.txt": "new a", "d.txt": "d"})
+    with mock.patch.object(self.relic, "put_many", wraps = self.relic.put_many) as m:
+      out = self.relic.sync(self.up, "data")
+    self.assertEqual(out, {"transferred": 2, "deleted": 0, "skipped": 2})
+    self.assertEqual(sorted(m.call_args[0][1]), ["data/a.txt", "data/d.txt"])
+
+  def test_delete_and_dry_run(self):
+    self.relic.sync(self.up, "data")
+    os.remove(os.path.join(self.up, "a.txt"))
+    self.assertEqual(self.relic.sync(self.up, "data", delete = True, dry_run = True), {"transferred": 0, "deleted": 1, "skipped": 2})
+    self.assertTrue(self.relic.has("data/a.txt"))
+    self.assertEqual(self.relic.sync(self.up, "data", delete = True)["deleted"], 1)
+    self.assertFalse(self.relic.has("data/a.txt"))
+
+    self.write(self.down, {"a.txt": "a", "extra.txt": "x"})
+    self.relic.sync(self.down, "data", "down", delete = True)
+    self.assertEqual(self.tree(self.down), self.tree(self.up))
+
+  def test_bad_direction(self):
+    with self.assertRaises(ValueError):
+      self.relic.sync(self.up, "data", "sideways")
+
+
+if __name__ == "__main__":
+  unittest.main()
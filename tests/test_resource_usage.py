@@ -0,0 +1,88 @@
+import time
+import unittest
+import threading
+import tracemalloc
+from unittest import mock
+
+import nbox.nbxlib.resource_usage as ru
+from nbox.nbxlib.resource_usage import measure_resources
+
+
+def busy(seconds: float):
+  end = time.perf_counter() + seconds
+  while time.perf_counter() < end:
+    pass
+
+
+class MeasureResourcesTest(unittest.TestCase):
+  def test_nested_calls_roll_up(self):
+    with measure_resources() as outer:
+      busy(0.05)
+      with measure_resources() as inner:
+        busy(0.1)
+    self.assertGreaterEqual(inner["cpu_s"], 0.05)
+    self.assertGreater(outer["cpu_s"], inner["cpu_s"])
+    self.assertLess(outer["cpu_self_s"], outer["cpu_s"] - 0.05)
+    self.assertLess(outer["wall_self_s"], outer["wall_s"])
+    self.assertEqual(ru._measuring, 0)
+
+  def test_cpu_is_per_thread_without_rusage_thread(self):
+    stop = threading.Event()
+    def _spin():
+      while not stop.is_set():
+        pass
+    t = threading.Thread(target = _spin)
+    with mock.patch.object(ru, "_RUSAGE_THREAD", None):
+      t.start()
+      try:
+        with measure_resources() as usage:
+          time.sleep(0.2)
+      finally:
+        stop.set()
+        t.join()
+    self.assertLess(usage["cpu_s"], 0.1)
+
+  def test_peak_is_not_reset_by_other_threads(self):
+    tracemalloc.start()
+    self.addCleanup(tracemalloc.stop)
+    allocated, other_started = threading.Event(), threading.Event()
+    out = {}
+
+    def _a():
+      with measure_resources() as usage:
+        x = bytearray(20 * ru.MiB)
+        del x
+        allocated.set()
+        other_started.wait(5)
+      out["a"] = usage
+
+    def _b():
+      allocated.wait(5)
+      with measure_resources():
+        with measure_resources():
+          other_started.set()
+
+    threads = [threading.Thread(target = _a), threading.Thread(target = _b)]
+    for t in threads:
+      t.start()
+    for t in threads:
+      t.join()
+    self.assertGreaterEqual(out["a"]["tracemalloc_peak_mib"], 19)
+    self.assertEqual(ru._measuring, 0)
+
+  def test_peak_of_nested_calls(self):
+    tracemalloc.start()
+    self.addCleanup(tracemalloc.stop)
+    with measure_resources() as outer:
+      with measure_resources() as inner:
+        x = bytearray(10 * ru.MiB)
+        del x
+      with measure_resources() as second:
+        pass
+    self.assertGreaterEqual(inner["tracemalloc_peak_mib"], 9)
+    self.assertLess(second["tracemalloc_peak_mib"], 1)
+    self.assertGreaterEqual(outer["tracemalloc_peak_mib"], 9)
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,98 @@
+import io
+import unittest
+from unittest import mock
+
+from nbox.relics.shards import ShardWriter, ShardReader, SHARD_INDEX_NAME
+
+
+class FakeResponse:
+  def __init__(self, status_code: int, content: bytes):
+    self.status_code = status_code
+    self.content = content
+
+  def raise_for_status(self):
+    if self.status_code >= 400:
+      raise Exception(f"HTTP {self.status_code}")
+
+
+class FakeRelic:
+  """Keeps the files in memory, the URL of a file is its name"""
+  def __init__(self):
+    self.files = {}
+    self.gets = []
+
+  def put_stream(self, f, name: str, size: int):
+    data = f.read()
+    assert len(data) == size
+    self.files[name] = data
+
+  def get_url(self, name: str) -> str:
+    return name
+
+  def get(self, url: str, headers = {}):
+    self.gets.append((url, headers.get("Range")))
+    data = self.files[url]
+    if "Range" in headers:
+      start, end = map(int, headers["Range"][len("bytes="):].split("-"))
+      return FakeResponse(206, data[start:end + 1])
+    return FakeResponse(200, data)
+
+
+class ShardTest(unittest.TestCase):
+  def setUp(self):
+    self.relic = FakeRelic()
+    patcher = mock.patch("nbox.relics.shards._get_transfer_session", return_value = self.relic)
+    patcher.start()
+    self.addCleanup(patcher.stop)
+
+  def write(self, records, **kwargs):
+    with ShardWriter(self.relic, "/data/", **kwargs) as w:
+      for r in records:
+        w.write(r)
+    return w
+
+  def test_round_trip(self):
+    records = [{"i": i, "x": "a" * (i % 7)} for i in range(1000)]
+    w = self.write(records, shard_size = 4096)
+    self.assertGreater(len(w.shards), 1)
+    self.assertIn(f"data/{SHARD_INDEX_NAME}", self.relic.files)
+    self.assertEqual(len(w), 1000)
+
+    reader = ShardReader(self.relic, "data")
+    self.assertEqual(len(reader), 1000)
+    self.assertEqual(list(reader), records)
+    self.assertEqual(reader[0], records[0])
+    self.assertEqual(reader[567], records[567])
+    self.assertEqual(reader[-1], records[-1])
+    with self.assertRaises(IndexError):
+      reader[1000]
+
+  def test_random_access_uses_ranges(self):
+    self.write([bytes([i]) * 100 for i in range(50)], shard_size = 1 << 20, encode = None)
+    reader = ShardReader(self.relic, "data", decode = None)
+    self.relic.gets.clear()
+    self.assertEqual(reader[10], bytes([10]) * 100)
+    # one read of the index at the end of the shard and one of the record
+    self.assertEqual(len(self.relic.gets), 2)
+    self.assertTrue(all(r is not None for _, r in self.relic.gets))
+    self.relic.gets.clear()
+    self.assertEqual(reader[11], bytes([11]) * 100)
+    self.assertEqual(len(self.relic.gets), 1) # the index is cached
+
+  def test_server_without_ranges(self):
+    self.write([b"abc", b"defg"], encode = None)
+    get = self.relic.get
+    self.relic.get = lambda url, headers = {}: get(url) # ignores the Range header
+    self.assertEqual(ShardReader(self.relic, "data", decode = None)[1], b"defg")
+
+  def test_not_a_shard(self):
+    self.write([b"abc"], encode = None)
+    name = next(k for k in self.relic.files if k.endswith(".nbxs"))
+    self.relic.files[name] = self.relic.files[name][:-8] + b"XXXXXXXX"
+    with self.assertRaises(ValueError):
+      list(ShardReader(self.relic, "data", decode = None))
+
+  def test_closed_writer(self):
+    w = self.write([b"abc"], encode = None)
+    with self.assertRaises(ValueError):
+      w.write(b"def")
@@ -0,0 +1,109 @@
+import time
+import threading
+import unittest
+
+from nbox.observability.shipper import RunLogShipper, ServingLogShipper
+from nbox.sublime.proto.lmao_pb2 import RunLog, Record
+
+
+def record(key: str) -> Record:
+  return Record(key = key, value_type = Record.DataType.FLOAT, float_data = [1.0])
+
+
+class RunLogShipperTest(unittest.TestCase):
+  def make(self, **kwargs) -> RunLogShipper:
+    self.sent = []
+    def send(run_log: RunLog) -> bool:
+      self.sent.extend(r.key for r in run_log.data)
+      return True
+    # nothing is sent till a flush
+    shipper = RunLogShipper(send, "run", batch_size = 1000, flush_every = 100, **kwargs)
+    self.addCleanup(shipper.close, 5)
+    return shipper
+
+  def test_batches_by_log_type(self):
+    calls = []
+    shipper = RunLogShipper(lambda x: calls.append((x.log_type, len(x.data))) or True, "run", flush_every = 100)
+    self.addCleanup(shipper.close, 5)
+    for i in range(10):
+      shipper.put([record(f"k{i}")], RunLog.LogType.USER)
+    shipper.put([record("cpu")], RunLog.LogType.SYSTEM)
+    self.assertTrue(shipper.flush(5))
+    self.assertEqual(sorted(calls), sorted([(RunLog.LogType.USER, 10), (RunLog.LogType.SYSTEM, 1)]))
+    self.assertEqual(shipper.stats()["sent"], 11)
+    self.assertEqual(shipper.stats()["batches"], 2)
+
+  def test_block(self):
+    shipper = self.make(max_queue = 2, backpressure = "block")
+    shipper.put([record("k0")])
+    shipper.put([record("k1")])
+    t = threading.Thread(target = shipper.put, args = ([record("k2")],))
+    t.start()
+    time.sleep(0.2)
+    self.assertTrue(t.is_alive()) # waiting for space
+    self.assertTrue(shipper.flush(5))
+    t.join(5)
+    self.assertFalse(t.is_alive())
+    self.assertTrue(shipper.flush(5))
+    self.assertEqual(self.sent, ["k0", "k1", "k2"])
+    self.assertEqual(shipper.stats()["dropped"], 0)
+
+  def test_drop_oldest(self):
+    shipper = self.make(max_queue = 3, backpressure = "drop_oldest")
+    for i in range(5):
+      self.assertTrue(shipper.put([record(f"k{i}")]))
+    self.assertTrue(shipper.flush(5))
+    self.assertEqual(self.sent, ["k2", "k3", "k4"])
+    self.assertEqual(shipper.stats()["dropped"], 2)
+
+  def test_sample(self):
+    shipper = self.make(max_queue = 3, backpressure = "sample")
+    kept = [shipper.put([record(f"k{i}")]) for i in range(100)]
+    self.assertTrue(shipper.flush(5))
+    self.assertEqual(len(self.sent), 3)
+    self.assertEqual(len(set(self.sent)), 3)
+    self.assertIn(False, kept)
+    stats = shipper.stats()
+    self.assertEqual((stats["queued"], stats["sent"], stats["dropped"], stats["pending"]), (100, 3, 97, 0))
+
+  def test_failed_send_is_counted(self):
+    shipper = RunLogShipper(lambda x: False, "run", flush_every = 100)
+    self.addCleanup(shipper.close, 5)
+    shipper.put([record("k0"), record("k1")])
+    self.assertTrue(shipper.flush(5))
+    self.assertEqual(shipper.stats()["failed"], 2)
+
+  def test_closed_shipper_raises(self):
+    shipper = self.make()
+    shipper.put([record("k0")])
+    shipper.close(5)
+    self.assertEqual(self.sent, ["k0"])
+    with self.assertRaises(ValueError):
+      shipper.put([record("k1")])
+
+  def test_unknown_policy(self):
+    with self.assertRaises(ValueError):
+      RunLogShipper(lambda x: True, "run", backpressure = "drop_newest")
+
+
+class ServingLogShipperTest(unittest.TestCase):
+  def test_dropped_from_many_threads(self):
+    sent = []
+    def send(log_buffer) -> bool:
+      sent.append(len(log_buffer.live_logs))
+      return True
+    # the buffer never reaches a batch, nothing is sent till the close
+    shipper = ServingLogShipper(send, "token", max_buffer = 50, batch_size = 1000, flush_every = 100, aggregate = False)
+
+    def _put():
+      for _ in range(2000):
+        shipper.put("predict", "POST", 200, 1.0, time.time())
+    threads = [threading.Thread(target = _put) for _ in range(8)]
+    for t in threads:
+      t.start()
+    for t in threads:
+      t.join()
+    self.assertEqual(shipper.stats()["dropped"], 8 * 2000 - 50)
+    shipper.close(5)
+    self.assertEqual(sent, [50])
+    self.assertEqual(shipper.stats()["sent"], 50)
@@ -0,0 +1,92 @@
+import math
+import unittest
+
+import numpy as np
+
+from nbox.observability.sketch import DDSketch
+
+
+class DDSketchNonFiniteTest(unittest.TestCase):
+  def test_add_skips_nan_and_inf(self):
+    s = DDSketch()
+    for v in [1.0, float("nan"), float("inf"), -float("inf"), 2.0]:
+      s.add(v)
+    self.assertEqual(s.count, 2)
+    self.assertEqual(s.non_finite, 3)
+    self.assertEqual(s.max, 2.0)
+    self.assertEqual(s.min, 1.0)
+
+  def test_add_many_skips_nan_and_inf(self):
+    s = DDSketch()
+    s.add_many(np.array([1.0, np.nan, np.inf, -np.inf, 2.0, 3.0]))
+    self.assertEqual(s.count, 3)
+    self.assertEqual(s.non_finite, 3)
+    self.assertTrue(all(abs(i) < 1000 for i in list(s.bins) + list(s.negative_bins)))
+    self.assertLess(abs(s.quantile(1.0) - 3.0) / 3.0, 0.01)
+
+  def test_non_finite_survives_records(self):
+    s = DDSketch()
+    s.add_many([1.0, np.inf])
+    r = DDSketch.from_records(s.to_records("x", 1))
+    self.assertEqual(r.non_finite, 1)
+    self.assertEqual(r.count, 1)
+
+
+class DDSketchTest(unittest.TestCase):
+  def test_quantiles_within_relative_accuracy(self):
+    rng = np.random.default_rng(0)
+    for values in [rng.lognormal(0, 2, 50_000), -rng.exponential(3, 50_000), rng.normal(0, 1, 50_000)]:
+      s = DDSketch(relative_accuracy = 0.01)
+      s.add_many(values)
+      for q in [0.01, 0.1, 0.5, 0.9, 0.99]:
+        # rank of the quantile in the sketch is the same as np.quantile with the "lower" method
+        exact = np.quantile(values, q, method = "lower")
+        if abs(exact) <= s.min_value:
+          continue
+        self.assertLessEqual(abs(s.quantile(q) - exact), 0.01 * abs(exact) + 1e-9, f"q = {q}")
+
+  def test_add_and_add_many_agree(self):
+    values = np.random.default_rng(1).normal(0, 10, 2_000)
+    a, b = DDSketch(), DDSketch()
+    for v in values:
+      a.add(float(v))
+    b.add_many(values)
+    self.assertEqual(a.bins, b.bins)
+    self.assertEqual(a.negative_bins, b.negative_bins)
+    self.assertEqual(a.zero_count, b.zero_count)
+    self.assertEqual(a.count, b.count)
+
+  def test_merge_is_the_same_as_one_sketch(self):
+    values = np.random.default_rng(2).lognormal(1, 1, 10_000)
+    whole = DDSketch()
+    whole.add_many(values)
+    merged = DDSketch()
+    for part in np.array_split(values, 7):
+      s = DDSketch()
+      s.add_many(part)
+      merged.merge(s)
+    self.assertEqual(merged.bins, whole.bins)
+    self.assertEqual(merged.count, whole.count)
+    self.assertAlmostEqual(merged.sum, whole.sum, places = 6)
+    self.assertEqual((merged.min, merged.max), (whole.min, whole.max))
+    for q in [0.5, 0.9, 0.99]:
+      self.assertEqual(merged.quantile(q), whole.quantile(q))
+
+  def test_merge_needs_same_accuracy(self):
+    with self.assertRaises(ValueError):
+      DDSketch(0.01).merge(DDSketch(0.02))
+
+  def test_records_round_trip(self):
+    s = DDSketch()
+    s.add_many([-5.0, 0.0, 1.0, 2.0, 300.0])
+    r = DDSketch.from_records(s.to_records("loss", 3))
+    self.assertEqual(r.bins, s.bins)
+    self.assertEqual(r.negative_bins, s.negative_bins)
+    self.assertEqual(r.zero_count, 1)
+    self.assertEqual(r.count, 5)
+    self.assertAlmostEqual(r.quantile(0.5), s.quantile(0.5), places = 5) # min and max are float32 in the records
+
+  def test_empty(self):
+    s = DDSketch()
+    self.assertTrue(math.isnan(s.quantile(0.5)))
+    self.assertEqual(DDSketch.from_records(s.to_records("x", 0)).count, 0)
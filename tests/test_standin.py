@@ -0,0 +1,57 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from nbox.standin.relics import RelicStoreService, _clean_id
+from nbox.standin.lmao import LmaoService
+from nbox.standin.jobs import JobService
+from nbox.sublime.relics_rpc_client import CreateRelicRequest, ListRelicsRequest
+from nbox.sublime.lmao_client import RunLog, LogBuffer
+
+
+class StandinPathTest(unittest.TestCase):
+  def setUp(self):
+    self.root = tempfile.mkdtemp()
+    self.relics = RelicStoreService(self.root, "http://127.0.0.1:0")
+
+  def tearDown(self):
+    shutil.rmtree(self.root)
+
+  def test_clean_id(self):
+    self.assertEqual(_clean_id("ws_1", "workspace_id"), "ws_1")
+    for bad in ["", ".", "..", "../x", "a/b", "a\\b"]:
+      with self.assertRaises(ValueError):
+        _clean_id(bad, "workspace_id")
+
+  def test_relics_stay_in_the_root(self):
+    self.relics.create_relic(CreateRelicRequest(workspace_id = "ws", name = "r"))
+    self.assertTrue(os.path.isdir(os.path.join(self.root, "relics", "ws", "r")))
+    for ws in ["..", "../../tmp", "a/b"]:
+      with self.assertRaises(ValueError):
+        self.relics.create_relic(CreateRelicRequest(workspace_id = ws, name = "r"))
+      with self.assertRaises(ValueError):
+        self.relics.list_relics(ListRelicsRequest(workspace_id = ws))
+    with self.assertRaises(ValueError):
+      self.relics.file_path("ws", "r", "../../escape")
+
+  def test_lmao_ids_stay_in_the_root(self):
+    lmao = LmaoService(self.root)
+    with self.assertRaises(ValueError):
+      lmao.on_log(RunLog(experiment_id = "../runs"))
+    with self.assertRaises(ValueError):
+      lmao.on_serving_log(LogBuffer(agent_token = "../../x"))
+
+  def test_jobs_stay_in_the_root(self):
+    jobs = JobService(self.root, workers = 1)
+    self.assertEqual(jobs._job_dir("ws", "j"), os.path.join(self.root, "jobs", "ws", "j"))
+    self.assertEqual(jobs._job_dir(""), os.path.join(self.root, "jobs", "personal"))
+    for ws, job_id in [("..", "j"), ("ws", ".."), ("ws", "../../x")]:
+      with self.assertRaises(ValueError):
+        jobs._job_dir(ws, job_id)
+    self.assertEqual(jobs.rest(["workspace", "..", "jobs"], {})[0], 400)
+    self.assertEqual(jobs.rest(["workspace", "ws", "job", "a/b", "runs"], {})[0], 400)
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,96 @@
+import time
+import unittest
+
+from nbox.observability.system import Collector, SystemMetricsLogger, aggregate, _RateCollector
+from nbox.sublime.proto.lmao_pb2 import RunLog
+
+
+class FakeRun:
+  completed = False
+
+  def __init__(self):
+    self.logs = []
+
+  def log(self, data, log_type = None):
+    self.logs.append((data, log_type))
+
+
+class SequenceCollector(Collector):
+  def __init__(self, values, every = 0.0):
+    self.values = list(values)
+    self.every = every
+
+  def sample(self):
+    return {"x": self.values.pop(0)} if self.values else {}
+
+
+class SystemMetricsTest(unittest.TestCase):
+  def test_aggregate(self):
+    out = aggregate(list(range(1, 101)))
+    self.assertEqual(out, {"mean": 50.5, "min": 1, "max": 100, "p95": 96})
+    self.assertEqual(aggregate([3.0]), {"mean": 3.0, "min": 3.0, "max": 3.0, "p95": 3.0})
+
+  def test_one_record_per_window(self):
+    run = FakeRun()
+    logger = SystemMetricsLogger(run, log_every = 1, resolution = 0.1, collectors = [SequenceCollector([1, 2, 3, 4])])
+    for _ in range(4):
+      logger._sample()
+    logger.log()
+    self.assertEqual(run.logs, [({"x": 2.5, "x/min": 1, "x/max": 4, "x/p95": 4}, RunLog.LogType.SYSTEM)])
+
+    # nothing sampled, nothing logged
+    logger.log()
+    self.assertEqual(len(run.logs), 1)
+
+  def test_ring_buffer_keeps_the_latest(self):
+    run = FakeRun()
+    logger = SystemMetricsLogger(run, log_every = 1, resolution = 0.25, collectors = [SequenceCollector(range(20))])
+    self.assertEqual(logger.buffer_size, 8)
+    for _ in range(20):
+      logger._sample()
+    logger.log()
+    self.assertEqual(run.logs[0][0]["x/min"], 12)
+    self.assertEqual(run.logs[0][0]["x/max"], 19)
+
+  def test_slow_collector_and_failures(self):
+    class Failing(Collector):
+      def sample(self):
+        raise RuntimeError("no sensor")
+
+    run = FakeRun()
+    slow = SequenceCollector([1, 2, 3], every = 3600)
+    logger = SystemMetricsLogger(run, collectors = [slow, Failing()])
+    for _ in range(3):
+      logger._sample()
+    logger.log()
+    self.assertEqual(run.logs[0][0]["x"], 1) # sampled once in the hour
+
+  def test_completed_run_is_not_logged(self):
+    run = FakeRun()
+    run.completed = True
+    logger = SystemMetricsLogger(run, collectors = [SequenceCollector([1])])
+    logger._sample()
+    logger.log()
+    self.assertEqual(run.logs, [])
+
+  def test_rate_collector(self):
+    class Counter(_RateCollector):
+      def __init__(self):
+        super().__init__()
+        self.n = 0
+      def counters(self):
+        self.n += 100
+        return {"bytes": self.n}
+
+    c = Counter()
+    self.assertEqual(c.sample(), {}) # the first sample only sets the baseline
+    self.assertGreater(c.sample()["bytes"], 0)
+
+  def test_thread_logs_the_last_window_on_stop(self):
+    run = FakeRun()
+    logger = SystemMetricsLogger(run, log_every = 60, resolution = 0.01, collectors = [SequenceCollector([5.0] * 1000)])
+    logger.start()
+    time.sleep(0.1)
+    logger.stop()
+    self.assertEqual(len(run.logs), 1)
+    self.assertEqual(run.logs[0][0]["x"], 5.0)
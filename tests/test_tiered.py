@@ -0,0 +1,113 @@
+import gc
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+import subprocess
+from uuid import uuid4
+from unittest import mock
+
+import standin_backend
+
+import nbox.relics.tiered as tiered
+from nbox.relics.nbx import RelicsNBX
+from nbox.relics.tiered import TieredRelic
+
+
+def dead_pid() -> int:
+  p = subprocess.Popen([sys.executable, "-c", "pass"])
+  p.wait()
+  return p.pid
+
+
+class TieredRelicTest(unittest.TestCase):
+  def setUp(self):
+    self.home = tempfile.mkdtemp()
+    self.env = mock.patch.dict(os.environ, {"NBOX_HOME_DIR": self.home})
+    self.env.start()
+    self.relic_name = f"tiered_{uuid4().hex[:8]}"
+    self.remote = RelicsNBX(self.relic_name, create = True, cache = False)
+
+  def tearDown(self):
+    self.env.stop()
+    shutil.rmtree(self.home, ignore_errors = True)
+
+  def relic(self, policy: str = TieredRelic.WRITE_BACK) -> TieredRelic:
+    return TieredRelic(self.relic_name, policy = policy, local_dir = os.path.join(self.home, "tier"))
+
+  def write_dirty(self, relic: TieredRelic, key: str, value, owner: int):
+    """an entry as left behind by a process that did not upload it"""
+    def _write(tmp):
+      with open(tmp, "w") as f:
+        f.write(value)
+    meta = relic._store_local(key, _write, dirty = True)
+    meta["owner"] = owner
+    relic._write_meta(key, meta)
+    with relic._lock:
+      relic._written.discard(meta["key"])
+
+  def test_write_back_keeps_the_last_version(self):
+    relic = self.relic()
+    for i in range(20):
+      relic.put_object("x.pkl", i)
+    self.assertEqual(relic.get_object("x.pkl"), 19) # from the local tier
+    relic.flush()
+    self.assertEqual(self.remote.get_object("x.pkl"), 19)
+    self.assertFalse(relic._read_meta("x.pkl")["dirty"])
+    self.assertEqual(relic._written, set())
+
+  def test_write_through(self):
+    relic = self.relic(TieredRelic.WRITE_THROUGH)
+    relic.put_object("x.pkl", {"a": 1})
+    self.assertEqual(self.remote.get_object("x.pkl"), {"a": 1})
+    self.assertNotIn(relic, tiered._write_back_relics)
+
+  def test_flush_retries_failed_uploads(self):
+    relic = self.relic()
+    with mock.patch.object(relic.remote, "put_to", side_effect = ValueError("down")):
+      relic.put_object("x.pkl", 1)
+      with self.assertRaises(ValueError):
+        relic.flush()
+    self.assertTrue(relic._read_meta("x.pkl")["dirty"])
+    relic.flush()
+    self.assertEqual(self.remote.get_object("x.pkl"), 1)
+
+  def test_flush_uploads_orphans_of_dead_processes(self):
+    relic = self.relic()
+    self.write_dirty(relic, "orphan.txt", "left behind", dead_pid())
+    relic.flush()
+    self.assertTrue(self.remote.has("orphan.txt"))
+    self.assertFalse(relic._read_meta("orphan.txt")["dirty"])
+
+  def test_flush_skips_entries_of_live_processes(self):
+    relic = self.relic()
+    self.write_dirty(relic, "theirs.txt", "uploading", os.getppid())
+    relic.flush()
+    self.assertFalse(self.remote.has("theirs.txt"))
+    self.assertTrue(relic._read_meta("theirs.txt")["dirty"])
+
+  def test_flush_skips_keys_of_other_instances(self):
+    a, b = self.relic(), self.relic()
+    with mock.patch.object(a.remote, "put_to", side_effect = ValueError("down")):
+      a.put_object("x.pkl", 1)
+      with self.assertRaises(ValueError):
+        a.flush()
+    b.flush()
+    self.assertFalse(self.remote.has("x.pkl"))
+    a.flush()
+    self.assertTrue(self.remote.has("x.pkl"))
+
+  def test_instances_are_not_kept_alive_for_exit(self):
+    relic = self.relic()
+    self.assertIn(relic, tiered._write_back_relics)
+    relic.put_object("x.pkl", 1)
+    relic.flush()
+    n = len(tiered._write_back_relics)
+    del relic
+    gc.collect()
+    self.assertEqual(len(tiered._write_back_relics), n - 1)
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,193 @@
+import os
+import time
+import shutil
+import tempfile
+import unittest
+import threading
+from unittest import mock
+
+from nbox.observability.wal import RunLogWAL, WALUploader, OFFLINE_PREFIX
+from nbox.sublime.lmao_client import RunLog, Record, Run, Acknowledge, InitRunRequest
+from nbox.sublime._yql.common import message_to_b64
+
+
+class FakeStub:
+  def __init__(self, fail_after: int = None):
+    self.logs = []
+    self.ended = []
+    self.saved = []
+    self.fail_after = fail_after
+
+  def init_run(self, _InitRunRequest):
+    return Run(experiment_id = "real_id")
+
+  def on_log(self, _RunLog):
+    if self.fail_after is not None and len(self.logs) >= self.fail_after:
+      return None
+    self.logs.append((_RunLog.experiment_id, _RunLog.data[0].key))
+    return Acknowledge(success = True)
+
+  def on_train_end(self, _Run):
+    self.ended.append((_Run.experiment_id, _Run.status))
+    return Acknowledge(success = True)
+
+
+def run_log(key: str) -> RunLog:
+  return RunLog(experiment_id = "x", data = [Record(key = key, value_type = Record.DataType.FLOAT, float_data = [1.0])])
+
+
+class RunLogWALTest(unittest.TestCase):
+  def setUp(self):
+    self.home = tempfile.mkdtemp()
+    self._env = mock.patch.dict(os.environ, {"NBOX_HOME_DIR": self.home})
+    self._env.start()
+
+  def tearDown(self):
+    self._env.stop()
+    shutil.rmtree(self.home, ignore_errors = True)
+
+  def test_append_replay_offset(self):
+    wal = RunLogWAL("run_a", fsync = False)
+    self.assertTrue(wal.acquire())
+    for i in range(3):
+      wal.append(run_log(f"k{i}"))
+    self.assertGreater(wal.pending, 0)
+
+    stub = FakeStub(fail_after = 2)
+    self.assertFalse(wal.sync(stub))
+    self.assertEqual([x[1] for x in stub.logs], ["k0", "k1"])
+    self.assertGreater(wal.pending, 0)
+
+    # continues from the checkpoint
+    stub.fail_after = None
+    self.assertTrue(wal.sync(stub))
+    self.assertEqual([x[1] for x in stub.logs], ["k0", "k1", "k2"])
+    self.assertEqual(wal.pending, 0)
+    self.assertEqual(wal.size, 0)
+
+  def test_partial_tail_is_removed(self):
+    wal = RunLogWAL("run_b", fsync = False)
+    wal.acquire()
+    wal.append(run_log("k0"))
+    size = wal.size
+    wal.close()
+    with open(os.path.join(wal.folder, "wal.bin"), "ab") as f:
+      f.write(b"\x20\x01\x02") # length of 32 and only two bytes
+
+    wal = RunLogWAL("run_b", fsync = False)
+    self.assertTrue(wal.acquire())
+    self.assertEqual(wal.size, size)
+    stub = FakeStub()
+    self.assertTrue(wal.sync(stub))
+    self.assertEqual([x[1] for x in stub.logs], ["k0"])
+
+  def test_crash_between_checkpoint_and_truncate(self):
+    wal = RunLogWAL("run_c", fsync = False)
+    wal.acquire()
+    for i in range(3):
+      wal.append(run_log(f"k{i}"))
+    full = wal.size
+
+    # the process dies after the checkpoint and before the file is emptied
+    stub = FakeStub()
+    with mock.patch.object(wal._f, "truncate", side_effect = SystemExit):
+      with self.assertRaises(SystemExit):
+        wal.sync(stub)
+    self.assertEqual(wal.size, full)
+    self.assertEqual(wal.pending, 0)
+    wal.close()
+
+    wal = RunLogWAL("run_c", fsync = False)
+    self.assertTrue(wal.acquire())
+    self.assertEqual(wal.size, 0)
+    self.assertEqual(wal.offset, 0)
+    wal.append(run_log("k3"))
+    self.assertTrue(wal.sync(stub))
+    # nothing is sent twice and nothing is lost
+    self.assertEqual([x[1] for x in stub.logs], ["k0", "k1", "k2", "k3"])
+
+  def test_crash_after_truncate(self):
+    wal = RunLogWAL("run_d", fsync = False)
+    wal.acquire()
+    wal.append(run_log("k0"))
+    stub = FakeStub()
+    self.assertTrue(wal.sync(stub))
+    wal.close()
+
+    # the file was emptied but the process died before the checkpoint went back to a plain 0
+    wal = RunLogWAL("run_d", fsync = False)
+    wal._checkpoint(0, truncate_from = 100)
+    self.assertEqual(wal.offset, 0)
+    self.assertTrue(wal.acquire())
+    wal.append(run_log("k1"))
+    self.assertTrue(wal.sync(stub))
+    self.assertEqual([x[1] for x in stub.logs], ["k0", "k1"])
+
+  def test_offline_run_and_end(self):
+    init = InitRunRequest(project_id = "p")
+    wal = RunLogWAL(OFFLINE_PREFIX + "abc", {"init": message_to_b64(init)}, fsync = False)
+    wal.acquire()
+    wal.append(run_log("k0"))
+    wal.mark_ended(Run.Status.FAILED)
+    stub = FakeStub()
+    self.assertTrue(wal.sync(stub))
+    self.assertEqual(stub.logs, [("real_id", "k0")])
+    self.assertEqual(stub.ended, [("real_id", Run.Status.FAILED)])
+    self.assertTrue(wal.done)
+
+  def test_offline_files_wait_for_on_files(self):
+    calls = []
+    def on_files(wal, stub, names):
+      calls.append((wal.experiment_id, wal.meta["experiment_id"], names))
+      return True
+
+    wal = RunLogWAL(OFFLINE_PREFIX + "abc", {"init": message_to_b64(InitRunRequest(project_id = "p"))}, fsync = False, on_files = on_files)
+    wal.acquire()
+    wal.add_files(["a.txt", "b.txt"])
+    wal.mark_ended()
+    self.assertFalse(wal.done)
+    self.assertTrue(wal.sync(FakeStub()))
+    self.assertEqual(calls, [(OFFLINE_PREFIX + "abc", "real_id", ["a.txt", "b.txt"])])
+    self.assertEqual(wal.meta["files"], [])
+    self.assertTrue(wal.done)
+
+    # without a handler the files keep the WAL around
+    wal = RunLogWAL(OFFLINE_PREFIX + "def", fsync = False)
+    wal.acquire()
+    wal.add_files(["c.txt"])
+    self.assertFalse(wal.sync(FakeStub()))
+
+  def test_meta_default_is_not_shared(self):
+    a = RunLogWAL("run_e", fsync = False)
+    a.meta["username"] = "someone"
+    b = RunLogWAL("run_f", fsync = False)
+    self.assertEqual(b.meta["username"], "")
+
+
+class WALUploaderTest(unittest.TestCase):
+  def setUp(self):
+    self.home = tempfile.mkdtemp()
+    self._env = mock.patch.dict(os.environ, {"NBOX_HOME_DIR": self.home})
+    self._env.start()
+
+  def tearDown(self):
+    self._env.stop()
+    shutil.rmtree(self.home, ignore_errors = True)
+
+  def test_close_is_bound_by_timeout(self):
+    wal = RunLogWAL("run_g", fsync = False)
+    wal.acquire()
+    wal.append(run_log("k0"))
+    release = threading.Event()
+
+    class HangingStub(FakeStub):
+      def on_log(self, _RunLog):
+        release.wait(10)
+        return None
+
+    uploader = WALUploader(wal, HangingStub, every = 0.01)
+    time.sleep(0.1) # the thread is now stuck in a sync
+    st = time.monotonic()
+    self.assertFalse(uploader.close(timeout = 0.3))
+    self.assertLess(time.monotonic() - st, 2)
+    release.set()